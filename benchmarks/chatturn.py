@@ -0,0 +1,406 @@
+import argparse
+import imp
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy
+from webob import Request
+
+from sqliteadapter import create_database, connect, round_trips
+from stubserver import StackExchangeStub, load_recording
+
+"""
+This file contains the benchmark of a full chat turn: a question is asked (```handle_user_input```), and the
+answer is polled for (```get_answer_result```) until it is ready, as done by the JavaScript of the XBlock.
+
+The benchmark runs without network access and without a MySQL server: StackExchange is replaced by a local
+HTTP server replaying recorded responses (see stubserver.py), and MySQL by an SQLite file with the same
+interface (see sqliteadapter.py), given to the connection pool through the config file. The rest of the chat
+agent (connection pool, caches, rate limiter, background jobs and logging) is used as it is.
+
+The handlers of ```ChatAgentXBlock``` are called through the XBlock runtime, by ```concurrency``` simulated
+users asking the recorded questions. The XBlock workbench runtime (xblock-sdk) is used if it is installed,
+otherwise the test runtime of XBlock. The benchmark reports:
+    - the latency of the turns (p50, p95 and p99) and the throughput (turns per second)
+    - the number of round-trips to the database and requests to the StackExchange API per turn
+    - the mean time of each stage of the turn (with --instrument, see instrumentation.py)
+The results can be saved, and compared against a saved baseline:
+    python chatturn.py --turns 200 --concurrency 8 --save baseline.json
+    python chatturn.py --turns 200 --concurrency 8 --compare baseline.json
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+_PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_CONFIG_EXAMPLE = os.path.join(_PACKAGE_ROOT, "chatagent", "dbconfig.py.example")
+_DEFAULT_RECORDING = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings", "sample.json")
+
+
+def create_config(database_path=str, api_root=str, work_dir=str, arguments=argparse.Namespace):
+    """
+    Creates the config file (module) used by the chat agent, based on 'dbconfig.py.example'. The module
+    is registered as ```chatagent.dbconfig```, so it must be created before the chat agent is imported.
+
+    Arguments:
+        database_path (str): Path to the SQLite file used instead of MySQL
+        api_root (str): The root URL of the StackExchange stub
+        work_dir (str): Directory for the other local files (e.g. the document frequencies)
+        arguments (argparse.Namespace): The arguments of the benchmark
+
+    Returns:
+        module: The config
+
+    """
+    config = imp.new_module("chatagent.dbconfig")
+    execfile(_CONFIG_EXAMPLE, config.__dict__)
+    config.mysql_parameters = {'host': "", 'user': "", 'passwd': "", 'db': database_path}
+    config.pool_parameters = dict(config.pool_parameters, pool_size=arguments.pool_size, connect_function=connect)
+    config.stackexchange_parameters = dict(config.stackexchange_parameters, api_root=api_root)
+    config.question_ranking_parameters = dict(config.question_ranking_parameters,
+                                              sqlite_path=os.path.join(work_dir, "question_df.sqlite"))
+    config.local_index_parameters = {'index_path': None}
+    # the quota of the stub is not limited, but the requests per second are (as by the API)
+    config.rate_limit_parameters = dict(config.rate_limit_parameters, daily_quota=10 ** 9, pacing_threshold=0,
+                                        requests_per_second=arguments.api_rps)
+    config.instrumentation_parameters = dict(getattr(config, 'instrumentation_parameters', dict()),
+                                             enabled=arguments.instrument)
+    # the questions are not refreshed in the background, so that the turns are measured as they are
+    config.cache_warming_parameters = dict(getattr(config, 'cache_warming_parameters', dict()), enabled=False)
+    if arguments.cold:
+        # every question is searched for: no cached search results, and no answers to near-duplicates
+        config.cache_parameters = dict(config.cache_parameters, backend='memory', ttl=-1)
+        config.duplicate_question_parameters = dict(config.duplicate_question_parameters, enabled=False)
+    sys.modules["chatagent.dbconfig"] = config
+    return config
+
+
+def create_runtime(runtime_name=str):
+    """
+    Creates the XBlock runtime the handlers are called through
+
+    Arguments:
+        runtime_name (str): 'workbench' (xblock-sdk), 'test' (XBlock) or 'auto' (workbench, if installed)
+
+    Returns:
+        xblock.runtime.Runtime: The runtime
+
+    """
+    if runtime_name in ("workbench", "auto"):
+        try:
+            os.environ.setdefault("DJANGO_SETTINGS_MODULE", "workbench.settings")
+            import django
+            if hasattr(django, "setup"):
+                django.setup()
+            from workbench.runtime import WorkbenchRuntime
+            return WorkbenchRuntime("benchmark")
+        except ImportError:
+            if runtime_name == "workbench":
+                raise
+    from xblock.runtime import DictKeyValueStore, KvsFieldData
+    from xblock.test.tools import TestRuntime
+    return TestRuntime(services={'field-data': KvsFieldData(DictKeyValueStore())})
+
+
+class SimulatedUser(object):
+    """
+    A user of the chat agent, asking questions through the handlers of the XBlock
+    """
+
+    def __init__(self, block=object, poll_interval=float):
+        """
+        Constructor for the simulated user
+
+        Arguments:
+            block (ChatAgentXBlock): The XBlock (of this user)
+            poll_interval (float): Seconds between each poll for the answer
+
+        """
+        self.__block = block
+        self.__poll_interval = poll_interval
+
+    def start_session(self):
+        """
+        Retrieves the username, as done when the chat is opened (stores the user in the database)
+        """
+        self.__call_handler("get_username", {})
+
+    def ask(self, question=str):
+        """
+        Asks the question, and polls for the answer until it is ready
+
+        Arguments:
+            question (str): The question
+
+        Returns:
+            dict: The result of ```get_answer_result```
+
+        """
+        job = self.__call_handler("handle_user_input", {'user_input': question})
+        while True:
+            result = self.__call_handler("get_answer_result", {'job_id': job['job_id']})
+            if result['status'] != "pending":
+                return result
+            time.sleep(self.__poll_interval)
+
+    def __call_handler(self, handler_name=str, data=dict):
+        """
+        Calls the JSON handler of the XBlock through the runtime, as the JavaScript of the XBlock does
+        """
+        request = Request.blank("/", method="POST", body=json.dumps(data))
+        response = self.__block.handle(handler_name, request)
+        return json.loads(response.body)
+
+
+class LocalEnvironment(object):
+    """
+    The chat agent running in this process, with the local stand-ins for StackExchange and MySQL
+    """
+
+    def __init__(self, recording=dict, arguments=argparse.Namespace):
+        """
+        Constructor for the environment. The stand-ins are started with ```start```.
+
+        Arguments:
+            recording (dict): The recorded StackExchange responses (see stubserver.py)
+            arguments (argparse.Namespace): The arguments of the benchmark (see ```add_environment_arguments```)
+
+        """
+        self.__arguments = arguments
+        self.__stub = StackExchangeStub(recording, arguments.api_latency / 1000.0)
+        self.__work_dir = None
+        self.__runtime = None
+        self.__block_class = None
+
+    def start(self):
+        """
+        Starts the StackExchange stub, creates the SQLite database and the config file,
+        and imports the chat agent (which therefore must not be imported before this is called)
+        """
+        self.__work_dir = tempfile.mkdtemp(prefix="chatagent_benchmark_")
+        api_root = self.__stub.start()
+        database_path = os.path.join(self.__work_dir, "chatagent.sqlite")
+        sys.path.insert(0, _PACKAGE_ROOT)
+        create_config(database_path, api_root, self.__work_dir, self.__arguments)
+        from chatagent import ChatAgentXBlock
+        from chatagent.schemamigration import MIGRATIONS
+        create_database(database_path, [(version, description) for version, description, statements in MIGRATIONS])
+        self.__block_class = ChatAgentXBlock
+        self.__runtime = create_runtime(self.__arguments.runtime)
+
+    def stop(self):
+        """
+        Stops the StackExchange stub, and removes the local files
+        """
+        self.__stub.stop()
+        if self.__work_dir is not None:
+            shutil.rmtree(self.__work_dir, ignore_errors=True)
+
+    def create_block(self, user_id=str):
+        """
+        Creates the XBlock as seen by the given user
+
+        Arguments:
+            user_id (str): The ID of the user
+
+        Returns:
+            ChatAgentXBlock: The XBlock
+
+        """
+        from xblock.fields import ScopeIds
+        scope_ids = ScopeIds(user_id, "chatagent", "chatagent-definition", "chatagent-usage")
+        return self.__runtime.construct_xblock_from_class(self.__block_class, scope_ids)
+
+    def get_runtime_name(self):
+        return self.__runtime.__class__.__name__
+
+    def get_api_request_count(self):
+        """
+        Returns:
+            int: The number of requests made to the StackExchange stub
+
+        """
+        return self.__stub.get_request_count()
+
+
+def run_benchmark(arguments=argparse.Namespace):
+    """
+    Runs the benchmark
+
+    Arguments:
+        arguments (argparse.Namespace): The arguments of the benchmark (see ```parse_arguments```)
+
+    Returns:
+        dict: The results
+
+    """
+    recording = load_recording(arguments.recording)
+    questions = recording['questions']
+    environment = LocalEnvironment(recording, arguments)
+    try:
+        environment.start()
+        from chatagent.instrumentation import get_metrics
+        from chatagent.interactionlog import get_interaction_logger
+
+        users = [SimulatedUser(environment.create_block("user%d" % user_number), arguments.poll_interval)
+                 for user_number in range(0, arguments.concurrency)]
+        for user in users:
+            user.start_session()
+        for turn in range(0, arguments.warmup):
+            users[turn % len(users)].ask(questions[turn % len(questions)])
+        get_interaction_logger().flush()
+
+        latencies = list()
+        errors = [0]
+        lock = threading.Lock()
+        next_turn = [0]
+
+        def run_user(user=SimulatedUser):
+            while True:
+                with lock:
+                    turn = next_turn[0]
+                    next_turn[0] += 1
+                if turn >= arguments.turns:
+                    return
+                question = questions[(turn + arguments.warmup) % len(questions)]
+                start_time = time.time()
+                result = user.ask(question)
+                latency = time.time() - start_time
+                with lock:
+                    latencies.append(latency)
+                    if result.get('response', "").startswith("An error occurred"):
+                        errors[0] += 1
+
+        round_trips.reset()
+        get_metrics().reset()
+        api_requests = environment.get_api_request_count()
+        threads = [threading.Thread(target=run_user, args=(user,)) for user in users]
+        start_time = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed_time = time.time() - start_time
+        # the interactions are written in the background, and are part of the turns
+        get_interaction_logger().flush()
+        api_requests = environment.get_api_request_count() - api_requests
+        stage_timers = get_metrics().get_snapshot()['timers']
+    finally:
+        environment.stop()
+
+    latencies_ms = numpy.array(latencies) * 1000.0
+    return {
+        'turns': arguments.turns,
+        'concurrency': arguments.concurrency,
+        'cold': arguments.cold,
+        'api_latency_ms': arguments.api_latency,
+        'runtime': environment.get_runtime_name(),
+        'errors': errors[0],
+        'latency_ms': {
+            'p50': float(numpy.percentile(latencies_ms, 50)),
+            'p95': float(numpy.percentile(latencies_ms, 95)),
+            'p99': float(numpy.percentile(latencies_ms, 99)),
+            'mean': float(latencies_ms.mean()),
+            'max': float(latencies_ms.max())
+        },
+        'throughput': arguments.turns / elapsed_time,
+        'db_round_trips_per_turn': round_trips.get_count() / float(arguments.turns),
+        'api_requests_per_turn': api_requests / float(arguments.turns),
+        # the mean time of each stage (only if the instrumentation is enabled, see instrumentation.py)
+        'stages_ms': dict((stage, timer['mean'] * 1000.0) for stage, timer in stage_timers.items())
+    }
+
+
+_REPORTED_VALUES = [
+    ("Latency p50 (ms)", lambda results: results['latency_ms']['p50']),
+    ("Latency p95 (ms)", lambda results: results['latency_ms']['p95']),
+    ("Latency p99 (ms)", lambda results: results['latency_ms']['p99']),
+    ("Throughput (turns/s)", lambda results: results['throughput']),
+    ("DB round-trips per turn", lambda results: results['db_round_trips_per_turn']),
+    ("API requests per turn", lambda results: results['api_requests_per_turn']),
+]
+"""
+The values shown in the report (name, function returning the value from the results)
+"""
+
+
+def print_report(results=dict, baseline=None):
+    """
+    Prints the results, and the change compared to the baseline (if given)
+
+    Arguments:
+        results (dict): The results (see ```run_benchmark```)
+        baseline (dict): The results of an earlier run || None
+
+    """
+    print("Turns: %d, concurrency: %d, cold: %s, API latency: %d ms, runtime: %s, errors: %d" % (
+        results['turns'], results['concurrency'], results['cold'], results['api_latency_ms'], results['runtime'],
+        results['errors']))
+    for name, get_value in _REPORTED_VALUES:
+        line = "%-26s %10.2f" % (name, get_value(results))
+        if baseline is not None:
+            baseline_value = get_value(baseline)
+            change = (get_value(results) - baseline_value) / baseline_value * 100.0 if baseline_value else 0.0
+            line += "   baseline: %10.2f (%+.1f%%)" % (baseline_value, change)
+        print(line)
+    for stage, mean_time in sorted(results.get('stages_ms', dict()).items()):
+        print("  stage %-19s %10.2f ms (mean)" % (stage, mean_time))
+
+
+def add_environment_arguments(parser=argparse.ArgumentParser):
+    """
+    Adds the arguments of the local environment (see ```LocalEnvironment``` and ```create_config```)
+
+    Arguments:
+        parser (argparse.ArgumentParser): The parser to add the arguments to
+
+    """
+    parser.add_argument("--cold", action="store_true",
+                        help="disable the search cache and the answers to near-duplicate questions")
+    parser.add_argument("--api-latency", type=int, default=0, help="milliseconds each API request is delayed")
+    parser.add_argument("--api-rps", type=int, default=30, help="maximum API requests per second")
+    parser.add_argument("--pool-size", type=int, default=10, help="maximum number of database connections")
+    parser.add_argument("--instrument", action="store_true",
+                        help="enable the instrumentation, and report the mean time of each stage")
+    parser.add_argument("--runtime", choices=["auto", "workbench", "test"], default="auto",
+                        help="XBlock runtime (auto: workbench, if installed)")
+    parser.add_argument("--recording", default=_DEFAULT_RECORDING, help="recorded StackExchange responses")
+
+
+def parse_arguments(argument_list=list):
+    """
+    Parses the arguments of the benchmark
+
+    Arguments:
+        argument_list (list): The arguments (e.g. ```sys.argv[1:]```)
+
+    Returns:
+        argparse.Namespace: The arguments
+
+    """
+    parser = argparse.ArgumentParser(description="Benchmark of a full chat turn, using local stand-ins for "
+                                                 "StackExchange and MySQL")
+    parser.add_argument("--turns", type=int, default=100, help="number of questions asked (measured)")
+    parser.add_argument("--concurrency", type=int, default=4, help="number of users asking at the same time")
+    parser.add_argument("--warmup", type=int, default=0, help="number of questions asked before measuring")
+    parser.add_argument("--poll-interval", type=float, default=0.01, help="seconds between each poll for the answer")
+    add_environment_arguments(parser)
+    parser.add_argument("--save", help="save the results (JSON) to this file")
+    parser.add_argument("--compare", help="compare the results with a saved baseline (JSON)")
+    return parser.parse_args(argument_list)
+
+if __name__ == "__main__":
+    benchmark_arguments = parse_arguments(sys.argv[1:])
+    benchmark_results = run_benchmark(benchmark_arguments)
+    benchmark_baseline = None
+    if benchmark_arguments.compare:
+        with open(benchmark_arguments.compare) as baseline_file:
+            benchmark_baseline = json.load(baseline_file)
+    print_report(benchmark_results, benchmark_baseline)
+    if benchmark_arguments.save:
+        with open(benchmark_arguments.save, "w") as results_file:
+            json.dump(benchmark_results, results_file, indent=2, sort_keys=True)
@@ -0,0 +1,561 @@
+import argparse
+import csv
+import json
+import random
+import re
+import sys
+import threading
+import time
+
+import numpy
+import requests
+
+from chatturn import LocalEnvironment, add_environment_arguments
+from stubserver import load_recording
+
+"""
+This file contains the load test of the chat agent: a classroom of synthetic students using the chat at
+the same time, to find the number of students where the throughput stops increasing (or collapses).
+
+Each student calls the handlers of the XBlock in the same sequence as the JavaScript of the XBlock
+(chatagent.js): 'get_username' and 'get_default_welcome_message' when the chat is opened, and then, for each
+question, 'handle_user_input' followed by polling 'get_answer_result' (with the same intervals as the
+JavaScript), and sometimes 'show_or_hide_answer_text' (read more). The students wait between the questions
+(think time), and the questions are drawn from a question corpus.
+
+The number of students is increased in steps (e.g. --levels 10,50,100,200). At each step, the new students
+are started over the ramp-up time, and the step is then measured for the step duration. For each step, the
+saturation curve contains the throughput, the latency of the turns (p50, p95, p99), the outcome of the turns
+(answered, timed out, throttled by the rate limiter, failed), and the server counters showing why the
+throughput stops increasing (database connection pool exhausted, StackExchange API throttled; the
+instrumentation of the chat agent must be enabled, see instrumentation.py).
+
+The load is generated against either:
+    - the workbench server (xblock-sdk), e.g. --target http://localhost:8000 (the usage ID of the XBlock is
+      found in the scenario page, or given with --usage-id)
+    - the chat agent in this process, with the local stand-ins for StackExchange and MySQL (--target local,
+      see chatturn.py), where the connection pool and the API limits can be changed (--pool-size, --api-rps)
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+_POLL_INTERVAL = 0.25
+_MAX_POLL_INTERVAL = 2.0
+_MAX_POLL_TIME = 60.0
+"""
+The polling for the answer, as in chatagent.js (seconds)
+"""
+
+_THROTTLED_MESSAGES = ("The request limit of the StackExchange API has been reached",
+                       "The StackExchange API has asked to wait")
+"""
+The responses given when the request to StackExchange was not allowed by the rate limiter (see ratelimiter.py)
+"""
+
+
+class HandlerError(Exception):
+    """
+    Raised when a handler of the XBlock could not be called (e.g. HTTP error)
+    """
+
+
+class HttpTarget(object):
+    """
+    The chat agent running in the workbench server (xblock-sdk)
+    """
+
+    def __init__(self, base_url=str, usage_id=None, scenario="chatagent.0", timeout=60, metrics_token=None):
+        """
+        Constructor for the target
+
+        Arguments:
+            base_url (str): The URL of the workbench server, e.g. 'http://localhost:8000'
+            usage_id (str): The usage ID of the XBlock (None: found in the scenario page)
+            scenario (str): The workbench scenario containing the XBlock
+            timeout (float): Seconds to wait for a response
+            metrics_token (str): The access token of the metrics (see ```instrumentation_parameters```)
+
+        """
+        self.__base_url = base_url.rstrip("/")
+        self.__usage_id = usage_id
+        self.__scenario = scenario
+        self.__timeout = timeout
+        self.__metrics_token = metrics_token
+
+    def start(self):
+        """
+        Finds the usage ID of the XBlock in the scenario page (if not given)
+
+        Raises:
+            HandlerError: If the usage ID could not be found
+
+        """
+        if self.__usage_id is not None:
+            return
+        try:
+            page = requests.get(self.__base_url + "/scenario/" + self.__scenario + "/", timeout=self.__timeout).text
+        except requests.RequestException, err:
+            raise HandlerError("The scenario page could not be retrieved: " + str(err))
+        for tag in re.findall(r'<[^>]*data-block-type="chatagent"[^>]*>', page):
+            usage = re.search(r'data-usage="([^"]+)"', tag)
+            if usage is not None:
+                self.__usage_id = usage.group(1)
+                return
+        raise HandlerError("The chat agent was not found in the scenario '%s' (use --usage-id)" % self.__scenario)
+
+    def stop(self):
+        pass
+
+    def create_client(self, student_id=str):
+        """
+        Returns the function calling the handlers of the XBlock as the given student
+
+        Arguments:
+            student_id (str): The ID of the student
+
+        Returns:
+            function: function(handler name, data) returning the JSON response of the handler
+
+        """
+        session = requests.Session()
+
+        def call_handler(handler_name=str, data=None):
+            url = "%s/handler/%s/%s/?student=%s" % (self.__base_url, self.__usage_id, handler_name, student_id)
+            try:
+                response = session.post(url, data=json.dumps(data), timeout=self.__timeout)
+                response.raise_for_status()
+                return response.json()
+            except (requests.RequestException, ValueError), err:
+                raise HandlerError(str(err))
+        return call_handler
+
+    def get_metrics(self):
+        """
+        Returns:
+            dict: The metrics of the chat agent (see ```Metrics.get_snapshot```) || None
+
+        """
+        try:
+            return self.create_client("loadtest-monitor")("get_metrics", {'token': self.__metrics_token})
+        except HandlerError:
+            return None
+
+
+class LocalTarget(object):
+    """
+    The chat agent running in this process, with the local stand-ins (see ```chatturn.LocalEnvironment```)
+    """
+
+    def __init__(self, recording=dict, arguments=argparse.Namespace):
+        """
+        Constructor for the target
+
+        Arguments:
+            recording (dict): The recorded StackExchange responses
+            arguments (argparse.Namespace): The arguments of the local environment
+
+        """
+        # the server counters are needed to tell why the throughput stops increasing
+        arguments.instrument = True
+        self.__environment = LocalEnvironment(recording, arguments)
+        self.__lock = threading.Lock()
+
+    def start(self):
+        self.__environment.start()
+
+    def stop(self):
+        self.__environment.stop()
+
+    def create_client(self, student_id=str):
+        """
+        Returns the function calling the handlers of the XBlock as the given student
+
+        Arguments:
+            student_id (str): The ID of the student
+
+        Returns:
+            function: function(handler name, data) returning the JSON response of the handler
+
+        """
+        from webob import Request
+        with self.__lock:
+            block = self.__environment.create_block(student_id)
+
+        def call_handler(handler_name=str, data=None):
+            request = Request.blank("/", method="POST", body=json.dumps(data))
+            response = block.handle(handler_name, request)
+            if response.status_code != 200:
+                raise HandlerError(response.status)
+            return json.loads(response.body)
+        return call_handler
+
+    def get_metrics(self):
+        from chatagent.instrumentation import get_metrics
+        return get_metrics().get_snapshot()
+
+
+def create_think_time(specification=str):
+    """
+    Creates the distribution of the think time (the time a student waits before asking the next question)
+
+    Arguments:
+        specification (str): 'constant:<seconds>', 'uniform:<min>,<max>' or 'exponential:<mean>'
+
+    Returns:
+        function: function(random.Random) returning the think time (seconds)
+
+    Raises:
+        ValueError: If the specification is not valid
+
+    """
+    name, _, values = specification.partition(":")
+    try:
+        values = [float(value) for value in values.split(",")] if values else list()
+    except ValueError:
+        raise ValueError("Invalid think time: " + specification)
+    if name == "constant" and len(values) == 1:
+        return lambda generator: values[0]
+    if name == "uniform" and len(values) == 2:
+        return lambda generator: generator.uniform(values[0], values[1])
+    if name == "exponential" and len(values) == 1:
+        return lambda generator: generator.expovariate(1.0 / values[0]) if values[0] > 0 else 0.0
+    raise ValueError("Invalid think time: " + specification)
+
+
+class SyntheticStudent(object):
+    """
+    A student using the chat: opens the chat, and asks questions (with think time between them) until stopped
+    """
+
+    ANSWERED = "answered"
+    TIMED_OUT = "timed_out"
+    THROTTLED = "throttled"
+    FAILED = "failed"
+    """
+    The outcomes of a turn
+    """
+
+    def __init__(self, call_handler=object, questions=list, think_time=object, read_more_probability=float,
+                 seed=int, results=list, stop_event=threading.Event):
+        """
+        Constructor for the student
+
+        Arguments:
+            call_handler (function): Function calling the handlers of the XBlock (see ```create_client```)
+            questions (list): The question corpus
+            think_time (function): The distribution of the think time (see ```create_think_time```)
+            read_more_probability (float): The probability of clicking 'read more' after an answer
+            seed (int): Seed for the random choices of the student
+            results (list): The list the turns are added to, as (finish time, latency, outcome)
+            stop_event (threading.Event): Set when the student should stop
+
+        """
+        self.__call_handler = call_handler
+        self.__questions = questions
+        self.__think_time = think_time
+        self.__read_more_probability = read_more_probability
+        self.__random = random.Random(seed)
+        self.__results = results
+        self.__stop_event = stop_event
+
+    def run(self):
+        """
+        Opens the chat, and asks questions until stopped
+        """
+        try:
+            username = self.__call_handler("get_username", None)['username']
+            self.__call_handler("get_default_welcome_message", {'username': username})
+        except HandlerError:
+            self.__results.append((time.time(), 0.0, self.FAILED))
+            return
+        while not self.__stop_event.is_set():
+            self.__stop_event.wait(self.__think_time(self.__random))
+            if self.__stop_event.is_set():
+                return
+            start_time = time.time()
+            outcome, result = self.__ask(self.__random.choice(self.__questions))
+            self.__results.append((time.time(), time.time() - start_time, outcome))
+            if outcome == self.ANSWERED and self.__random.random() < self.__read_more_probability:
+                self.__read_more(result)
+
+    def __ask(self, question=str):
+        """
+        Asks the question, and polls for the answer as done by chatagent.js
+
+        Returns:
+            tuple: (outcome, result of 'get_answer_result' || None)
+
+        """
+        try:
+            job = self.__call_handler("handle_user_input", {'user_input': question})
+            interval = _POLL_INTERVAL
+            elapsed = 0.0
+            while True:
+                time.sleep(interval)
+                result = self.__call_handler("get_answer_result", {'job_id': job['job_id']})
+                if result['status'] != "pending":
+                    break
+                if elapsed + interval >= _MAX_POLL_TIME:
+                    return self.TIMED_OUT, None
+                elapsed += interval
+                interval = min(interval * 2, _MAX_POLL_INTERVAL)
+        except HandlerError:
+            return self.FAILED, None
+        response = result.get('response', "")
+        if response.startswith(_THROTTLED_MESSAGES):
+            return self.THROTTLED, result
+        if response.startswith("An error occurred"):
+            return self.FAILED, result
+        return self.ANSWERED, result
+
+    def __read_more(self, result=dict):
+        """
+        Clicks 'read more' (if the answer has it), as done by chatagent.js
+        """
+        index = re.search(r"value='(\d+)'", result.get('read_more', ""))
+        if index is None:
+            return
+        try:
+            self.__call_handler("show_or_hide_answer_text", {'index': index.group(1), 'read_more': True})
+        except HandlerError:
+            pass
+
+
+_SERVER_COUNTERS = [
+    ('api_requests', "api_requests"),
+    ('api_throttled', "api_throttled"),
+    ('db_pool_exhausted', "db_pool_exhausted"),
+    ('db_statements', "db_statements"),
+]
+"""
+The counters of the chat agent in the saturation curve (column, counter), see instrumentation.py
+"""
+
+
+def _get_counter_totals(snapshot=None):
+    """
+    Returns the value of each counter (summed over the labels) || None if the metrics are not available
+    """
+    if snapshot is None or not snapshot.get('enabled'):
+        return None
+    totals = dict()
+    for counter in snapshot['counters']:
+        totals[counter['name']] = totals.get(counter['name'], 0) + counter['value']
+    return totals
+
+
+def _create_level_row(students=int, turns=list, duration=float, counters_before=None, counters_after=None):
+    """
+    Creates the row of the saturation curve for one step
+
+    Arguments:
+        students (int): The number of students
+        turns (list): The turns finished during the step: (finish time, latency, outcome)
+        duration (float): Seconds the step was measured
+        counters_before (dict): The server counters at the start of the step || None
+        counters_after (dict): The server counters at the end of the step || None
+
+    Returns:
+        dict: The row
+
+    """
+    latencies_ms = numpy.array([latency for finish_time, latency, outcome in turns
+                                if outcome == SyntheticStudent.ANSWERED]) * 1000.0
+    row = {'students': students, 'turns': len(turns), 'throughput': len(turns) / duration}
+    answered = len(latencies_ms)
+    row['answered_per_second'] = answered / duration
+    for percentile in (50, 95, 99):
+        row['p%d_ms' % percentile] = float(numpy.percentile(latencies_ms, percentile)) if answered else None
+    for outcome in (SyntheticStudent.ANSWERED, SyntheticStudent.TIMED_OUT, SyntheticStudent.THROTTLED,
+                    SyntheticStudent.FAILED):
+        row[outcome] = len([turn for turn in turns if turn[2] == outcome])
+    row['error_rate'] = (len(turns) - answered) / float(len(turns)) if turns else 0.0
+    for column, counter in _SERVER_COUNTERS:
+        if counters_before is None or counters_after is None:
+            row[column] = None
+        else:
+            row[column] = counters_after.get(counter, 0) - counters_before.get(counter, 0)
+    return row
+
+
+def find_saturation(rows=list, minimum_scaling=float, maximum_error_rate=float):
+    """
+    Finds the step where the throughput stops increasing with the number of students: the first step where
+    the number of answered questions per second increased by less than ```minimum_scaling``` of the increase
+    in students (e.g. 0.5: twice the students must give at least 1.5 times the throughput), or where the
+    error rate is above ```maximum_error_rate```.
+
+    Arguments:
+        rows (list): The saturation curve (see ```_create_level_row```)
+        minimum_scaling (float): The minimum increase of the throughput, relative to the increase in students
+        maximum_error_rate (float): The maximum share of turns that were not answered, e.g. 0.05
+
+    Returns:
+        tuple: (the row of the saturated step, the likely causes (list of str)) || None
+
+    """
+    for previous_row, row in zip([None] + rows[:-1], rows):
+        saturated = row['error_rate'] > maximum_error_rate
+        if previous_row is not None and previous_row['answered_per_second'] > 0 \
+                and row['students'] > previous_row['students']:
+            gain = row['answered_per_second'] / previous_row['answered_per_second'] - 1
+            expected_gain = float(row['students']) / previous_row['students'] - 1
+            saturated = saturated or gain < minimum_scaling * expected_gain
+        if not saturated:
+            continue
+        causes = list()
+        if row['db_pool_exhausted']:
+            causes.append("database connection pool exhausted (%d checkouts timed out)" % row['db_pool_exhausted'])
+        if row['api_throttled'] or row[SyntheticStudent.THROTTLED]:
+            causes.append("StackExchange API throttled by the rate limiter (%d turns)" % row[SyntheticStudent.THROTTLED])
+        if row[SyntheticStudent.TIMED_OUT]:
+            causes.append("answers not ready within %d seconds (%d turns)" % (_MAX_POLL_TIME,
+                                                                               row[SyntheticStudent.TIMED_OUT]))
+        if row[SyntheticStudent.FAILED]:
+            causes.append("failed requests or errors (%d turns)" % row[SyntheticStudent.FAILED])
+        if len(causes) == 0:
+            causes.append("no errors: the server is at its capacity (see the latency)")
+        return row, causes
+    return None
+
+
+def run_load_test(target=object, questions=list, arguments=argparse.Namespace):
+    """
+    Runs the load test: the students are added in steps, and each step is measured
+
+    Arguments:
+        target (HttpTarget || LocalTarget): The chat agent
+        questions (list): The question corpus
+        arguments (argparse.Namespace): The arguments of the load test (see ```parse_arguments```)
+
+    Returns:
+        list: The saturation curve (one row per step)
+
+    """
+    think_time = create_think_time(arguments.think_time)
+    results = list()
+    stop_event = threading.Event()
+    threads = list()
+    rows = list()
+    try:
+        for students in arguments.levels:
+            new_students = max(students - len(threads), 0)
+            for student_number in range(len(threads), len(threads) + new_students):
+                student = SyntheticStudent(target.create_client("student%d" % student_number), questions,
+                                           think_time, arguments.read_more, arguments.seed + student_number,
+                                           results, stop_event)
+                thread = threading.Thread(target=student.run, name="student%d" % student_number)
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+                time.sleep(arguments.ramp_up / float(new_students))
+            counters_before = _get_counter_totals(target.get_metrics())
+            start_time = time.time()
+            time.sleep(arguments.step_duration)
+            end_time = time.time()
+            counters_after = _get_counter_totals(target.get_metrics())
+            turns = [turn for turn in list(results) if start_time <= turn[0] < end_time]
+            row = _create_level_row(len(threads), turns, end_time - start_time, counters_before, counters_after)
+            rows.append(row)
+            print_row(row)
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join(_MAX_POLL_TIME)
+    return rows
+
+
+_COLUMNS = ['students', 'turns', 'throughput', 'answered_per_second', 'p50_ms', 'p95_ms', 'p99_ms',
+            SyntheticStudent.ANSWERED, SyntheticStudent.TIMED_OUT, SyntheticStudent.THROTTLED,
+            SyntheticStudent.FAILED, 'error_rate'] + [column for column, counter in _SERVER_COUNTERS]
+"""
+The columns of the saturation curve (CSV)
+"""
+
+
+def print_row(row=dict):
+    """
+    Prints the row of the saturation curve
+    """
+    def format_value(value):
+        return "-" if value is None else ("%.1f" % value if isinstance(value, float) else str(value))
+    print("students=%s answered/s=%s p50=%s p95=%s p99=%s ms timed_out=%s throttled=%s failed=%s "
+          "pool_exhausted=%s api_throttled=%s" % tuple(format_value(row[column]) for column in (
+              'students', 'answered_per_second', 'p50_ms', 'p95_ms', 'p99_ms', SyntheticStudent.TIMED_OUT,
+              SyntheticStudent.THROTTLED, SyntheticStudent.FAILED, 'db_pool_exhausted', 'api_throttled')))
+
+
+def save_curve(rows=list, path=str):
+    """
+    Writes the saturation curve to a CSV file (one row per step)
+    """
+    with open(path, "wb") as curve_file:
+        writer = csv.DictWriter(curve_file, _COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict((column, "" if row[column] is None else row[column]) for column in _COLUMNS))
+
+
+def parse_arguments(argument_list=list):
+    """
+    Parses the arguments of the load test
+
+    Arguments:
+        argument_list (list): The arguments (e.g. ```sys.argv[1:]```)
+
+    Returns:
+        argparse.Namespace: The arguments
+
+    """
+    parser = argparse.ArgumentParser(description="Load test simulating a classroom of students using the chat agent")
+    parser.add_argument("--target", default="local",
+                        help="'local' (this process, with local stand-ins) or the URL of the workbench server")
+    parser.add_argument("--usage-id", help="usage ID of the XBlock in the workbench (default: found in the scenario)")
+    parser.add_argument("--scenario", default="chatagent.0", help="workbench scenario containing the XBlock")
+    parser.add_argument("--metrics-token", help="access token of the metrics handler (access_token in the config file)")
+    parser.add_argument("--levels", type=lambda value: [int(level) for level in value.split(",")],
+                        default=[5, 10, 25, 50, 100], help="number of students in each step, e.g. 10,50,100")
+    parser.add_argument("--step-duration", type=float, default=30.0, help="seconds each step is measured")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="seconds the new students of a step are started over")
+    parser.add_argument("--think-time", default="exponential:5",
+                        help="time between questions: constant:<s>, uniform:<min>,<max> or exponential:<mean>")
+    parser.add_argument("--read-more", type=float, default=0.3, help="probability of clicking 'read more'")
+    parser.add_argument("--questions", help="question corpus (one question per line; default: the recording)")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the random choices of the students")
+    parser.add_argument("--minimum-scaling", type=float, default=0.5,
+                        help="saturated when the throughput increases by less than this share of the increase in "
+                             "students")
+    parser.add_argument("--maximum-error-rate", type=float, default=0.05,
+                        help="saturated when more than this share of the questions is not answered")
+    parser.add_argument("--output", help="save the saturation curve (CSV) to this file")
+    add_environment_arguments(parser)
+    return parser.parse_args(argument_list)
+
+
+if __name__ == "__main__":
+    load_test_arguments = parse_arguments(sys.argv[1:])
+    create_think_time(load_test_arguments.think_time)
+    if load_test_arguments.questions:
+        with open(load_test_arguments.questions) as questions_file:
+            question_corpus = [line.strip() for line in questions_file if line.strip()]
+    else:
+        question_corpus = load_recording(load_test_arguments.recording)['questions']
+    if load_test_arguments.target == "local":
+        load_test_target = LocalTarget(load_recording(load_test_arguments.recording), load_test_arguments)
+    else:
+        load_test_target = HttpTarget(load_test_arguments.target, load_test_arguments.usage_id,
+                                      load_test_arguments.scenario, metrics_token=load_test_arguments.metrics_token)
+    load_test_target.start()
+    try:
+        saturation_curve = run_load_test(load_test_target, question_corpus, load_test_arguments)
+    finally:
+        load_test_target.stop()
+    if load_test_arguments.output:
+        save_curve(saturation_curve, load_test_arguments.output)
+    saturation = find_saturation(saturation_curve, load_test_arguments.minimum_scaling,
+                                 load_test_arguments.maximum_error_rate)
+    if saturation is None:
+        print("The throughput increased at every step (not saturated)")
+    else:
+        saturated_row, saturation_causes = saturation
+        print("Saturated at %d students: %s" % (saturated_row['students'], "; ".join(saturation_causes)))
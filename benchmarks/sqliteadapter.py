@@ -0,0 +1,427 @@
+import datetime
+import hashlib
+import re
+import sqlite3
+import threading
+
+import MySQLdb
+import MySQLdb.cursors
+
+"""
+This file contains a stand-in for the MySQL database, used when benchmarking without a MySQL server.
+
+```connect``` opens a connection to an SQLite file with the same interface as ```MySQLdb.connect```, so it
+can be given to the connection pool (```pool_parameters['connect_function']```), and ```MySQLDatabase``` is
+used as it is. The queries of ```MySQLDatabase``` are translated to SQLite when they are executed:
+    - the parameters (```%(name)s``` and ```%s```) are converted to the SQLite style
+    - 'START TRANSACTION' starts a write transaction ('BEGIN IMMEDIATE', so that concurrent transactions wait
+      for each other instead of failing)
+    - 'ON DUPLICATE KEY UPDATE pk=LAST_INSERT_ID(pk)' is converted to an upsert returning the primary key
+      (which is set as ```lastrowid```, as with MySQL)
+    - 'ON DUPLICATE KEY UPDATE column=VALUES(column), ...' is converted to an upsert updating the columns
+    - NOW() and SHA1() are added as functions
+SQLite errors are raised as ```MySQLdb.Error```, so they are handled the same way as errors from MySQL.
+
+Every request that would be sent to the MySQL server (queries, commits, rollbacks and pings) is counted in
+```round_trips```, so that the number of round-trips to the database can be measured.
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+
+class RoundTripCounter(object):
+    """
+    Thread-safe counter of the round-trips to the database
+    """
+
+    def __init__(self):
+        self.__count = 0
+        self.__lock = threading.Lock()
+
+    def increment(self, count=1):
+        """
+        Adds the given number of round-trips
+
+        Arguments:
+            count (int): The number of round-trips
+
+        """
+        with self.__lock:
+            self.__count += count
+
+    def get_count(self):
+        """
+        Returns:
+            int: The number of round-trips since the counter was created (or reset)
+
+        """
+        with self.__lock:
+            return self.__count
+
+    def reset(self):
+        """
+        Sets the counter to 0
+        """
+        with self.__lock:
+            self.__count = 0
+
+
+round_trips = RoundTripCounter()
+"""
+The round-trips made by all connections in the process
+"""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tblChatUsers (
+  chatUserID INTEGER PRIMARY KEY AUTOINCREMENT,
+  username VARCHAR(250) NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tblChatQuestions (
+  chatQuestionID INTEGER PRIMARY KEY AUTOINCREMENT,
+  edx_questionID INT NULL,
+  question_text VARCHAR(250) NOT NULL,
+  asked_by_user TINYINT(1) NULL,
+  fk_tblChatUsers INT NOT NULL REFERENCES tblChatUsers (chatUserID),
+  question_hash CHAR(40) NOT NULL UNIQUE
+);
+CREATE INDEX IF NOT EXISTS user_asked_by_user_idx ON tblChatQuestions (fk_tblChatUsers, asked_by_user, edx_questionID);
+CREATE TABLE IF NOT EXISTS tblStackExchange (
+  stackexchangeID INTEGER PRIMARY KEY AUTOINCREMENT,
+  stackexchange_link LONGTEXT NOT NULL,
+  lookup_date DATETIME NOT NULL,
+  stackexchange_link_hash CHAR(40) NOT NULL UNIQUE
+);
+CREATE INDEX IF NOT EXISTS lookup_date_idx ON tblStackExchange (lookup_date);
+CREATE TABLE IF NOT EXISTS tblChatAnswers (
+  chatAnswersID INTEGER PRIMARY KEY AUTOINCREMENT,
+  answer_text LONGTEXT NOT NULL,
+  answer_preview TEXT NULL,
+  is_answer_read TINYINT(1) NOT NULL,
+  correct_answer TINYINT(1) NOT NULL,
+  fk_tblStackExchange INT NOT NULL REFERENCES tblStackExchange (stackexchangeID),
+  fk_tblChatQuestions INT NOT NULL REFERENCES tblChatQuestions (chatQuestionID)
+);
+CREATE INDEX IF NOT EXISTS fk_tblChatAnswers_tblStackOverflow1_idx ON tblChatAnswers (fk_tblStackExchange);
+CREATE INDEX IF NOT EXISTS fk_tblChatAnswers_tblChatQuestions1_idx ON tblChatAnswers (fk_tblChatQuestions);
+CREATE INDEX IF NOT EXISTS correct_answer_idx
+  ON tblChatAnswers (correct_answer, is_answer_read, fk_tblChatQuestions, fk_tblStackExchange);
+CREATE INDEX IF NOT EXISTS is_answer_read_idx ON tblChatAnswers (is_answer_read, fk_tblChatQuestions, fk_tblStackExchange);
+CREATE TABLE IF NOT EXISTS tblFeedbackQuestion (
+  feedbackQuestionID INTEGER PRIMARY KEY AUTOINCREMENT,
+  feedback_msg LONGTEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tblUserFeedback (
+  feedbackID INTEGER PRIMARY KEY AUTOINCREMENT,
+  feedback_text LONGTEXT NOT NULL,
+  fk_tblFeedbackType INT NOT NULL REFERENCES tblFeedbackQuestion (feedbackQuestionID),
+  fk_tblChatUsers INT NOT NULL REFERENCES tblChatUsers (chatUserID)
+);
+CREATE TABLE IF NOT EXISTS tblEdxQuestions (
+  edx_questionID INT NOT NULL PRIMARY KEY,
+  course_id VARCHAR(250) NULL,
+  question_text LONGTEXT NOT NULL,
+  question_link LONGTEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS course_id_idx ON tblEdxQuestions (course_id);
+CREATE TABLE IF NOT EXISTS tblEdxAnswers (
+  edx_questionID INT NOT NULL PRIMARY KEY REFERENCES tblEdxQuestions (edx_questionID) ON DELETE CASCADE,
+  title LONGTEXT NOT NULL,
+  answer_text LONGTEXT NOT NULL,
+  answer_preview TEXT NULL,
+  fk_tblStackExchange INT NOT NULL REFERENCES tblStackExchange (stackexchangeID),
+  computed_date DATETIME NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fk_tblEdxAnswers_tblStackExchange1_idx ON tblEdxAnswers (fk_tblStackExchange);
+CREATE TABLE IF NOT EXISTS tblSchemaVersion (
+  version INT NOT NULL PRIMARY KEY,
+  description VARCHAR(250) NOT NULL,
+  applied_date DATETIME NOT NULL
+);
+"""
+"""
+The schema of 'create_db.sql', in SQLite
+"""
+
+_NAMED_PARAMETER = re.compile(r"%\((\w+)\)s")
+_UPSERT = re.compile(r"\s*ON DUPLICATE KEY UPDATE\s+(\w+)\s*=\s*LAST_INSERT_ID\(\s*\1\s*\)\s*;?\s*$", re.IGNORECASE)
+_UPSERT_VALUES = re.compile(r"\s+ON DUPLICATE KEY UPDATE\s+", re.IGNORECASE)
+_INSERTED_VALUE = re.compile(r"\bVALUES\(\s*(\w+)\s*\)", re.IGNORECASE)
+_TABLE_OPTIONS = re.compile(r"\s+(ENGINE|COMMENT)\s*=\s*('[^']*'|\w+)", re.IGNORECASE)
+
+_translated_queries = dict()
+"""
+The translated queries (the same queries are executed many times)
+"""
+
+
+def connect(host=str, user=str, passwd=str, db=str):
+    """
+    Opens a connection to the SQLite database, with the same arguments as ```MySQLdb.connect```
+    (only ```db```, the path to the SQLite file, is used).
+
+    Arguments:
+        host (str): Not used
+        user (str): Not used
+        passwd (str): Not used
+        db (str): Path to the SQLite file (see ```create_database```)
+
+    Returns:
+        SQLiteConnection: The connection
+
+    """
+    return SQLiteConnection(db)
+
+
+def create_database(path=str, schema_versions=list()):
+    """
+    Creates the tables of 'create_db.sql' in the SQLite file (existing tables are kept).
+
+    Arguments:
+        path (str): Path to the SQLite file
+        schema_versions (list): The applied schema versions, as tuples (version, description)
+            (see ```schemamigration.MIGRATIONS```)
+
+    """
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL;")
+        connection.executescript(_SCHEMA)
+        connection.executemany("INSERT OR IGNORE INTO tblSchemaVersion (version, description, applied_date) "
+                               "VALUES (?, ?, ?);",
+                               [(version, description, _now()) for version, description in schema_versions])
+        connection.commit()
+    finally:
+        connection.close()
+
+
+class SQLiteConnection(object):
+    """
+    Connection to an SQLite file, with the parts of the interface of ```MySQLdb.connections.Connection```
+    used by ```ConnectionPool``` and ```MySQLDatabase```.
+    """
+
+    def __init__(self, path=str):
+        """
+        Constructor for the connection
+
+        Arguments:
+            path (str): Path to the SQLite file
+
+        """
+        try:
+            # isolation_level=None: the transactions are started by the queries ('START TRANSACTION')
+            self.__connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+            self.__connection.execute("PRAGMA journal_mode=WAL;")
+            self.__connection.execute("PRAGMA synchronous=NORMAL;")
+        except sqlite3.Error, err:
+            raise MySQLdb.OperationalError(str(err))
+        self.__connection.create_function("NOW", 0, _now)
+        self.__connection.create_function("SHA1", 1, _sha1)
+        self.open = 1
+        round_trips.increment()
+
+    def autocommit(self, enabled=bool):
+        """
+        Autocommit is always enabled outside of transactions (see ```__init__```)
+        """
+
+    def cursor(self, cursor_class=None):
+        """
+        Returns a cursor for executing queries
+
+        Arguments:
+            cursor_class (class): The type of cursor. The rows are returned as dicts for
+                ```MySQLdb.cursors.DictCursor``` and ```MySQLdb.cursors.SSDictCursor```, and as tuples otherwise.
+
+        Returns:
+            SQLiteCursor: The cursor
+
+        """
+        return SQLiteCursor(self.__connection.cursor(),
+                            cursor_class in (MySQLdb.cursors.DictCursor, MySQLdb.cursors.SSDictCursor))
+
+    def commit(self):
+        self.__end_transaction("COMMIT;")
+
+    def rollback(self):
+        self.__end_transaction("ROLLBACK;")
+
+    def ping(self, reconnect=False):
+        if not self.open:
+            raise MySQLdb.OperationalError("The connection is closed")
+        round_trips.increment()
+
+    def close(self):
+        self.open = 0
+        self.__connection.close()
+
+    def __end_transaction(self, statement=str):
+        """
+        Commits or rolls back the transaction (if one is active)
+        """
+        round_trips.increment()
+        try:
+            self.__connection.execute(statement)
+        except sqlite3.OperationalError, err:
+            if "no transaction is active" not in str(err):
+                raise MySQLdb.OperationalError(str(err))
+
+
+class SQLiteCursor(object):
+    """
+    Cursor translating the queries of ```MySQLDatabase``` to SQLite (see the description of the module).
+    """
+
+    def __init__(self, cursor=sqlite3.Cursor, dict_rows=bool):
+        """
+        Constructor for the cursor
+
+        Arguments:
+            cursor (sqlite3.Cursor): The SQLite cursor
+            dict_rows (bool): Should the rows be returned as dicts (column name => value)?
+
+        """
+        self.__cursor = cursor
+        self.__dict_rows = dict_rows
+        self.__rows_consumed = False  # have the rows of the query been read by the cursor (upsert)?
+        self.lastrowid = None
+        self.rowcount = -1
+
+    def execute(self, query=str, args=None):
+        """
+        Translates and executes the query
+
+        Arguments:
+            query (str): The query (MySQL)
+            args (dict or list): The parameters of the query
+
+        Returns:
+            int: The number of affected rows
+
+        Raises:
+            MySQLdb.Error: If the query failed
+
+        """
+        round_trips.increment()
+        translated_query, is_upsert = _translate(query, args is not None)
+        try:
+            self.__cursor.execute(translated_query, args if args is not None else ())
+            self.__rows_consumed = is_upsert
+            if is_upsert:
+                # the upsert returns the primary key of the inserted (or existing) row
+                returned_rows = self.__cursor.fetchall()
+                self.lastrowid = returned_rows[0][0] if returned_rows else None
+            else:
+                self.lastrowid = self.__cursor.lastrowid
+            self.rowcount = self.__cursor.rowcount
+        except sqlite3.IntegrityError, err:
+            raise MySQLdb.IntegrityError(str(err))
+        except sqlite3.Error, err:
+            raise MySQLdb.OperationalError(str(err))
+        return self.rowcount
+
+    def executemany(self, query=str, args_list=list):
+        """
+        Translates and executes the query for each of the parameters. As with MySQLdb, an INSERT is
+        sent as one query, and other queries (e.g. UPDATE) are sent once per row.
+
+        Arguments:
+            query (str): The query (MySQL)
+            args_list (list): The parameters for each execution
+
+        Returns:
+            int: The number of affected rows
+
+        Raises:
+            MySQLdb.Error: If the query failed
+
+        """
+        args_list = list(args_list)
+        is_insert = query.lstrip().upper().startswith("INSERT")
+        round_trips.increment(1 if is_insert else len(args_list))
+        translated_query, is_upsert = _translate(query, True)
+        try:
+            self.__cursor.executemany(translated_query, args_list)
+            self.rowcount = self.__cursor.rowcount
+        except sqlite3.IntegrityError, err:
+            raise MySQLdb.IntegrityError(str(err))
+        except sqlite3.Error, err:
+            raise MySQLdb.OperationalError(str(err))
+        return self.rowcount
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchmany(self, size=1):
+        return self.__convert_rows(self.__cursor.fetchmany(size))
+
+    def fetchall(self):
+        return self.__convert_rows(self.__cursor.fetchall())
+
+    def close(self):
+        self.__cursor.close()
+
+    def __convert_rows(self, rows=list):
+        """
+        Returns the rows as dicts (if ```dict_rows```), or as tuples
+        """
+        if self.__rows_consumed:
+            return list()
+        if not self.__dict_rows:
+            return [tuple(row) for row in rows]
+        columns = [column[0] for column in self.__cursor.description or ()]
+        return [dict(zip(columns, row)) for row in rows]
+
+
+def _translate(query=str, has_args=bool):
+    """
+    Translates the query from MySQL to SQLite (see the description of the module)
+
+    Arguments:
+        query (str): The query (MySQL)
+        has_args (bool): Are parameters given? (as with MySQLdb, the parameters are only replaced if they are)
+
+    Returns:
+        tuple: (the query (SQLite), is the query an upsert returning the primary key?)
+
+    """
+    key = (query, has_args)
+    translated = _translated_queries.get(key)
+    if translated is not None:
+        return translated
+    translated_query = query.strip()
+    is_upsert = False
+    if translated_query.rstrip(";").strip().upper() == "START TRANSACTION":
+        translated_query = "BEGIN IMMEDIATE;"
+    else:
+        translated_query = _TABLE_OPTIONS.sub("", translated_query)
+        upsert = _UPSERT.search(translated_query)
+        if upsert is not None:
+            primary_key = upsert.group(1)
+            translated_query = translated_query[:upsert.start()] \
+                + " ON CONFLICT DO UPDATE SET " + primary_key + "=" + primary_key \
+                + " RETURNING " + primary_key + ";"
+            is_upsert = True
+        else:
+            upsert = _UPSERT_VALUES.search(translated_query)
+            if upsert is not None:
+                translated_query = translated_query[:upsert.start()] + " ON CONFLICT DO UPDATE SET " \
+                    + _INSERTED_VALUE.sub(r"excluded.\1", translated_query[upsert.end():])
+        if has_args:
+            translated_query = _NAMED_PARAMETER.sub(r":\1", translated_query).replace("%s", "?").replace("%%", "%")
+    translated = (translated_query, is_upsert)
+    _translated_queries[key] = translated
+    return translated
+
+
+def _now():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _sha1(value=object):
+    if value is None:
+        return None
+    if isinstance(value, unicode):
+        value = value.encode("utf8")
+    return hashlib.sha1(str(value)).hexdigest()
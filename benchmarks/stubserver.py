@@ -0,0 +1,243 @@
+import BaseHTTPServer
+import SocketServer
+import gzip
+import json
+import sys
+import threading
+import time
+import urllib
+import urlparse
+from StringIO import StringIO
+
+import requests
+
+"""
+This file contains a local stand-in for the StackExchange API, used when benchmarking without network access.
+
+```StackExchangeStub``` is an HTTP server replaying recorded responses of the API. The chat agent is pointed to
+it with ```stackexchange_parameters['api_root']``` in the config file. The recording (JSON) contains:
+    - questions: the questions asked by the benchmark
+    - search: the search results (items) for each question (lower case), used for 'search' and 'search/advanced'
+    - answers: the answers (items) for each question ID, used for 'questions/{ids}/answers'
+The responses are paged and compressed (gzip) as by the API, and the requests can be delayed to simulate the
+latency of the API. Filters are not applied (all recorded fields are returned).
+
+Responses are recorded from the API with:
+    python stubserver.py record <questions file (one per line)> <recording file>
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+
+class StackExchangeStub(object):
+    """
+    Local HTTP server replaying the recorded responses of the StackExchange API
+    """
+
+    FILTER = "!benchmark"
+    """
+    The filter returned by 'filters/create'
+    """
+
+    __QUOTA_MAX = 10000000
+    """
+    The quota reported in the responses (high enough that the quota never limits the benchmark)
+    """
+
+    def __init__(self, recording=dict, latency=0.0):
+        """
+        Constructor for the stub. The server is started with ```start```.
+
+        Arguments:
+            recording (dict): The recorded responses (see the description of the module)
+            latency (float): Seconds each request is delayed
+
+        """
+        self.__search = dict((question.lower(), items) for question, items in recording.get('search', dict()).items())
+        self.__answers = dict((int(question_id), items)
+                              for question_id, items in recording.get('answers', dict()).items())
+        self.__latency = latency
+        self.__request_count = 0
+        self.__lock = threading.Lock()
+        self.__server = None
+
+    def start(self):
+        """
+        Starts the server on a free port on localhost (in a background thread)
+
+        Returns:
+            str: The root URL of the API (see ```stackexchange_parameters['api_root']```)
+
+        """
+        self.__server = _ThreadingHTTPServer(("127.0.0.1", 0), _StubRequestHandler)
+        self.__server.stub = self
+        thread = threading.Thread(target=self.__server.serve_forever, name="StackExchangeStub")
+        thread.daemon = True
+        thread.start()
+        return self.get_api_root()
+
+    def stop(self):
+        """
+        Stops the server
+        """
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+
+    def get_api_root(self):
+        return "http://%s:%d/" % self.__server.server_address
+
+    def get_request_count(self):
+        """
+        Returns:
+            int: The number of requests made to the stub
+
+        """
+        with self.__lock:
+            return self.__request_count
+
+    def handle_request(self, path=str, params=dict):
+        """
+        Returns the response to the request (called by the request handler)
+
+        Arguments:
+            path (str): The path of the request, e.g. '/2.2/search'
+            params (dict): The parameters of the request (name => value)
+
+        Returns:
+            tuple: (HTTP status, response (dict))
+
+        """
+        with self.__lock:
+            self.__request_count += 1
+        if self.__latency > 0:
+            time.sleep(self.__latency)
+        # the first part of the path is the API version
+        method = path.strip("/").split("/", 1)[-1]
+        parts = method.split("/")
+        if method == "filters/create":
+            items = [{'filter': self.FILTER, 'filter_type': 'safe'}]
+        elif method in ("search", "search/advanced"):
+            question = params.get('intitle', params.get('q', ""))
+            items = self.__search.get(question.lower(), list())
+        elif len(parts) == 3 and parts[0] == "questions" and parts[2] == "answers":
+            items = list()
+            for question_id in parts[1].split(";"):
+                items.extend(self.__answers.get(int(question_id), list()))
+            if params.get('sort') == 'votes':
+                items = sorted(items, key=lambda item: item.get('score', 0), reverse=True)
+        else:
+            return 404, {'error_id': 404, 'error_name': "no_method", 'error_message': "Unknown method: " + method}
+        return 200, self.__create_page(items, int(params.get('page', 1)), int(params.get('pagesize', 30)))
+
+    def __create_page(self, items=list, page=int, page_size=int):
+        """
+        Returns the response with the given page of the items
+        """
+        start = (page - 1) * page_size
+        return {
+            'items': items[start:start + page_size],
+            'has_more': start + page_size < len(items),
+            'quota_max': self.__QUOTA_MAX,
+            'quota_remaining': self.__QUOTA_MAX - self.get_request_count()
+        }
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    stub = None
+
+
+class _StubRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Handles the requests to the stub (keep-alive, responses compressed with gzip if accepted)
+    """
+
+    protocol_version = "HTTP/1.1"
+    # the response is sent at once (not one packet per header), so it is not delayed by Nagle's algorithm
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = dict((name, values[-1]) for name, values in urlparse.parse_qs(url.query).items())
+        status, response = self.server.stub.handle_request(urllib.unquote(url.path), params)
+        body = json.dumps(response)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            buffer = StringIO()
+            with gzip.GzipFile(fileobj=buffer, mode="wb") as gzip_file:
+                gzip_file.write(body)
+            body = buffer.getvalue()
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # the requests are not logged (it would slow down the benchmark)
+        pass
+
+
+def load_recording(path=str):
+    """
+    Reads the recorded responses
+
+    Arguments:
+        path (str): Path to the recording (JSON)
+
+    Returns:
+        dict: The recording (see the description of the module)
+
+    """
+    with open(path) as recording_file:
+        return json.load(recording_file)
+
+
+def record(questions=list, path=str, api_root="https://api.stackexchange.com/2.2/", site="stackoverflow"):
+    """
+    Records the responses of the StackExchange API for the questions: the search results (first page, as
+    used by the chat agent) and all the answers of the questions in the search results.
+
+    Arguments:
+        questions (list): The questions to record
+        path (str): Path to the recording (JSON)
+        api_root (str): The root URL of the API (including the version)
+        site (str): The API name of the site
+
+    """
+    session = requests.Session()
+    recording = {'questions': list(questions), 'search': dict(), 'answers': dict()}
+    for question in questions:
+        response = session.get(api_root + "search", params={'intitle': question, 'pagesize': 100,
+                                                            'filter': 'default', 'site': site}).json()
+        time.sleep(response.get('backoff', 0))
+        items = response.get('items', list())
+        recording['search'][question.lower()] = items
+        question_ids = [str(item['question_id']) for item in items]
+        for start in range(0, len(question_ids), 100):
+            page = 1
+            while True:
+                response = session.get(api_root + "questions/" + ";".join(question_ids[start:start + 100])
+                                       + "/answers", params={'pagesize': 100, 'page': page, 'sort': 'votes',
+                                                             'filter': 'withbody', 'site': site}).json()
+                for answer in response.get('items', list()):
+                    recording['answers'].setdefault(str(answer['question_id']), list()).append(answer)
+                time.sleep(response.get('backoff', 0))
+                if not response.get('has_more'):
+                    break
+                page += 1
+        print("Recorded: %s (%d results)" % (question, len(items)))
+    with open(path, "w") as recording_file:
+        json.dump(recording, recording_file, indent=1, sort_keys=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "record":
+        with open(sys.argv[2]) as questions_file:
+            record([line.strip() for line in questions_file if line.strip()], sys.argv[3])
+    else:
+        print("Usage: python stubserver.py record <questions file> <recording file>")
+        sys.exit(1)
@@ -1,31 +1,36 @@
+from record import Record
+
 _author_ = "Knut Lucas Andersen"
 
 # TODO: Consider merging this and QuestionClass, to use these as objects for storing user input
 
 
-class Answer:
+class Answer(Record):
+    """
+    Record of an answer presented to the user. The answer is not changed after it is created,
+    a new Answer is created when it is updated (see ```AnswerSession.replace_answer```).
+    """
+
+    __slots__ = ('__answer_id', '__answer_text', '__question_id', '__is_answer_read', '__is_correct_answer',
+                 '__stackexchange_id', '__stackexchange_link', '__answer_preview')
 
-    __answer_id = None
-    __answer_text = None
-    __question_id = None
-    __is_answer_read = None
-    __is_correct_answer = None
-    __stackexchange_id = None
-    __stackexchange_link = None
+    FIELDS = ('answer_id', 'answer_text', 'question_id', 'is_answer_read', 'is_correct_answer', 'stackexchange_id',
+              'stackexchange_link', 'answer_preview')
 
     def __init__(self, answer_id=long, answer_text=str, question_id=long, is_answer_read=bool, is_correct_answer=bool,
-                 stackexchange_id=long, stackexchange_link=str):
+                 stackexchange_id=long, stackexchange_link=str, answer_preview=None):
         """
         Constructor for the Answer class
 
         Arguments:
             answer_id (long): The ID for this answer
-            answer_text (str): The answer
+            answer_text (str): The answer (sanitized HTML, see ```answerformatting```)
             question_id (long): The ID for the question to which this answer belongs
             is_answer_read (bool): Is this answer read?
             is_correct_answer (bool): Is this answer marked as correct?
             stackexchange_id (long): The ID of the StackExchange site which this answer is retrieved from
             stackexchange_link (str): The link to the StackExchange site which this answer is retrieved from
+            answer_preview (str): The shortened answer shown before 'read more' (None: same as the answer)
 
         """
         self.__answer_id = answer_id
@@ -35,6 +40,7 @@ class Answer:
         self.__is_correct_answer = is_correct_answer
         self.__stackexchange_id = stackexchange_id
         self.__stackexchange_link = stackexchange_link
+        self.__answer_preview = answer_preview
 
     def get_answer_id(self):
         return self.__answer_id
@@ -57,3 +63,11 @@ class Answer:
     def get_stackexchange_link(self):
         return self.__stackexchange_link
 
+    def get_answer_preview(self):
+        if self.__answer_preview is None:
+            return self.__answer_text
+        return self.__answer_preview
+
+    def _get_values(self):
+        return (self.__answer_id, self.__answer_text, self.__question_id, self.__is_answer_read,
+                self.__is_correct_answer, self.__stackexchange_id, self.__stackexchange_link, self.__answer_preview)
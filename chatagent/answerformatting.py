@@ -0,0 +1,255 @@
+import cgi
+import hashlib
+import threading
+from HTMLParser import HTMLParser, HTMLParseError
+from collections import OrderedDict
+
+import dbconfig as config
+
+"""
+This file contains the processing of the answers (HTML) retrieved from StackExchange before they are shown.
+
+Each answer is processed once, when it is retrieved:
+    - the HTML is sanitized: only the tags and attributes used in StackExchange posts are kept, scripts and
+      styles are removed, and unclosed tags are closed
+    - a preview is created from the sanitized HTML, with at most ```preview_length``` characters of text.
+      The preview is cut between tags (or in the text), and the open tags are closed, so that a tag is never
+      cut in half.
+The sanitized answer and the preview are stored with the answer (```Answer``` and 'tblChatAnswers'), so that
+'read more' only has to look them up. The results are cached, since the same answer often is shown several
+times (e.g. for duplicate questions).
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+
+class AnswerFormatter(object):
+    """
+    Class for sanitizing answers and creating their previews.
+    """
+
+    DEFAULT_PREVIEW_LENGTH = 150
+    """
+    The default maximum number of characters of text in the preview
+    """
+
+    DEFAULT_CACHE_SIZE = 1000
+    """
+    The default number of formatted answers kept in the cache
+    """
+
+    def __init__(self, preview_length=DEFAULT_PREVIEW_LENGTH, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        Constructor for the answer formatter
+
+        Arguments:
+            preview_length (int): The maximum number of characters of text in the preview
+            cache_size (int): The number of formatted answers kept in the cache
+
+        """
+        self.__preview_length = preview_length
+        self.__cache_size = cache_size
+        self.__cache = OrderedDict()  # sha1 of the answer => (sanitized answer, preview)
+        self.__lock = threading.Lock()
+
+    def format(self, answer_html=str):
+        """
+        Sanitizes the answer and creates its preview
+
+        Arguments:
+            answer_html (str): The answer (HTML) as retrieved from StackExchange, or from the database
+                (```str``` is decoded as UTF-8)
+
+        Returns:
+            tuple: (sanitized answer, preview). If the whole answer fits in the preview, both are the same.
+
+        """
+        if not answer_html:
+            return u"", u""
+        if isinstance(answer_html, str):
+            # MySQLdb returns the text as UTF-8 encoded str (the connections are not opened with use_unicode)
+            answer_html = answer_html.decode("utf8", "replace")
+        key = hashlib.sha1(answer_html.encode("utf8")).hexdigest()
+        with self.__lock:
+            formatted = self.__cache.pop(key, None)
+            if formatted is not None:
+                self.__cache[key] = formatted
+                return formatted
+        tokens = _tokenize(answer_html)
+        formatted = (_render(tokens), _render(tokens, self.__preview_length))
+        with self.__lock:
+            self.__cache[key] = formatted
+            while len(self.__cache) > self.__cache_size:
+                self.__cache.popitem(last=False)
+        return formatted
+
+
+_ALLOWED_TAGS = {
+    'a': ('href', 'title', 'rel'),
+    'b': (), 'blockquote': (), 'br': (), 'code': (), 'dd': (), 'del': (), 'div': (), 'dl': (), 'dt': (),
+    'em': (), 'h1': (), 'h2': (), 'h3': (), 'h4': (), 'h5': (), 'h6': (), 'hr': (), 'i': (),
+    'img': ('src', 'alt', 'title', 'width', 'height'),
+    'kbd': (), 'li': (), 'ol': (), 'p': (), 'pre': (), 's': (), 'span': (), 'strike': (), 'strong': (),
+    'sub': (), 'sup': (), 'table': (), 'tbody': (), 'td': (), 'th': (), 'thead': (), 'tr': (), 'ul': ()
+}
+"""
+The tags kept in the sanitized answer, with the attributes kept for each tag
+"""
+
+_VOID_TAGS = frozenset(['br', 'hr', 'img'])
+"""
+Tags without content (and end tag)
+"""
+
+_REMOVED_CONTENT_TAGS = frozenset(['script', 'style', 'iframe', 'object', 'embed', 'noscript'])
+"""
+Tags that are removed together with their content
+"""
+
+_URL_ATTRIBUTES = frozenset(['href', 'src'])
+_ALLOWED_URL_SCHEMES = ('http://', 'https://', '//', '/', '#')
+
+
+class _AnswerParser(HTMLParser):
+    """
+    Parses the answer into a list of tokens, keeping only the allowed tags and attributes:
+        ('start', tag, attributes as HTML), ('end', tag), ('text', text), ('entity', entity as HTML)
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.tokens = list()
+        self.__open_tags = list()
+        self.__removed_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _REMOVED_CONTENT_TAGS:
+            self.__removed_depth += 1
+            return
+        if self.__removed_depth > 0 or tag not in _ALLOWED_TAGS:
+            return
+        attributes = u""
+        for name, value in attrs:
+            if name not in _ALLOWED_TAGS[tag] or value is None:
+                continue
+            if name in _URL_ATTRIBUTES and not value.strip().lower().startswith(_ALLOWED_URL_SCHEMES):
+                continue
+            attributes += u' %s="%s"' % (name, cgi.escape(value, True))
+        self.tokens.append(('start', tag, attributes))
+        if tag not in _VOID_TAGS:
+            self.__open_tags.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in _REMOVED_CONTENT_TAGS:
+            self.__removed_depth = max(self.__removed_depth - 1, 0)
+            return
+        if self.__removed_depth > 0 or tag not in self.__open_tags:
+            # end tags without a start tag are left out
+            return
+        # close the tags that were left open inside this tag
+        while True:
+            open_tag = self.__open_tags.pop()
+            self.tokens.append(('end', open_tag))
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.__removed_depth == 0:
+            self.tokens.append(('text', data))
+
+    def handle_entityref(self, name):
+        if self.__removed_depth == 0:
+            self.tokens.append(('entity', u"&%s;" % name))
+
+    def handle_charref(self, name):
+        if self.__removed_depth == 0:
+            self.tokens.append(('entity', u"&#%s;" % name))
+
+    def close(self):
+        HTMLParser.close(self)
+        while self.__open_tags:
+            self.tokens.append(('end', self.__open_tags.pop()))
+
+
+def _tokenize(answer_html=str):
+    """
+    Parses the answer into the tokens of the sanitized answer (see ```_AnswerParser```)
+
+    Arguments:
+        answer_html (str): The answer (HTML)
+
+    Returns:
+        list: The tokens
+
+    """
+    parser = _AnswerParser()
+    try:
+        parser.feed(answer_html)
+        parser.close()
+    except HTMLParseError:
+        # the answer is not valid HTML, so it is shown as text
+        return [('text', answer_html)]
+    return parser.tokens
+
+
+def _render(tokens=list, max_length=None):
+    """
+    Renders the tokens as HTML. If ```max_length``` is given, the text is cut after this number of characters
+    (followed by '...'), and the tags that are open at that point are closed.
+
+    Arguments:
+        tokens (list): The tokens (see ```_AnswerParser```)
+        max_length (int): The maximum number of characters of text (None: all)
+
+    Returns:
+        str: The HTML
+
+    """
+    html = list()
+    open_tags = list()
+    length = 0
+    for token in tokens:
+        token_type = token[0]
+        if token_type == 'start':
+            html.append(u"<%s%s>" % (token[1], token[2]))
+            if token[1] not in _VOID_TAGS:
+                open_tags.append(token[1])
+        elif token_type == 'end':
+            html.append(u"</%s>" % token[1])
+            open_tags.pop()
+        else:
+            text = token[1]
+            text_length = 1 if token_type == 'entity' else len(text)
+            if max_length is not None and length + text_length > max_length:
+                if token_type == 'text':
+                    html.append(cgi.escape(text[:max_length - length]))
+                html.append(u"...")
+                html.extend([u"</%s>" % tag for tag in reversed(open_tags)])
+                break
+            html.append(text if token_type == 'entity' else cgi.escape(text))
+            length += text_length
+    return u"".join(html)
+
+
+_answer_formatter = None
+_answer_formatter_lock = threading.Lock()
+
+
+def get_answer_formatter():
+    """
+    Returns the answer formatter shared by the process, creating it on first use.
+    The settings are read from ```answer_format_parameters``` in the config file (if set).
+
+    Returns:
+        AnswerFormatter: The answer formatter
+
+    """
+    global _answer_formatter
+    if _answer_formatter is None:
+        with _answer_formatter_lock:
+            if _answer_formatter is None:
+                format_parameters = getattr(config, 'answer_format_parameters', dict())
+                _answer_formatter = AnswerFormatter(
+                    format_parameters.get('preview_length', AnswerFormatter.DEFAULT_PREVIEW_LENGTH),
+                    format_parameters.get('cache_size', AnswerFormatter.DEFAULT_CACHE_SIZE))
+    return _answer_formatter
@@ -0,0 +1,170 @@
+import Queue
+import threading
+import time
+import uuid
+
+import dbconfig as config
+from searchcache import MemoryCacheBackend, SQLiteCacheBackend
+
+_author_ = "Knut Lucas Andersen"
+
+
+class AnswerJobManager(object):
+    """
+    Class for running the retrieval of answers in the background.
+
+    Jobs are submitted with ```submit```, which returns a job id immediately. The jobs are run by a
+    fixed number of worker threads, and the result is retrieved (polled) with ```get_job_result```.
+    The jobs are run in the process they were submitted to, but their status and result are kept in the
+    backend, so with the SQLite backend (see ```answer_job_parameters```) the result can be retrieved by
+    any process on the same host. The answer is also added to the session of the user, so the sessions must
+    be shared by the processes as well (the SQLite backend in ```session_parameters```, see ```answersession```).
+    Deployments on several hosts must route the requests of a user to the same host (sticky sessions).
+    """
+
+    PENDING = "pending"
+    """
+    Status for jobs that are waiting to be run, or are running
+    """
+
+    DONE = "done"
+    """
+    Status for jobs that have finished
+    """
+
+    FAILED = "failed"
+    """
+    Status for jobs that raised an error. The result is None (the error is printed by the worker).
+    """
+
+    UNKNOWN = "unknown"
+    """
+    Status for job ids that does not exist (or where the result has expired)
+    """
+
+    DEFAULT_WORKER_COUNT = 4
+    """
+    The default number of worker threads running the jobs
+    """
+
+    DEFAULT_RESULT_TTL = 300
+    """
+    The default number of seconds a job is kept (if its result isn't retrieved)
+    """
+
+    DEFAULT_MAX_JOBS = 10000
+    """
+    The default number of jobs kept in the backend (least recently used are removed first)
+    """
+
+    def __init__(self, worker_count=DEFAULT_WORKER_COUNT, result_ttl=DEFAULT_RESULT_TTL, backend=None):
+        """
+        Constructor for the job manager. The worker threads are started when the first job is submitted.
+
+        Arguments:
+            worker_count (int): The number of worker threads
+            result_ttl (int): Seconds before a job (and its result) is removed, counted from when the job
+                was submitted or finished
+            backend (object): The backend keeping the status and result of the jobs (```MemoryCacheBackend```
+                or ```SQLiteCacheBackend```). If None, an in-memory backend with ```DEFAULT_MAX_JOBS``` is used.
+
+        """
+        if backend is None:
+            backend = MemoryCacheBackend(self.DEFAULT_MAX_JOBS)
+        self.__worker_count = worker_count
+        self.__result_ttl = result_ttl
+        self.__backend = backend
+        self.__job_queue = Queue.Queue()
+        self.__lock = threading.Lock()
+        self.__workers = list()
+
+    def submit(self, function, *args):
+        """
+        Adds the function to the job queue.
+
+        Arguments:
+            function (function): The function to run
+            *args: The arguments passed to the function
+
+        Returns:
+            str: The id of the job
+
+        """
+        job_id = uuid.uuid4().hex
+        self.__backend.put(job_id, time.time(), (self.PENDING, None))
+        with self.__lock:
+            if len(self.__workers) == 0:
+                self.__start_workers()
+        self.__job_queue.put((job_id, function, args))
+        return job_id
+
+    def get_job_result(self, job_id=str):
+        """
+        Returns the status and result of the job. Finished jobs are removed once their result is retrieved.
+        Jobs that have been pending for longer than the time-to-live (e.g. if the process running the job
+        was restarted) are unknown.
+
+        Arguments:
+            job_id (str): The id of the job
+
+        Returns:
+            tuple: (status, result), where result is None until the job is finished
+
+        """
+        entry = self.__backend.get(str(job_id))
+        if entry is None:
+            return self.UNKNOWN, None
+        stored_time, (status, result) = entry
+        if time.time() - stored_time > self.__result_ttl:
+            self.__backend.remove(str(job_id))
+            return self.UNKNOWN, None
+        if status != self.PENDING:
+            self.__backend.remove(str(job_id))
+        return status, result
+
+    def __start_workers(self):
+        """
+        Starts the worker threads. The threads are daemon threads, so they do not keep the process alive.
+        """
+        for counter in range(0, self.__worker_count):
+            worker = threading.Thread(target=self.__run_jobs, name="AnswerJobWorker-%d" % counter)
+            worker.daemon = True
+            worker.start()
+            self.__workers.append(worker)
+
+    def __run_jobs(self):
+        """
+        Runs the jobs in the job queue (run by each worker thread)
+        """
+        while True:
+            job_id, function, args = self.__job_queue.get()
+            try:
+                status, result = self.DONE, function(*args)
+            except Exception as err:
+                # the error is not shown to the user
+                print("Error (Answer job): %s" % err)
+                status, result = self.FAILED, None
+            try:
+                self.__backend.put(job_id, time.time(), (status, result))
+            except Exception as err:
+                # e.g. the SQLite file is locked by another process for too long
+                print("Error (Answer job): %s" % err)
+
+
+def create_answer_job_manager():
+    """
+    Creates the job manager based on ```answer_job_parameters``` in the config file.
+    If no settings are given, the jobs are kept in memory (per process) with the default TTL.
+
+    Returns:
+        AnswerJobManager: The job manager
+
+    """
+    answer_job_parameters = getattr(config, 'answer_job_parameters', dict())
+    max_jobs = answer_job_parameters.get('max_jobs', AnswerJobManager.DEFAULT_MAX_JOBS)
+    if answer_job_parameters.get('backend', 'memory') == 'sqlite':
+        backend = SQLiteCacheBackend(answer_job_parameters['sqlite_path'], max_jobs, "answer_jobs")
+    else:
+        backend = MemoryCacheBackend(max_jobs)
+    return AnswerJobManager(answer_job_parameters.get('worker_count', AnswerJobManager.DEFAULT_WORKER_COUNT),
+                            answer_job_parameters.get('result_ttl', AnswerJobManager.DEFAULT_RESULT_TTL), backend)
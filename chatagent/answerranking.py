@@ -0,0 +1,162 @@
+import calendar
+import time
+
+import numpy
+
+import dbconfig as config
+from textprocessing import tokenize
+
+"""
+This file contains the ranking of the answers retrieved from StackExchange.
+
+The answers to all the top search results are candidates. For each candidate, a set of features
+is extracted (score, accepted, age, length of the body, reputation of the owner and the share of
+the terms in the question that occur in the answer), and the features are stored as columns in a
+NumPy array. Each feature is normalized (to mean 0 and standard deviation 1 across the candidates),
+and the relevance of every candidate is computed in one pass as the weighted sum of its features.
+The weights can be set in the config file (```ranking_parameters```).
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+
+class AnswerRanker(object):
+    """
+    Class for ranking the candidate answers (```StackExchangeAnswer```) by their relevance to the question.
+    """
+
+    FEATURES = ('score', 'is_accepted', 'age', 'body_length', 'owner_reputation', 'term_overlap')
+    """
+    The features used for ranking, in the order of the columns in the feature array
+    """
+
+    DEFAULT_WEIGHTS = {
+        'score': 1.0,
+        'is_accepted': 1.5,
+        'age': -0.25,
+        'body_length': 0.25,
+        'owner_reputation': 0.5,
+        'term_overlap': 1.5
+    }
+    """
+    The default weight of each feature (negative weights lower the relevance, e.g. for older answers)
+    """
+
+    __SECONDS_PER_DAY = 86400.0
+
+    def __init__(self, weights=None):
+        """
+        Constructor for the answer ranker.
+
+        Arguments:
+            weights (dict): The weight of each feature (see ```FEATURES```).
+                Features that are not given use the default weight.
+
+        Raises:
+            ValueError: If a weight is given for a feature that does not exist
+
+        """
+        weight_dict = dict(self.DEFAULT_WEIGHTS)
+        if weights is not None:
+            for feature in weights:
+                if feature not in weight_dict:
+                    raise ValueError("The feature '" + feature + "' does not exist.")
+            weight_dict.update(weights)
+        self.__weights = numpy.array([weight_dict[feature] for feature in self.FEATURES], dtype=numpy.float64)
+
+    def rank(self, answer_list=list, question=str, now=None):
+        """
+        Ranks the answers by their relevance to the question.
+
+        Arguments:
+            answer_list (list): List of ```StackExchangeAnswer``` (the candidates)
+            question (str): The question that was asked
+            now (float): The current time (unix epoch time), used for the age. None: the current time.
+
+        Returns:
+            list: The answers, ordered by relevance (most relevant first)
+
+        """
+        if len(answer_list) == 0:
+            return list()
+        relevance = self.get_relevance(answer_list, question, now)
+        # stable sort, so that answers with the same relevance keep their order (e.g. by votes)
+        order = numpy.argsort(-relevance, kind='mergesort')
+        return [answer_list[index] for index in order]
+
+    def get_relevance(self, answer_list=list, question=str, now=None):
+        """
+        Computes the relevance of each answer to the question.
+
+        Arguments:
+            answer_list (list): List of ```StackExchangeAnswer```
+            question (str): The question that was asked
+            now (float): The current time (unix epoch time). None: the current time.
+
+        Returns:
+            numpy.ndarray: The relevance of each answer (same order as ```answer_list```)
+
+        """
+        features = self.get_features(answer_list, question, now)
+        # normalize each feature across the candidates, so that the weights are comparable
+        mean = features.mean(axis=0)
+        deviation = features.std(axis=0)
+        deviation[deviation == 0] = 1.0
+        return ((features - mean) / deviation).dot(self.__weights)
+
+    def get_features(self, answer_list=list, question=str, now=None):
+        """
+        Extracts the (unnormalized) features of the answers.
+
+        Arguments:
+            answer_list (list): List of ```StackExchangeAnswer```
+            question (str): The question that was asked
+            now (float): The current time (unix epoch time). None: the current time.
+
+        Returns:
+            numpy.ndarray: Array with one row per answer, and one column per feature (see ```FEATURES```)
+
+        """
+        if now is None:
+            now = time.time()
+        question_terms = set(tokenize(question))
+        no_of_answers = len(answer_list)
+        scores = numpy.empty(no_of_answers)
+        accepted = numpy.empty(no_of_answers)
+        creation_times = numpy.empty(no_of_answers)
+        body_lengths = numpy.empty(no_of_answers)
+        reputations = numpy.empty(no_of_answers)
+        overlaps = numpy.zeros(no_of_answers)
+        for index, answer in enumerate(answer_list):
+            body = answer.get_body() or u""
+            scores[index] = answer.get_score() or 0
+            accepted[index] = 1.0 if answer.get_is_accepted() else 0.0
+            creation_date = answer.get_creation_date()
+            creation_times[index] = now if creation_date is None else calendar.timegm(creation_date.timetuple())
+            body_lengths[index] = len(body)
+            reputations[index] = answer.get_owner_reputation() or 0
+            if len(question_terms) > 0:
+                # the terms of the body are kept on the answer (see StackExchangeAnswer.get_body_terms)
+                overlaps[index] = len(question_terms.intersection(answer.get_body_terms())) / float(len(question_terms))
+        features = numpy.empty((no_of_answers, len(self.FEATURES)))
+        # scores, lengths, ages and reputations are heavy-tailed, so their logarithm is used
+        features[:, 0] = numpy.sign(scores) * numpy.log1p(numpy.abs(scores))
+        features[:, 1] = accepted
+        features[:, 2] = numpy.log1p(numpy.maximum(now - creation_times, 0) / self.__SECONDS_PER_DAY)
+        features[:, 3] = numpy.log1p(body_lengths)
+        features[:, 4] = numpy.log1p(numpy.maximum(reputations, 0))
+        features[:, 5] = overlaps
+        return features
+
+
+def create_answer_ranker():
+    """
+    Creates the answer ranker based on ```ranking_parameters``` in the config file.
+    If no weights are given, the default weights are used.
+
+    Returns:
+        AnswerRanker: The answer ranker
+
+    """
+    ranking_parameters = getattr(config, 'ranking_parameters', dict())
+    return AnswerRanker(ranking_parameters.get('weights'))
@@ -0,0 +1,646 @@
+import cPickle as pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import dbconfig as config
+from interactionlog import PendingKey
+
+"""
+This file contains the per-user storage of the answers presented in the chat.
+
+Each user (and XBlock instance) has its own ```AnswerSession```, holding the answers that have been
+presented to the user. The number of answers in a session is bounded (the oldest are removed first),
+and sessions that have not been used within the idle time are removed by the ```AnswerSessionStore```,
+so the memory use does not grow with the number of users or questions.
+
+The sessions are kept in memory (per process) by ```AnswerSessionStore```, or in a local SQLite database
+by ```SQLiteAnswerSessionStore```, so that all the processes on the host serving the XBlock share them
+(e.g. 'Read more?' for an answer found by another process). The store is set with ```session_parameters```.
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+
+class AnswerSession(object):
+    """
+    The answers presented to a single user. Each answer gets an index when it is added,
+    which is used by the chat to refer to the answer (e.g. for 'Read more?').
+    Indexes are never re-used, so an index of a removed answer does not point to another answer.
+    """
+
+    def __init__(self, max_answers=int):
+        """
+        Constructor for the answer session
+
+        Arguments:
+            max_answers (int): The maximum number of answers to keep in the session
+
+        """
+        self.__max_answers = max_answers
+        self.__answers = OrderedDict()  # index => Answer
+        self.__answer_index = dict()  # answer_id => index
+        self.__updated_answers = set()
+        self.__edx_answer_index = dict()  # edx_question_id => index
+        self.__next_index = 0
+        self.__last_access = time.time()
+        self.__lock = threading.Lock()
+
+    def get_last_access(self):
+        return self.__last_access
+
+    def touch(self):
+        """
+        Marks the session as used (resets the idle time)
+        """
+        self.__last_access = time.time()
+
+    def add_answer(self, answer=object):
+        """
+        Adds the answer to the session. If the session is full, the oldest answer is removed.
+
+        Arguments:
+            answer (Answer): The answer that was presented
+
+        Returns:
+            int: The index of the answer in this session
+
+        """
+        with self.__lock:
+            index = self.__next_index
+            self.__next_index += 1
+            self.__answers[index] = answer
+            self.__answer_index[answer.get_answer_id()] = index
+            while len(self.__answers) > self.__max_answers:
+                removed_index, removed_answer = self.__answers.popitem(last=False)
+                removed_id = removed_answer.get_answer_id()
+                if self.__answer_index.get(removed_id) == removed_index:
+                    del self.__answer_index[removed_id]
+                self.__updated_answers.discard(removed_id)
+            return index
+
+    def get_answer(self, index=int):
+        """
+        Returns the answer with the given index
+
+        Arguments:
+            index (int): The index of the answer in this session
+
+        Returns:
+            Answer: The answer, or None if it doesn't exist (or has been removed)
+
+        """
+        with self.__lock:
+            return self.__answers.get(index)
+
+    def get_index_of_answer(self, answer_id=long):
+        """
+        Returns the index of the answer with the given ID
+
+        Arguments:
+            answer_id (long): The ID of the answer (primary key in MySQL db)
+
+        Returns:
+            int: The index of the answer, or None if it doesn't exist (or has been removed)
+
+        """
+        with self.__lock:
+            return self.__answer_index.get(answer_id)
+
+    def replace_answer(self, index=int, answer=object):
+        """
+        Replaces the answer with the given index (e.g. after it has been updated).
+        Nothing is done if the answer has been removed from the session.
+
+        Arguments:
+            index (int): The index of the answer in this session
+            answer (Answer): The updated answer
+
+        """
+        with self.__lock:
+            if index in self.__answers:
+                self.__answers[index] = answer
+
+    def is_answer_updated(self, answer_id=long):
+        """
+        Checks if the answer with the given ID already has been updated
+
+        Arguments:
+            answer_id (long): The ID of the answer
+
+        Returns:
+            bool: True if the answer has been updated, False otherwise
+
+        """
+        with self.__lock:
+            return answer_id in self.__updated_answers
+
+    def set_answer_updated(self, answer_id=long):
+        """
+        Marks the answer with the given ID as updated
+
+        Arguments:
+            answer_id (long): The ID of the answer
+
+        """
+        with self.__lock:
+            if answer_id in self.__answer_index:
+                self.__updated_answers.add(answer_id)
+
+    def get_edx_answer_index(self, edx_question_id=int):
+        """
+        Returns the index of the precomputed answer to the edX question, if it has been presented in this session
+
+        Arguments:
+            edx_question_id (int): ID of the question in edX
+
+        Returns:
+            int: The index of the answer, or None if it hasn't been presented (or has been removed)
+
+        """
+        with self.__lock:
+            index = self.__edx_answer_index.get(edx_question_id)
+            if index is not None and index not in self.__answers:
+                del self.__edx_answer_index[edx_question_id]
+                return None
+            return index
+
+    def set_edx_answer_index(self, edx_question_id=int, index=int):
+        """
+        Marks the answer with the given index as the presented answer to the edX question
+
+        Arguments:
+            edx_question_id (int): ID of the question in edX
+            index (int): The index of the answer in this session
+
+        """
+        with self.__lock:
+            self.__edx_answer_index[edx_question_id] = index
+
+    def __len__(self):
+        return len(self.__answers)
+
+
+class AnswerSessionStore(object):
+    """
+    Keeps the ```AnswerSession``` for each user in memory (per process).
+    Sessions that have not been used within the idle time are removed, and the number of sessions
+    is bounded; when the store is full, the least recently used session is removed.
+    """
+
+    DEFAULT_MAX_ANSWERS = 50
+    """
+    The default maximum number of answers kept per session
+    """
+
+    DEFAULT_MAX_IDLE_TIME = 3600
+    """
+    The default number of seconds before an unused session is removed
+    """
+
+    DEFAULT_MAX_SESSIONS = 10000
+    """
+    The default maximum number of sessions kept
+    """
+
+    def __init__(self, max_answers=DEFAULT_MAX_ANSWERS, max_idle_time=DEFAULT_MAX_IDLE_TIME,
+                 max_sessions=DEFAULT_MAX_SESSIONS):
+        """
+        Constructor for the session store
+
+        Arguments:
+            max_answers (int): The maximum number of answers kept per session
+            max_idle_time (int): Seconds before an unused session is removed
+            max_sessions (int): The maximum number of sessions kept
+
+        """
+        self.__max_answers = max_answers
+        self.__max_idle_time = max_idle_time
+        self.__max_sessions = max_sessions
+        self.__sessions = OrderedDict()  # session_key => AnswerSession (least recently used first)
+        self.__lock = threading.Lock()
+
+    def get_session(self, session_key=str):
+        """
+        Returns the session with the given key. A new session is created if it doesn't exist.
+
+        Arguments:
+            session_key (str): The key identifying the user (and XBlock instance)
+
+        Returns:
+            AnswerSession: The session
+
+        """
+        with self.__lock:
+            self.__remove_idle_sessions()
+            session = self.__sessions.pop(session_key, None)
+            if session is None:
+                session = AnswerSession(self.__max_answers)
+            session.touch()
+            self.__sessions[session_key] = session
+            while len(self.__sessions) > self.__max_sessions:
+                self.__sessions.popitem(last=False)
+            return session
+
+    def remove_session(self, session_key=str):
+        """
+        Removes the session with the given key (if it exists)
+
+        Arguments:
+            session_key (str): The key identifying the user (and XBlock instance)
+
+        """
+        with self.__lock:
+            self.__sessions.pop(session_key, None)
+
+    def __remove_idle_sessions(self):
+        """
+        Removes the sessions that have not been used within the idle time.
+        Must be called while holding the lock.
+        """
+        expiry_time = time.time() - self.__max_idle_time
+        # sessions are ordered by last use, so stop at the first session that is still active
+        while len(self.__sessions) > 0:
+            session_key, session = next(self.__sessions.iteritems())
+            if session.get_last_access() >= expiry_time:
+                break
+            del self.__sessions[session_key]
+
+    def __len__(self):
+        return len(self.__sessions)
+
+
+class StoredAnswerKey(PendingKey):
+    """
+    The primary key of an answer in a ```SQLiteAnswerSessionStore``` that was presented by another process,
+    and has not been written to the database yet. The key is read from the store when it is needed
+    (e.g. by the ```InteractionLogger``` writing an update of the answer).
+    """
+
+    def __init__(self, session_store=object, session_key=str, index=int):
+        """
+        Constructor for the stored answer key
+
+        Arguments:
+            session_store (SQLiteAnswerSessionStore): The store the answer is kept in
+            session_key (str): The key identifying the session
+            index (int): The index of the answer in the session
+
+        """
+        PendingKey.__init__(self)
+        self.__session_store = session_store
+        self.__session_key = session_key
+        self.__index = index
+
+    def get_index(self):
+        return self.__index
+
+    def get_key(self):
+        key = PendingKey.get_key(self)
+        if key is None:
+            key = self.__session_store._get_answer_key(self.__session_key, self.__index)
+            if key is not None:
+                self.set_key(key)
+        return key
+
+
+class SQLiteAnswerSession(object):
+    """
+    The answers presented to a single user, kept in a ```SQLiteAnswerSessionStore```.
+    This class has the same functions as ```AnswerSession```, and can be used in its place.
+    """
+
+    def __init__(self, session_store=object, session_key=str):
+        """
+        Constructor for the session
+
+        Arguments:
+            session_store (SQLiteAnswerSessionStore): The store the answers are kept in
+            session_key (str): The key identifying the user (and XBlock instance)
+
+        """
+        self.__session_store = session_store
+        self.__session_key = session_key
+
+    def add_answer(self, answer=object):
+        return self.__session_store._add_answer(self.__session_key, answer)
+
+    def get_answer(self, index=int):
+        return self.__session_store._get_answer(self.__session_key, index)
+
+    def get_index_of_answer(self, answer_id=long):
+        return self.__session_store._get_index_of_answer(self.__session_key, answer_id)
+
+    def replace_answer(self, index=int, answer=object):
+        self.__session_store._replace_answer(self.__session_key, index, answer)
+
+    def is_answer_updated(self, answer_id=long):
+        return self.__session_store._is_answer_updated(self.__session_key, answer_id)
+
+    def set_answer_updated(self, answer_id=long):
+        self.__session_store._set_answer_updated(self.__session_key, answer_id)
+
+    def get_edx_answer_index(self, edx_question_id=int):
+        return self.__session_store._get_edx_answer_index(self.__session_key, edx_question_id)
+
+    def set_edx_answer_index(self, edx_question_id=int, index=int):
+        self.__session_store._set_edx_answer_index(self.__session_key, edx_question_id, index)
+
+    def __len__(self):
+        return self.__session_store._count_answers(self.__session_key)
+
+
+class SQLiteAnswerSessionStore(object):
+    """
+    Keeps the session of each user in a local SQLite database, shared by the processes on the host.
+    The answers are pickled before they are stored. The primary keys of the answers that have not been
+    written to the database yet are stored when they are set (see ```PendingKey```), so that the answers
+    can be updated by the other processes as well.
+    Sessions that have not been used within the idle time are removed, and the number of sessions is bounded.
+    """
+
+    __CLEANUP_INTERVAL = 60
+    """
+    The number of seconds between each removal of the idle sessions
+    """
+
+    def __init__(self, database_path=str, max_answers=AnswerSessionStore.DEFAULT_MAX_ANSWERS,
+                 max_idle_time=AnswerSessionStore.DEFAULT_MAX_IDLE_TIME,
+                 max_sessions=AnswerSessionStore.DEFAULT_MAX_SESSIONS):
+        """
+        Constructor for the SQLite session store. The tables are created if they do not exist.
+
+        Arguments:
+            database_path (str): Path to the SQLite database file
+            max_answers (int): The maximum number of answers kept per session
+            max_idle_time (int): Seconds before an unused session is removed
+            max_sessions (int): The maximum number of sessions kept
+
+        """
+        self.__max_answers = max_answers
+        self.__max_idle_time = max_idle_time
+        self.__max_sessions = max_sessions
+        self.__pending_keys = dict()  # (session_key, index) => PendingKey of the answers added by this process
+        self.__last_cleanup = 0.0
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(database_path, check_same_thread=False)
+        with self.__lock:
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS answer_sessions ("
+                                      "session_key TEXT PRIMARY KEY, "
+                                      "next_index INTEGER NOT NULL, "
+                                      "last_access REAL NOT NULL)")
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS answer_sessions_last_access_idx "
+                                      "ON answer_sessions (last_access)")
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS session_answers ("
+                                      "session_key TEXT NOT NULL, "
+                                      "answer_index INTEGER NOT NULL, "
+                                      "answer_key INTEGER, "
+                                      "is_updated INTEGER NOT NULL, "
+                                      "edx_question_id INTEGER, "
+                                      "answer BLOB NOT NULL, "
+                                      "PRIMARY KEY (session_key, answer_index))")
+            self.__connection.commit()
+
+    def get_session(self, session_key=str):
+        """
+        Returns the session with the given key. A new session is created if it doesn't exist.
+
+        Arguments:
+            session_key (str): The key identifying the user (and XBlock instance)
+
+        Returns:
+            SQLiteAnswerSession: The session
+
+        """
+        with self.__lock:
+            if time.time() - self.__last_cleanup > self.__CLEANUP_INTERVAL:
+                self.__remove_idle_sessions()
+            self.__connection.execute("INSERT OR IGNORE INTO answer_sessions VALUES (?, 0, ?)",
+                                      (session_key, time.time()))
+            self.__connection.execute("UPDATE answer_sessions SET last_access = ? WHERE session_key = ?",
+                                      (time.time(), session_key))
+            self.__connection.commit()
+        return SQLiteAnswerSession(self, session_key)
+
+    def remove_session(self, session_key=str):
+        """
+        Removes the session with the given key (if it exists)
+
+        Arguments:
+            session_key (str): The key identifying the user (and XBlock instance)
+
+        """
+        with self.__lock:
+            self.__connection.execute("DELETE FROM session_answers WHERE session_key = ?", (session_key,))
+            self.__connection.execute("DELETE FROM answer_sessions WHERE session_key = ?", (session_key,))
+            self.__connection.commit()
+
+    def _add_answer(self, session_key=str, answer=object):
+        """
+        Adds the answer to the session (see ```AnswerSession.add_answer```)
+        """
+        answer_id = answer.get_answer_id()
+        answer_key = self.__to_stored_key(answer_id)
+        stored_answer = sqlite3.Binary(pickle.dumps(self.__to_stored_answer(answer), pickle.HIGHEST_PROTOCOL))
+        with self.__lock:
+            # the index is counted in the same transaction, so the processes do not get the same index
+            self.__connection.execute("INSERT OR IGNORE INTO answer_sessions VALUES (?, 0, ?)",
+                                      (session_key, time.time()))
+            self.__connection.execute("UPDATE answer_sessions SET next_index = next_index + 1, last_access = ? "
+                                      "WHERE session_key = ?", (time.time(), session_key))
+            index = self.__connection.execute("SELECT next_index - 1 FROM answer_sessions WHERE session_key = ?",
+                                              (session_key,)).fetchone()[0]
+            self.__connection.execute("INSERT INTO session_answers VALUES (?, ?, ?, 0, NULL, ?)",
+                                      (session_key, index, answer_key, stored_answer))
+            self.__connection.execute("DELETE FROM session_answers WHERE session_key = ? AND answer_index <= ?",
+                                      (session_key, index - self.__max_answers))
+            self.__connection.commit()
+            is_pending = isinstance(answer_id, PendingKey) and answer_key is None
+            if is_pending:
+                self.__pending_keys[(session_key, index)] = answer_id
+        if is_pending:
+            answer_id.add_callback(lambda key: self.__set_answer_key(session_key, index, key))
+        return index
+
+    def _get_answer(self, session_key=str, index=int):
+        """
+        Returns the answer with the given index (see ```AnswerSession.get_answer```)
+        """
+        with self.__lock:
+            row = self.__connection.execute("SELECT answer, answer_key FROM session_answers "
+                                            "WHERE session_key = ? AND answer_index = ?",
+                                            (session_key, index)).fetchone()
+            pending_key = self.__pending_keys.get((session_key, index))
+        if row is None:
+            return None
+        answer = pickle.loads(str(row[0]))
+        if pending_key is not None:
+            answer_id = pending_key
+        elif row[1] is not None:
+            answer_id = row[1]
+        else:
+            answer_id = StoredAnswerKey(self, session_key, index)
+        values = list(answer.to_tuple())
+        values[answer.FIELDS.index('answer_id')] = answer_id
+        return answer.from_tuple(values)
+
+    def _get_index_of_answer(self, session_key=str, answer_id=long):
+        """
+        Returns the index of the answer with the given ID (see ```AnswerSession.get_index_of_answer```)
+        """
+        if isinstance(answer_id, StoredAnswerKey):
+            return answer_id.get_index()
+        with self.__lock:
+            for (pending_session_key, index), pending_key in self.__pending_keys.items():
+                if pending_key is answer_id and pending_session_key == session_key:
+                    return index
+        answer_key = answer_id.get_key() if isinstance(answer_id, PendingKey) else answer_id
+        if answer_key is None:
+            return None
+        with self.__lock:
+            row = self.__connection.execute("SELECT MAX(answer_index) FROM session_answers "
+                                            "WHERE session_key = ? AND answer_key = ?",
+                                            (session_key, answer_key)).fetchone()
+        return row[0]
+
+    def _replace_answer(self, session_key=str, index=int, answer=object):
+        """
+        Replaces the answer with the given index (see ```AnswerSession.replace_answer```)
+        """
+        answer_key = self.__to_stored_key(answer.get_answer_id())
+        stored_answer = sqlite3.Binary(pickle.dumps(self.__to_stored_answer(answer), pickle.HIGHEST_PROTOCOL))
+        with self.__lock:
+            self.__connection.execute("UPDATE session_answers SET answer = ?, answer_key = COALESCE(answer_key, ?) "
+                                      "WHERE session_key = ? AND answer_index = ?",
+                                      (stored_answer, answer_key, session_key, index))
+            self.__connection.commit()
+
+    def _is_answer_updated(self, session_key=str, answer_id=long):
+        """
+        Checks if the answer with the given ID already has been updated (see ```AnswerSession.is_answer_updated```)
+        """
+        index = self._get_index_of_answer(session_key, answer_id)
+        if index is None:
+            return False
+        with self.__lock:
+            row = self.__connection.execute("SELECT is_updated FROM session_answers "
+                                            "WHERE session_key = ? AND answer_index = ?",
+                                            (session_key, index)).fetchone()
+        return row is not None and row[0] == 1
+
+    def _set_answer_updated(self, session_key=str, answer_id=long):
+        """
+        Marks the answer with the given ID as updated (see ```AnswerSession.set_answer_updated```)
+        """
+        index = self._get_index_of_answer(session_key, answer_id)
+        if index is None:
+            return
+        with self.__lock:
+            self.__connection.execute("UPDATE session_answers SET is_updated = 1 "
+                                      "WHERE session_key = ? AND answer_index = ?", (session_key, index))
+            self.__connection.commit()
+
+    def _get_edx_answer_index(self, session_key=str, edx_question_id=int):
+        """
+        Returns the index of the answer to the edX question (see ```AnswerSession.get_edx_answer_index```)
+        """
+        with self.__lock:
+            row = self.__connection.execute("SELECT MAX(answer_index) FROM session_answers "
+                                            "WHERE session_key = ? AND edx_question_id = ?",
+                                            (session_key, edx_question_id)).fetchone()
+        return row[0]
+
+    def _set_edx_answer_index(self, session_key=str, edx_question_id=int, index=int):
+        """
+        Marks the answer as the answer to the edX question (see ```AnswerSession.set_edx_answer_index```)
+        """
+        with self.__lock:
+            self.__connection.execute("UPDATE session_answers SET edx_question_id = ? "
+                                      "WHERE session_key = ? AND answer_index = ?",
+                                      (edx_question_id, session_key, index))
+            self.__connection.commit()
+
+    def _count_answers(self, session_key=str):
+        """
+        Returns the number of answers in the session
+        """
+        with self.__lock:
+            return self.__connection.execute("SELECT COUNT(*) FROM session_answers WHERE session_key = ?",
+                                             (session_key,)).fetchone()[0]
+
+    def _get_answer_key(self, session_key=str, index=int):
+        """
+        Returns the primary key of the answer stored by the process that presented it
+
+        Arguments:
+            session_key (str): The key identifying the session
+            index (int): The index of the answer in the session
+
+        Returns:
+            long: The primary key || None (if the answer doesn't exist, or its key is not set)
+
+        """
+        with self.__lock:
+            row = self.__connection.execute("SELECT answer_key FROM session_answers "
+                                            "WHERE session_key = ? AND answer_index = ?",
+                                            (session_key, index)).fetchone()
+        return row[0] if row is not None else None
+
+    def __set_answer_key(self, session_key=str, index=int, answer_key=long):
+        """
+        Stores the primary key of the answer when it has been written (called by the ```PendingKey```)
+        """
+        with self.__lock:
+            self.__connection.execute("UPDATE session_answers SET answer_key = ? "
+                                      "WHERE session_key = ? AND answer_index = ?", (answer_key, session_key, index))
+            self.__connection.commit()
+            self.__pending_keys.pop((session_key, index), None)
+
+    def __remove_idle_sessions(self):
+        """
+        Removes the sessions that have not been used within the idle time, and the least recently used
+        sessions if there are more than ```max_sessions```. Must be called while holding the lock.
+        """
+        self.__last_cleanup = time.time()
+        self.__connection.execute("DELETE FROM answer_sessions WHERE last_access < ?",
+                                  (time.time() - self.__max_idle_time,))
+        self.__connection.execute("DELETE FROM answer_sessions WHERE session_key IN ("
+                                  "SELECT session_key FROM answer_sessions "
+                                  "ORDER BY last_access DESC LIMIT -1 OFFSET ?)", (self.__max_sessions,))
+        self.__connection.execute("DELETE FROM session_answers "
+                                  "WHERE session_key NOT IN (SELECT session_key FROM answer_sessions)")
+        self.__connection.commit()
+
+    @staticmethod
+    def __to_stored_key(value=object):
+        """
+        Returns the primary key if the value is a ```PendingKey``` (None if the key is not set yet)
+        """
+        if isinstance(value, PendingKey):
+            return value.get_key()
+        return value
+
+    def __to_stored_answer(self, answer=object):
+        """
+        Returns a copy of the answer where the ```PendingKey``` values are replaced by their key (so it can be pickled)
+        """
+        return answer.from_tuple([self.__to_stored_key(value) for value in answer.to_tuple()])
+
+
+def create_answer_session_store():
+    """
+    Creates the session store based on ```session_parameters``` in the config file.
+    If no settings are given, the sessions are kept in memory (per process) with the default values.
+
+    Returns:
+        AnswerSessionStore || SQLiteAnswerSessionStore: The session store
+
+    """
+    session_parameters = getattr(config, 'session_parameters', dict())
+    max_answers = session_parameters.get('max_answers', AnswerSessionStore.DEFAULT_MAX_ANSWERS)
+    max_idle_time = session_parameters.get('max_idle_time', AnswerSessionStore.DEFAULT_MAX_IDLE_TIME)
+    max_sessions = session_parameters.get('max_sessions', AnswerSessionStore.DEFAULT_MAX_SESSIONS)
+    if session_parameters.get('backend', 'memory') == 'sqlite':
+        return SQLiteAnswerSessionStore(session_parameters['sqlite_path'], max_answers, max_idle_time, max_sessions)
+    return AnswerSessionStore(max_answers, max_idle_time, max_sessions)
@@ -0,0 +1,390 @@
+import socket
+import sys
+import threading
+import time
+
+import MySQLdb
+
+import dbconfig as config
+from connectionpool import get_connection_pool
+from instrumentation import get_metrics
+from mysqldatabase import MySQLDatabase
+from questionranking import create_question_ranker
+from ratelimiter import RateLimitExceededError, get_rate_limiter
+from searchcache import SearchCache
+from searchstackexchange import SearchStackExchange
+
+"""
+This file contains the warming of the search cache: the search results (and the answers of the top results)
+of the questions asked most often are refreshed in the background before they expire from the cache, so
+that these questions are answered without waiting for the StackExchange API, also right after a restart.
+
+```CacheWarmer``` runs in a background thread, started by the first request to the XBlock. Which processes
+warm the cache depends on where it is kept (see ```cache_parameters```):
+    - SQLite backend: the cache is shared by the processes on the host, so only the process holding the
+      MySQL lock ('GET_LOCK') of the host warms it; if that process stops, another process takes over
+    - memory backend: each process has its own cache, so every process warms its cache, with its share of
+      the quota of the warming (```quota_share``` is split between the ```process_count``` processes
+      given in ```rate_limit_parameters```)
+Every ```interval``` seconds it:
+    - retrieves the questions asked most often among the latest answers in the database (the hot questions)
+    - selects the hot questions that are not cached, or expire before the next run (not cached first, then
+      the ones expiring soonest)
+    - refreshes as many of them as the share of the daily API quota given to the warming allows, spread
+      evenly over the interval, and stops early if the rate limiter has few requests left for the users
+
+The warming is enabled with ```cache_warming_parameters``` in the config file. It can also be run once
+(e.g. after a deploy, with the SQLite cache backend) with:
+    python cachewarming.py
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+
+class CacheWarmer(object):
+    """
+    Class refreshing the cached search results of the questions asked most often
+    """
+
+    DEFAULT_INTERVAL = 300
+    """
+    The default number of seconds between each run
+    """
+
+    DEFAULT_NUMBER_OF_QUESTIONS = 100
+    """
+    The default number of hot questions that are kept warm
+    """
+
+    DEFAULT_HISTORY_SIZE = 10000
+    """
+    The default number of latest answers the questions are counted in (older answers are not counted)
+    """
+
+    DEFAULT_QUOTA_SHARE = 0.2
+    """
+    The default share of the daily API quota that can be used by the warming
+    """
+
+    DEFAULT_MIN_AVAILABLE_REQUESTS = 100
+    """
+    The default number of requests that are left to the users (the warming waits if fewer are available)
+    """
+
+    DEFAULT_NUMBER_OF_PREFETCHED_QUESTIONS = 5
+    """
+    The default number of top results whose answers are cached (as in ```ChatAgentXBlock```)
+    """
+
+    __REQUESTS_PER_REFRESH = 2
+    """
+    The number of API requests made to refresh a question (the search, and the answers of the top results)
+    """
+
+    __SECONDS_PER_DAY = 86400.0
+
+    __LOCK_NAME = "chatagent_cache_warming:"
+    """
+    The prefix of the name of the MySQL lock held by the process warming the cache (followed by the host name,
+    since the SQLite cache is shared by the processes of a host)
+    """
+
+    __MAX_LOCK_NAME_LENGTH = 64
+
+    def __init__(self, site_name="StackOverflow", question_ranker=None, interval=DEFAULT_INTERVAL,
+                 number_of_questions=DEFAULT_NUMBER_OF_QUESTIONS, history_size=DEFAULT_HISTORY_SIZE,
+                 quota_share=DEFAULT_QUOTA_SHARE, min_available_requests=DEFAULT_MIN_AVAILABLE_REQUESTS,
+                 number_of_prefetched_questions=DEFAULT_NUMBER_OF_PREFETCHED_QUESTIONS, exclusive=True):
+        """
+        Constructor for the cache warmer. The background thread is started with ```start```.
+
+        Arguments:
+            site_name (str): Name of the StackExchange community site to search
+            question_ranker (QuestionRanker): The ranker ordering the results (the one used by the XBlock,
+                so that the answers of the same top results are cached). None creates a new ranker.
+            interval (float): Seconds between each run
+            number_of_questions (int): The number of hot questions that are kept warm
+            history_size (int): The number of latest answers the questions are counted in
+            quota_share (float): The share of the daily API quota that can be used by the warming (0-1)
+            min_available_requests (int): The number of requests left to the users
+            number_of_prefetched_questions (int): The number of top results whose answers are cached
+            exclusive (bool): Should the background thread only warm the cache while it holds the MySQL lock?
+                (so that only one process on the host warms a cache shared by the processes, i.e. SQLite)
+
+        """
+        self.__site_name = site_name
+        self.__question_ranker = question_ranker if question_ranker is not None else create_question_ranker()
+        self.__interval = interval
+        self.__number_of_questions = number_of_questions
+        self.__history_size = history_size
+        self.__quota_share = quota_share
+        self.__min_available_requests = min_available_requests
+        self.__number_of_prefetched_questions = number_of_prefetched_questions
+        self.__exclusive = exclusive
+        self.__lock_name = (self.__LOCK_NAME + socket.gethostname())[:self.__MAX_LOCK_NAME_LENGTH]
+        self.__lock_connection = None  # the connection holding the MySQL lock (while held)
+        self.__stop_event = threading.Event()
+        self.__thread = None
+
+    def start(self):
+        """
+        Starts the background thread. The first run starts immediately, so the hot questions are warmed
+        right after the process is started.
+        """
+        if self.__thread is not None:
+            return
+        self.__stop_event.clear()
+        self.__thread = threading.Thread(target=self.__run, name="CacheWarmer")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread (the refresh that is running is finished first)
+        """
+        self.__stop_event.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def run_cycle(self, spread=True):
+        """
+        Refreshes the hot questions that are not cached, or expire before the next run
+
+        Arguments:
+            spread (bool): Should the refreshes be spread evenly over the interval? (False: refresh at once)
+
+        Returns:
+            dict: The number of questions, e.g. ```{'hot': 100, 'stale': 12, 'refreshed': 10, 'failed': 0,
+            'deferred': 2}```, where 'deferred' are the stale questions left for the next run (quota)
+
+        """
+        hot_questions = self.get_hot_questions()
+        stale_questions = self.get_stale_questions(hot_questions)
+        refreshes = stale_questions[:self.get_refresh_budget()]
+        result = {'hot': len(hot_questions), 'stale': len(stale_questions), 'refreshed': 0, 'failed': 0,
+                  'deferred': len(stale_questions) - len(refreshes)}
+        pause = self.__interval / float(len(refreshes)) if spread and len(refreshes) > 0 else 0.0
+        rate_limiter = get_rate_limiter()
+        for index, question in enumerate(refreshes):
+            if index > 0 and self.__stop_event.wait(pause):
+                result['deferred'] += len(refreshes) - index
+                break
+            if self.__stop_event.is_set() or rate_limiter.get_available_requests() < self.__min_available_requests:
+                result['deferred'] += len(refreshes) - index
+                break
+            try:
+                refreshed = self.refresh(question)
+            except RateLimitExceededError, err:
+                # the API has asked to wait (or the quota is used), so the rest is left for the next run
+                print("Error (Cache warming): %s" % err)
+                result['failed'] += 1
+                result['deferred'] += len(refreshes) - index - 1
+                break
+            result['refreshed' if refreshed else 'failed'] += 1
+            get_metrics().increment("cache_warming", {'result': "refreshed" if refreshed else "failed"})
+        return result
+
+    def get_hot_questions(self):
+        """
+        Returns:
+            list: The questions asked most often (the most frequent first), one per cache entry
+
+        """
+        hot_questions = list()
+        cache_keys = set()
+        for row in MySQLDatabase().get_frequent_questions(self.__number_of_questions, self.__history_size):
+            # questions only differing in casing or spacing share the same cache entry
+            key = SearchCache.create_key(self.__site_name, row['question_text'], False)
+            if key not in cache_keys:
+                cache_keys.add(key)
+                hot_questions.append(row['question_text'])
+        return hot_questions
+
+    def get_stale_questions(self, hot_questions=list):
+        """
+        Returns the hot questions that are not cached, or expire before the end of the next run
+
+        Arguments:
+            hot_questions (list): The hot questions (the most frequent first)
+
+        Returns:
+            list: The questions to refresh; the ones not cached first (the most frequent first),
+            then the ones expiring soonest
+
+        """
+        search_cache = SearchStackExchange.get_search_cache()
+        ttl = search_cache.get_ttl()
+        missing_questions = list()
+        expiring_questions = list()
+        for question in hot_questions:
+            age = search_cache.get_age(self.__site_name, question, False)
+            if age is None:
+                missing_questions.append(question)
+            elif ttl - age < 2 * self.__interval:
+                expiring_questions.append((ttl - age, question))
+        return missing_questions + [question for expires_in, question in sorted(expiring_questions)]
+
+    def get_refresh_budget(self):
+        """
+        Returns the number of questions that can be refreshed in one run within the share of the daily quota
+
+        Returns:
+            int: The number of questions (at least 1)
+
+        """
+        requests_per_run = get_rate_limiter().get_daily_quota() * self.__quota_share \
+            * self.__interval / self.__SECONDS_PER_DAY
+        return max(int(requests_per_run / self.__REQUESTS_PER_REFRESH), 1)
+
+    def refresh(self, question=str):
+        """
+        Searches for the question (without using the cache), and caches the search results together
+        with the answers of the top results
+
+        Arguments:
+            question (str): The question
+
+        Raises:
+            RateLimitExceededError: If the request limit of the API was reached
+
+        Returns:
+            bool: True if the search had results (and they were cached), False otherwise
+
+        """
+        search_stackexchange = SearchStackExchange(self.__site_name)
+        if not search_stackexchange.process_search_results_for_question(question, False, False):
+            return False
+        search_stackexchange.rank_results(self.__question_ranker, question)
+        search_stackexchange.prefetch_answers(self.__number_of_prefetched_questions)
+        return True
+
+    def __run(self):
+        """
+        Runs the warming every ```interval``` seconds until stopped (run by the background thread).
+        If ```exclusive```, the runs are skipped while another process on the host holds the MySQL lock.
+        """
+        while not self.__stop_event.is_set():
+            start_time = time.time()
+            try:
+                if not self.__exclusive or self.__hold_lock():
+                    self.run_cycle()
+            except Exception as err:
+                # the thread must keep running (e.g. if the database is unavailable for a while)
+                print("Error (Cache warming): %s" % err)
+            self.__stop_event.wait(max(self.__interval - (time.time() - start_time), 0))
+        self.__release_lock()
+
+    def __hold_lock(self):
+        """
+        Checks that this process still holds the MySQL lock of the warming on the host, or tries to acquire it.
+        The lock is held by the connection, so it is released if the process (or connection) stops.
+
+        Returns:
+            bool: True if this process holds the lock, False otherwise
+
+        """
+        pool = get_connection_pool()
+        if self.__lock_connection is not None:
+            try:
+                cursor = self.__lock_connection.cursor()
+                cursor.execute("SELECT IS_USED_LOCK(%s) = CONNECTION_ID();", (self.__lock_name,))
+                if cursor.fetchone()[0] == 1:
+                    return True
+            except MySQLdb.Error as err:
+                print("MySQLdb.Error (Cache warming lock): %s" % err)
+            # the connection was lost (and the lock with it), so it is acquired again below
+            pool.release_connection(self.__lock_connection, True)
+            self.__lock_connection = None
+        connection = pool.get_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT GET_LOCK(%s, 0);", (self.__lock_name,))
+            acquired = cursor.fetchone()[0] == 1
+        except MySQLdb.Error as err:
+            print("MySQLdb.Error (Cache warming lock): %s" % err)
+            pool.release_connection(connection, True)
+            return False
+        if acquired:
+            # the connection is kept (out of the pool) while the lock is held
+            self.__lock_connection = connection
+        else:
+            pool.release_connection(connection)
+        return acquired
+
+    def __release_lock(self):
+        """
+        Releases the MySQL lock (if held), so that another process can take over the warming
+        """
+        if self.__lock_connection is None:
+            return
+        try:
+            cursor = self.__lock_connection.cursor()
+            cursor.execute("SELECT RELEASE_LOCK(%s);", (self.__lock_name,))
+            cursor.fetchone()
+            get_connection_pool().release_connection(self.__lock_connection)
+        except MySQLdb.Error as err:
+            print("MySQLdb.Error (Cache warming lock): %s" % err)
+            get_connection_pool().release_connection(self.__lock_connection, True)
+        self.__lock_connection = None
+
+
+def create_cache_warmer(question_ranker=None):
+    """
+    Creates the cache warmer based on ```cache_warming_parameters``` in the config file.
+    The warming is disabled (None is returned) if not enabled, or if the local search index is used.
+    With the SQLite cache backend only one process per host warms the cache (```exclusive```), otherwise
+    every process warms its own cache with its share of ```quota_share``` (see ```rate_limit_parameters```).
+
+    Arguments:
+        question_ranker (QuestionRanker): The ranker ordering the results (None creates a new ranker)
+
+    Returns:
+        CacheWarmer: The cache warmer (not started) || None
+
+    """
+    cache_warming_parameters = dict(getattr(config, 'cache_warming_parameters', dict()))
+    if not cache_warming_parameters.pop('enabled', False):
+        return None
+    if getattr(config, 'local_index_parameters', dict()).get('index_path') is not None:
+        return None
+    is_cache_shared = getattr(config, 'cache_parameters', dict()).get('backend', 'memory') == 'sqlite'
+    if not is_cache_shared:
+        process_count = getattr(config, 'rate_limit_parameters', dict()).get('process_count', 1)
+        quota_share = cache_warming_parameters.get('quota_share', CacheWarmer.DEFAULT_QUOTA_SHARE)
+        cache_warming_parameters['quota_share'] = quota_share / float(max(process_count, 1))
+    return CacheWarmer(question_ranker=question_ranker, exclusive=is_cache_shared, **cache_warming_parameters)
+
+
+def start_cache_warmer(question_ranker=None):
+    """
+    Creates (see ```create_cache_warmer```) and starts the cache warmer, if enabled in the config file.
+    The warmer is started in every process that calls this (with the SQLite cache backend, only the process
+    holding the MySQL lock of the host warms the cache).
+
+    Arguments:
+        question_ranker (QuestionRanker): The ranker ordering the results (None creates a new ranker)
+
+    Returns:
+        CacheWarmer: The running cache warmer || None
+
+    """
+    cache_warmer = create_cache_warmer(question_ranker)
+    if cache_warmer is not None:
+        cache_warmer.start()
+    return cache_warmer
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 1:
+        print("Usage: python cachewarming.py")
+        sys.exit(1)
+    warming_parameters = dict(getattr(config, 'cache_warming_parameters', dict()))
+    warming_parameters.pop('enabled', None)
+    warming_start_time = time.time()
+    # run once, whether or not a background warmer holds the lock
+    warming_parameters['exclusive'] = False
+    warming_result = CacheWarmer(**warming_parameters).run_cycle(spread=False)
+    print("Refreshed %d of %d hot questions in %.1f seconds (failed: %d, left for later: %d)"
+          % (warming_result['refreshed'], warming_result['hot'], time.time() - warming_start_time,
+             warming_result['failed'], warming_result['deferred']))
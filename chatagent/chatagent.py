@@ -8,15 +8,37 @@ related to Programming by looking at posted answers on StackOverflow
 """
 
 
+import cgi
+import hmac
+import threading
+
+import MySQLdb
 import pkg_resources
+import stackexchange
 
+from webob import Response
 from xblock.core import XBlock
+from xblock.exceptions import JsonHandlerError
 from xblock.fragment import Fragment
-from xblock.fields import Scope, Dict
+from xblock.fields import Scope, Dict, Integer
 
+import dbconfig as config
 from answer import Answer
+from answerformatting import get_answer_formatter
+from answerjobs import AnswerJobManager, create_answer_job_manager
+from answerranking import create_answer_ranker
+from answersession import create_answer_session_store
+from cachewarming import start_cache_warmer
+from duplicatequestions import create_duplicate_question_index
+from edxquestions import create_edx_question_store
+from instrumentation import get_metrics
+from interactionlog import get_interaction_logger
 from mysqldatabase import MySQLDatabase
+from questionranking import create_question_ranker
+from ratelimiter import RateLimitExceededError
 from searchstackexchange import SearchStackExchange
+from stackoverflowindex import LocalSearchStackExchange
+from textprocessing import escape_html
 
 
 class ChatAgentXBlock(XBlock):
@@ -32,11 +54,10 @@ class ChatAgentXBlock(XBlock):
     This is the only site that will be used in this project.
     """
 
-    __ANSWER_TEXT_LENGTH = 150
+    __NUMBER_OF_PREFETCHED_QUESTIONS = 5
     """
-    The length of the returned answer displayed to the user.
-    The length equals the number of characters before the
-    text gets cut off with a 'Read more?'
+    The number of search results (questions) to retrieve the answers for in advance,
+    so that moving on to the next result does not require another request
     """
 
     user_dict = Dict(
@@ -50,23 +71,70 @@ class ChatAgentXBlock(XBlock):
     This dictionary contains the user data related to the logged in user
     """
 
-    retrieved_results_list = list()
+    edx_question_id = Integer(
+        default=None,
+        scope=Scope.settings,
+    )
+    """
+    The edX question of the course page the XBlock is placed on (see ```edxquestions```), or None
+    """
+
+    __answer_jobs = create_answer_job_manager()
+    """
+    Runs the retrieval of answers in the background, shared by all instances in the process
+    (the results are kept in the backend set in the config file, see ```AnswerJobManager```)
+    """
+
+    __answer_ranker = create_answer_ranker()
+    """
+    Ranks the answers of the top search results (see ```AnswerRanker```)
+    """
+
+    __question_ranker = create_question_ranker()
+    """
+    Re-ranks the search results against the question (see ```QuestionRanker```)
+    """
+
+    __duplicate_questions = create_duplicate_question_index()
+    """
+    Index of answered questions, for answering near-duplicate questions without searching
+    (see ```DuplicateQuestionIndex```). None if disabled in the config file.
+    """
+
+    __duplicate_questions_loaded = [False]
+    """
+    Have the answered questions in the database been added to the index? (list, so it can be set on the class)
+    """
+
+    __duplicate_questions_lock = threading.Lock()
+    """
+    Lock held while the answered questions are added to the index, so they are only added once
+    """
+
+    __answer_sessions = create_answer_session_store()
     """
-    This list contains all the search results that has been retrieved
-    (currently not in use)
+    The answers presented to each user (see ```AnswerSession```), shared by all instances in the process
     """
 
-    retrieved_answers_list = list()
+    __edx_questions = create_edx_question_store()
     """
-    This list contains all the answers that have been presented to the user
+    The imported edX questions and their precomputed answers (see ```EdxQuestionStore```)
     """
 
-    updated_answers_list = list()
+    __cache_warmer = [None]
     """
-    This list contains all answers that have been updated
-    (to avoid re-updating answers that have already been read)
+    Refreshes the cached search results of the questions asked most often in the background
+    (see ```CacheWarmer```), started by the first request. None if disabled in the config file.
+    (list, so it can be set on the class)
     """
 
+    __cache_warmer_started = [False]
+    """
+    Has the cache warmer been started (or found to be disabled)? (list, so it can be set on the class)
+    """
+
+    __cache_warmer_lock = threading.Lock()
+
     def resource_string(self, path):
         """
         Handy helper for getting resources from our kit.
@@ -97,6 +165,8 @@ class ChatAgentXBlock(XBlock):
     def get_default_welcome_message(self, data, suffix=''):
         """
         Get the default welcome message that the user is presented with upon entering the chat.
+        If the XBlock is placed on the page of an edX question (```edx_question_id```), the question is shown,
+        together with its answer if it has been found in advance (see ```edxquestions```).
 
         Arguments:
             data (dict): JSON dictionary containing the username {'username': username}
@@ -106,15 +176,23 @@ class ChatAgentXBlock(XBlock):
              JSON: The retrieved welcome message; {'welcome_msg': welcome_msg}
 
         """
+        self.__start_cache_warmer()
         # TODO 1: In the master thesis, either retrieve this from DB, or just use this one
-        # TODO 2: Add question to welcome message
         welcome_msg = "Welcome, "
         # check that username is set
         if data['username'] is not None:
             welcome_msg += "<i>" + data['username'] + "</i>."
-        welcome_msg += "<br />I see that you came from a page with the following Question: <br />"
-        welcome_msg += "<i>&lt;question_displayed_here&gt;</i>"  # TODO 2: insert question here
-        welcome_msg += "<br /> Is this the question you are looking for? Please enter 'Yes' or 'No'."
+        edx_question = self.__get_edx_question(self.edx_question_id)
+        if edx_question is not None:
+            welcome_msg += "<br />I see that you came from a page with the following Question: <br />"
+            welcome_msg += "<i>" + cgi.escape(edx_question['question_text']) + "</i>"
+            if edx_question['answer_text'] is not None:
+                # the answer was found in advance, so it is shown without searching
+                welcome_msg += "<br />This is the answer I found: <br />"
+                welcome_msg += self.__present_edx_answer(self.user_dict.get('user_id'), edx_question)
+            welcome_msg += "<br /> Is this the question you are looking for? Please enter 'Yes' or 'No'."
+        else:
+            welcome_msg += "<br />Please enter your question."
         welcome_msg += "<p><br /></p>"
         return {'welcome_msg': welcome_msg}
 
@@ -149,7 +227,10 @@ class ChatAgentXBlock(XBlock):
     @XBlock.json_handler
     def handle_user_input(self, data, suffix=''):
         """
-        Function for processing user input to retrieve answer from StackOverflow
+        Function for processing user input to retrieve answer from StackOverflow.
+        The answer is retrieved in the background (see ```__process_user_input```), and this
+        function returns the id of the job immediately. The result is retrieved by polling
+        ```get_answer_result``` with the returned job id.
 
         Arguments:
             data (dict): JSON dictionary containing users input {'user_input': user_input}
@@ -158,60 +239,220 @@ class ChatAgentXBlock(XBlock):
         Returns:
              dict:
              |  results_dict = {
+             |         'job_id': job_id,
+             |         'status': status,
+             |     }
+
+        """
+        self.__start_cache_warmer()
+        user_input = data['user_input']
+        user_id = self.user_dict.get('user_id')
+        answer_session = self.__get_answer_session()
+        job_id = self.__answer_jobs.submit(self.__process_user_input, answer_session, user_id, user_input,
+                                           self.edx_question_id)
+        results_dict = {
+            'job_id': job_id,
+            'status': AnswerJobManager.PENDING
+        }
+        return results_dict
+
+    @XBlock.json_handler
+    def get_answer_result(self, data, suffix=''):
+        """
+        Returns the result of the answer retrieval started by ```handle_user_input```.
+        While the answer is being retrieved, only the status ('pending') is returned.
+
+        Arguments:
+            data (dict): JSON dictionary containing the job id {'job_id': job_id}
+            suffix (str):
+
+        Returns:
+             dict:
+             |  results_dict = {
+             |         'status': status,
              |         'title': title,
              |         'response': response,
              |         'read_more': read_more,
+             |         'contains_html': contains_html
+             |     }
+
+        """
+        status, result = self.__answer_jobs.get_job_result(data['job_id'])
+        if status == AnswerJobManager.PENDING:
+            return {'status': status}
+        if status == AnswerJobManager.DONE:
+            results_dict = result
+        else:
+            if status == AnswerJobManager.FAILED:
+                response = "An error occurred during processing. Please try again."
+            else:
+                response = "The answer to this question is no longer available. Please ask the question again."
+            results_dict = {
+                'title': "",
+                'response': response,
+                'read_more': "",
+                'contains_html': False
+            }
+        results_dict['status'] = AnswerJobManager.DONE
+        return results_dict
+
+    @XBlock.json_handler
+    def get_metrics(self, data, suffix=''):
+        """
+        Returns the timings of the stages of the chat pipeline and the counters (see ```instrumentation```).
+        The metrics are only collected if enabled in the config file (```instrumentation_parameters```),
+        and are only returned to staff, or if the access token in the config file is given.
+
+        Arguments:
+            data (dict): JSON dictionary, e.g. ```{'token': access_token}``` (not needed for staff)
+            suffix (str):
+
+        Returns:
+             dict: The metrics, see ```Metrics.get_snapshot```
+
+        Raises:
+            JsonHandlerError: 403 if the user is not allowed to see the metrics
+
+        """
+        if not self.__is_metrics_access_allowed(data.get('token') if isinstance(data, dict) else None):
+            raise JsonHandlerError(403, "Only staff can see the metrics.")
+        return get_metrics().get_snapshot()
+
+    @XBlock.handler
+    def metrics(self, request, suffix=''):
+        """
+        Returns the timings of the stages of the chat pipeline and the counters in the Prometheus text format,
+        so that they can be scraped (see ```Metrics.to_prometheus```).
+
+        The metrics are only returned to staff, or if the access token in the config file is given
+        (as the header 'Authorization: Bearer <token>', which Prometheus sends with ```bearer_token```).
+
+        Arguments:
+            request (webob.Request): The request
+            suffix (str):
+
+        Returns:
+             webob.Response: The metrics (text/plain) || 403 if the user is not allowed to see the metrics
+
+        """
+        authorization = request.headers.get('Authorization', "")
+        token = authorization[len("Bearer "):] if authorization.startswith("Bearer ") else None
+        if not self.__is_metrics_access_allowed(token):
+            return Response(text=u"Only staff can see the metrics.", status=403, content_type="text/plain",
+                            charset="utf8")
+        return Response(text=get_metrics().to_prometheus(), content_type="text/plain; version=0.0.4", charset="utf8")
+
+    def __process_user_input(self, answer_session=object, user_id=int, user_input=str, edx_question_id=None):
+        """
+        Stores the question, searches for it on StackExchange, and retrieves (and stores) the answer.
+        If the question is the edX question of the page, and its answer has been found in advance
+        (see ```edxquestions```), the stored answer is used instead of searching.
+        This function is run in the background by the ```AnswerJobManager```.
+
+        Arguments:
+            answer_session (AnswerSession): The session of the user, where the presented answer is stored
+            user_id (int): User ID of the user asking the question
+            user_input (str): The question that was asked
+            edx_question_id (int): The edX question of the page the XBlock is placed on || None
+
+        Returns:
+             dict:
+             |  results_dict = {
+             |         'title': title,
+             |         'response': response,
+             |         'read_more': read_more,
+             |         'contains_html': contains_html
              |     }
 
         """
         # get and set relevant data
         title = ""
         read_more = ""
+        answer_index = -1
         asked_by_user = True
         contains_html = False
-        edx_question_id = None
         use_adv_search = False
-        user_input = data['user_input']
-        user_id = self.user_dict.get('user_id')
         selected_site = self.__DEFAULT_SITE_TO_USE
-        try:
-            # store question and retrieve its id
-            question_id = self.__store_question_in_database(user_id, user_input, asked_by_user, edx_question_id)
-            search_stackexchange = SearchStackExchange(selected_site)
-            # was the search executed successfully?
-            results_found = search_stackexchange.process_search_results_for_question(user_input, use_adv_search)
-            if results_found:
-                # test question: 'Py-StackExchange filter by tag'
-                res_list = search_stackexchange.get_list_of_results()
-                if len(res_list) == 1:
-                    res_obj = res_list[0]
+        metrics = get_metrics()
+        with metrics.trace("chat_turn"):
+            try:
+                # is this the question of the edX page, with an answer found in advance?
+                edx_answer = self.__find_edx_answer(edx_question_id, user_input)
+                if edx_answer is not None:
+                    asked_by_user = False
                 else:
-                    # TODO: handle multiple results here... for now, just retrieve the first one
-                    res_obj = res_list[0]
-
-                # just retrieve the first result - this will be updated in master thesis version
-                answer_list = search_stackexchange.get_question_data(0)
-                if len(answer_list) > 0:
+                    edx_question_id = None
+                # store question and retrieve its id
+                with metrics.timer("store_question"):
+                    question_id = self.__store_question_in_database(user_id, user_input, asked_by_user,
+                                                                    edx_question_id)
+                if edx_answer is not None:
+                    duplicate = (1.0, edx_answer)
+                else:
+                    # has a similar question been answered before?
+                    with metrics.timer("find_duplicate"):
+                        duplicate = self.__find_duplicate_question(user_input)
+                if duplicate is not None:
+                    similarity, duplicate_answer = duplicate
+                    results_found = True
                     contains_html = True
-                    answer_body = self.__retrieve_answer(True, answer_list, res_obj.get_link(), question_id)
+                    question_title = duplicate_answer.get('title')
+                    answer_body = duplicate_answer.get('answer_text')
+                    answer_index = self.__store_answer_in_database(answer_session, answer_body,
+                                                                   duplicate_answer.get('stackexchange_link'),
+                                                                   question_id, False, False)
                 else:
-                    answer_body = "No answers were found for this question."
-                # display result to user
-                answer_index = len(self.retrieved_answers_list) - 1
-                title = "<i>" + res_obj.get_title() + "</i><p /><div id='answer_body' " \
-                                                      "class='answer_body' data-index='" + str(answer_index) + "'>"
-                response = answer_body[:self.__ANSWER_TEXT_LENGTH]
-                read_more = ("</div>"
-                             "<div id='read_more' id='read_more'>"
-                             "<strong style='cursor: pointer' id='read_more_text' "
-                             "class='read_more_text'>Read more?</strong>"
-                             "<input id='answer_index' class='answer_index' name='answer_index'"
-                             "value='" + str(answer_index) + "' type='hidden'></div>"
-                             if len(answer_body) > self.__ANSWER_TEXT_LENGTH else "")
-            else:
-                response = "No results matching this question."
-        except AttributeError, err:
-            response = "An error occurred during processing. The error is: " + str(err)
+                    search_stackexchange = self.__create_search_stackexchange(selected_site)
+                    # was the search executed successfully?
+                    with metrics.timer("search"):
+                        results_found = search_stackexchange.process_search_results_for_question(user_input,
+                                                                                                 use_adv_search)
+                if results_found and duplicate is None:
+                    # order the results by their relevance to the question
+                    with metrics.timer("rank_results"):
+                        search_stackexchange.rank_results(self.__question_ranker, user_input)
+                    with metrics.timer("get_answers"):
+                        # retrieve the answers for the top results in one request
+                        search_stackexchange.prefetch_answers(self.__NUMBER_OF_PREFETCHED_QUESTIONS)
+                        # test question: 'Py-StackExchange filter by tag'
+                        res_list = search_stackexchange.get_list_of_results()
+                        # only the results that are needed are retrieved (see LazySearchResults)
+                        candidate_list = res_list[:self.__NUMBER_OF_PREFETCHED_QUESTIONS]
+                        # the answers to the top results are the candidates
+                        answer_list = list()
+                        for index in range(0, len(candidate_list)):
+                            answer_list.extend(search_stackexchange.get_question_data(index))
+                    if len(answer_list) > 0:
+                        contains_html = True
+                        with metrics.timer("retrieve_answer"):
+                            res_obj, answer_body, answer_index = self.__retrieve_answer(answer_session, answer_list,
+                                                                                        candidate_list, user_input,
+                                                                                        question_id)
+                        self.__add_answered_question(user_input, res_obj.get_title(), answer_body, res_obj.get_link())
+                    else:
+                        res_obj = res_list[0]
+                        answer_body = "No answers were found for this question."
+                    question_title = res_obj.get_title()
+                if results_found:
+                    # the stored answer is sanitized, and has its preview (see AnswerFormatter)
+                    stored_answer = answer_session.get_answer(answer_index)
+                    if stored_answer is not None:
+                        answer_body = stored_answer.get_answer_text()
+                        response = stored_answer.get_answer_preview()
+                    else:
+                        response = answer_body
+                    # display result to user
+                    title = self.__create_answer_title(question_title, answer_index)
+                    read_more = self.__create_read_more(answer_index) if response != answer_body else ""
+                else:
+                    response = "No results matching this question."
+            except AttributeError, err:
+                response = "An error occurred during processing. The error is: " + str(err)
+            except RateLimitExceededError, err:
+                response = str(err)
+            except (stackexchange.StackExchangeError, MySQLdb.Error), err:
+                print("Error (Chat): %s" % err)
+                response = "An error occurred while retrieving the answer. Please try again."
         # set values in dictionary
         results_dict = {
             'title': title,
@@ -245,74 +486,283 @@ class ChatAgentXBlock(XBlock):
         response = ''
         index = int(data['index'])
         read_more = data['read_more']
-        answer_list = self.retrieved_answers_list
-        # is the index valid?
-        if len(answer_list) > index > -1:
-            answer = answer_list[index]
+        answer_session = self.__get_answer_session()
+        answer = answer_session.get_answer(index)
+        # is the index valid (and the answer still stored in the session)?
+        if answer is not None:
             # which version of answer should be displayed?
             if read_more:
                 response = answer.get_answer_text()
-                if len(answer_list) > index > -1:
-                    answer = answer_list[index]
-                    update_dict = {
-                        'answer_id': answer.get_answer_id(),
-                        # 'answer_text': answer.get_answer_text(),
-                        # 'question_id': answer.get_question_id(),
-                        'is_answer_read': True,
-                        # 'correct_answer': 0,
-                        # 'stackexchange_id': answer.get_stackexchange_id(),
-                    }
-                    self.__update_answer_in_database(False, "is_answer_read", update_dict)
+                update_dict = {
+                    'answer_id': answer.get_answer_id(),
+                    # 'answer_text': answer.get_answer_text(),
+                    # 'question_id': answer.get_question_id(),
+                    'is_answer_read': True,
+                    # 'correct_answer': 0,
+                    # 'stackexchange_id': answer.get_stackexchange_id(),
+                }
+                self.__update_answer_in_database(answer_session, False, "is_answer_read", update_dict)
             else:
-                response = answer.get_answer_text()[:self.__ANSWER_TEXT_LENGTH]
+                response = answer.get_answer_preview()
         results_dict = {
             'index': index,
             'response': response
         }
         return results_dict
 
-    def __retrieve_answer(self, select_accepted_answer=bool, answer_list=list(), link=str, question_id=long):
+    def __start_cache_warmer(self):
         """
-        This function retrieves from the passed list the Answer that either is marked as accepted answer
-        (if it exists and ```select_accepted_answer``` is True). If not, the most highest voted answer
-        is returned. If only one answer exists, this is returned without any checks.
+        Starts the cache warmer (if enabled in the config file) the first time the XBlock is used in the process,
+        rather than when the module is imported (e.g. by the management commands)
+        """
+        if self.__cache_warmer_started[0]:
+            return
+        with self.__cache_warmer_lock:
+            if not self.__cache_warmer_started[0]:
+                self.__cache_warmer[0] = start_cache_warmer(self.__question_ranker)
+                self.__cache_warmer_started[0] = True
+
+    def __is_metrics_access_allowed(self, token=None):
+        """
+        Checks if the metrics can be returned: to staff (```runtime.user_is_staff```), or to a client
+        (e.g. a monitoring server) giving the ```access_token``` set in ```instrumentation_parameters```
+
+        Arguments:
+            token (str): The access token given with the request (if any)
+
+        Returns:
+            bool: True if the metrics can be returned, False otherwise
+
+        """
+        if getattr(self.runtime, 'user_is_staff', False):
+            return True
+        access_token = getattr(config, 'instrumentation_parameters', dict()).get('access_token')
+        if not access_token or not token:
+            return False
+        if isinstance(token, unicode):
+            token = token.encode("utf8")
+        return hmac.compare_digest(str(access_token), token)
+
+    def __get_answer_session(self):
+        """
+        Returns the session containing the answers presented to the current user in this XBlock.
+        The session is identified by the user id and the usage id of the XBlock.
+
+        Returns:
+            AnswerSession: The session of the current user
+
+        """
+        session_key = "%s:%s" % (self.scope_ids.user_id, self.scope_ids.usage_id)
+        return self.__answer_sessions.get_session(session_key)
+
+    def __get_edx_question(self, edx_question_id=None):
+        """
+        Retrieves the imported edX question and its precomputed answer (see ```EdxQuestionStore```)
+
+        Arguments:
+            edx_question_id (int): ID of the question in edX || None
+
+        Returns:
+            dict: The question, see ```MySQLDatabase.get_edx_question``` || None
+
+        """
+        if edx_question_id is None:
+            return None
+        return self.__edx_questions.get_question(edx_question_id)
+
+    def __find_edx_answer(self, edx_question_id=None, user_input=str):
+        """
+        Returns the precomputed answer if the asked question is the edX question of the page
+
+        Arguments:
+            edx_question_id (int): The edX question of the page the XBlock is placed on || None
+            user_input (str): The question that was asked
+
+        Returns:
+            dict: The answer, with the keys ```title```, ```answer_text``` and ```stackexchange_link``` || None
+
+        """
+        edx_question = self.__get_edx_question(edx_question_id)
+        if edx_question is None or edx_question['answer_text'] is None:
+            return None
+        is_page_question = user_input.strip().lower() == edx_question['question_text'].strip().lower()
+        get_metrics().increment("edx_answers", {'result': "hit" if is_page_question else "miss"})
+        if not is_page_question:
+            return None
+        return {
+            'title': edx_question['title'],
+            'answer_text': edx_question['answer_text'],
+            'stackexchange_link': edx_question['stackexchange_link']
+        }
+
+    def __present_edx_answer(self, user_id=int, edx_question=dict):
+        """
+        Stores the edX question and its precomputed answer as presented to the user (in the database
+        and the users session), and returns the answer as HTML (with 'read more' if it is shortened).
+        The answer is only stored the first time it is presented in the session (e.g. not on every page load).
+
+        Arguments:
+            user_id (int): User ID of the user the answer is presented to
+            edx_question (dict): The question and answer, see ```MySQLDatabase.get_edx_question```
+
+        Returns:
+            str: The answer (HTML)
+
+        """
+        answer_session = self.__get_answer_session()
+        answer_index = answer_session.get_edx_answer_index(edx_question['edx_question_id'])
+        if answer_index is None:
+            question_id = self.__store_question_in_database(user_id, edx_question['question_text'], False,
+                                                            edx_question['edx_question_id'])
+            answer_index = self.__store_answer_in_database(answer_session, edx_question['answer_text'],
+                                                           edx_question['stackexchange_link'], question_id, False,
+                                                           False)
+            answer_session.set_edx_answer_index(edx_question['edx_question_id'], answer_index)
+        stored_answer = answer_session.get_answer(answer_index)
+        answer_html = self.__create_answer_title(edx_question['title'], answer_index)
+        answer_html += stored_answer.get_answer_preview()
+        if stored_answer.get_answer_preview() != stored_answer.get_answer_text():
+            answer_html += self.__create_read_more(answer_index)
+        else:
+            answer_html += "</div>"
+        return answer_html
+
+    @staticmethod
+    def __create_answer_title(question_title=str, answer_index=int):
+        """
+        Returns the title of the answer (HTML), which opens the element containing the answer text.
+        The title is escaped, since it can be a question asked by a user (see ```DuplicateQuestionIndex```).
+
+        Arguments:
+            question_title (str): The title of the question the answer belongs to
+            answer_index (int): The index of the answer in the session
+
+        Returns:
+            str: The title
+
+        """
+        return "<i>" + escape_html(question_title) + "</i><p /><div id='answer_body' " \
+                                                     "class='answer_body' data-index='" + str(answer_index) + "'>"
+
+    @staticmethod
+    def __create_read_more(answer_index=int):
+        """
+        Returns the 'read more' link (HTML) for a shortened answer, which closes the element containing
+        the answer text (see ```__create_answer_title```)
 
         Arguments:
-            select_accepted_answer (bool): If it exists, should the answer marked as accepted be returned?
-            answer_list (list): The list of answer objects based on JSONModel from stackexchange
-            link (str): The link to the StackExchange site where this questions exists
-            question_id (long): The MySQL database ID for the Question
+            answer_index (int): The index of the answer in the session
+
+        Returns:
+            str: The link
+
+        """
+        return ("</div>"
+                "<div id='read_more' id='read_more'>"
+                "<strong style='cursor: pointer' id='read_more_text' "
+                "class='read_more_text'>Read more?</strong>"
+                "<input id='answer_index' class='answer_index' name='answer_index'"
+                "value='" + str(answer_index) + "' type='hidden'></div>")
+
+    def __retrieve_answer(self, answer_session=object, answer_list=list, question_list=list, user_input=str,
+                          question_id=long):
+        """
+        This function ranks the passed answers by their relevance to the question (see ```AnswerRanker```),
+        and retrieves the most relevant answer together with the question (search result) it belongs to.
+
+        Arguments:
+            answer_session (AnswerSession): The session of the user, where the selected answer is stored
+            answer_list (list): The list of candidate answer objects (```StackExchangeAnswer```)
+            question_list (list): The questions (```StackExchangeQuestions```) the answers belong to
+            user_input (str): The question that was asked
+            question_id (PendingKey): The MySQL database ID for the Question
 
         See:
-            |  ```stackexchange.Answers```
+            |  ```searchstackexchange.StackExchangeAnswer```
+            |  ```answerranking.AnswerRanker```
 
         Returns:
-            str: The HTML body of the selected answer
-
-        """
-        answer_body = None
-        if len(answer_list) > 1:
-            highest_vote = -1
-            index_of_highest_voted = -1
-            index_of_accepted_answer = -1
-            # loop through answers and check for highest voted and accepted answer
-            for index in range(0, len(answer_list)):
-                if answer_list[index].is_accepted:
-                    index_of_accepted_answer = index
-                if answer_list[index].score > highest_vote:
-                    highest_vote = answer_list[index].score
-                    index_of_highest_voted = index
-            # which answer should be retrieved?
-            if select_accepted_answer and index_of_accepted_answer > -1:
-                answer_body = answer_list[index_of_accepted_answer].body
-            else:
-                answer_body = answer_list[index_of_highest_voted].body
-        elif len(answer_list) == 1:
-            # only one answer, retrieve it
-            answer_body = answer_list[0].body
+            tuple: (question_obj, answer_body, answer_index), the question the selected answer belongs to,
+            the HTML body of the selected answer and its index in the session
+
+        """
+        ranked_answers = self.__answer_ranker.rank(answer_list, user_input)
+        selected_answer = ranked_answers[0]
+        question_obj = question_list[0]
+        for question in question_list:
+            if question.get_question_id() == selected_answer.get_question_id():
+                question_obj = question
+                break
+        answer_body = selected_answer.get_body()
         # log this answer in the database
-        self.__store_answer_in_database(answer_body, link, question_id, False)
-        return answer_body
+        answer_index = self.__store_answer_in_database(answer_session, answer_body, question_obj.get_link(),
+                                                       question_id, False, False)
+        return question_obj, answer_body, answer_index
+
+    def __find_duplicate_question(self, user_input=str):
+        """
+        Looks for a previously answered question that is similar to the asked question.
+        The answered questions stored in the database are added to the index on first use
+        (if the database can not be read, they are added on a later call).
+
+        Arguments:
+            user_input (str): The question that was asked
+
+        Returns:
+            tuple: (similarity, answer_dict) of the most similar answered question || None
+
+        """
+        if self.__duplicate_questions is None:
+            return None
+        if not self.__duplicate_questions_loaded[0]:
+            with self.__duplicate_questions_lock:
+                if not self.__duplicate_questions_loaded[0]:
+                    try:
+                        if getattr(config, 'duplicate_question_parameters', dict()).get('load_from_database', True):
+                            self.__duplicate_questions.load_from_database()
+                        self.__duplicate_questions_loaded[0] = True
+                    except MySQLdb.Error as err:
+                        print("MySQLdb.Error (Load answered questions): %s" % err)
+        duplicate = self.__duplicate_questions.find(user_input)
+        get_metrics().increment("duplicate_questions", {'result': "miss" if duplicate is None else "hit"})
+        return duplicate
+
+    def __add_answered_question(self, user_input=str, title=str, answer_body=str, link=str):
+        """
+        Adds the answered question to the duplicate question index (if enabled)
+
+        Arguments:
+            user_input (str): The question that was asked
+            title (str): The title of the StackExchange question the answer belongs to
+            answer_body (str): The HTML body of the answer
+            link (str): The link to the StackExchange question
+
+        """
+        if self.__duplicate_questions is None or not answer_body:
+            return
+        self.__duplicate_questions.add(user_input, {
+            'title': title,
+            'answer_text': answer_body,
+            'stackexchange_link': link
+        })
+
+    @staticmethod
+    def __create_search_stackexchange(site_name=str):
+        """
+        Creates the object used for searching. If a local index is set in the config file
+        (```local_index_parameters```), the local index is searched instead of the StackExchange API.
+
+        Arguments:
+            site_name (str): Name of the StackExchange community site to use
+
+        Returns:
+            SearchStackExchange || LocalSearchStackExchange
+
+        """
+        index_path = getattr(config, 'local_index_parameters', dict()).get('index_path')
+        if index_path is not None:
+            return LocalSearchStackExchange(site_name, index_path)
+        return SearchStackExchange(site_name)
 
     @staticmethod
     def __store_username_in_database(username=str):
@@ -336,6 +786,7 @@ class ChatAgentXBlock(XBlock):
     def __store_question_in_database(user_id=int, question=str, asked_by_user=bool, edx_question_id=None):
         """
         Stores the currently asked question in the database.
+        The question is written in the background (see ```InteractionLogger```).
 
         Arguments:
             question (str): The question that was asked
@@ -344,7 +795,7 @@ class ChatAgentXBlock(XBlock):
             edx_question_id (int): The EDX ID of the question (if this was taken from an EDX course)
 
         Returns:
-            long: The primary key of the inserted question
+            PendingKey: The primary key of the inserted question (set when it has been written)
 
         """
         question_dict = {
@@ -353,40 +804,56 @@ class ChatAgentXBlock(XBlock):
             'user_id': user_id,
             'edx_question_id': edx_question_id
         }
-        pk_question = MySQLDatabase().insert_into_table_questions(question_dict)
+        pk_question = get_interaction_logger().log_question(question_dict)
         return pk_question
 
-    def __store_answer_in_database(self, answer=str, se_link=str, question_id=long, is_answer_read=bool, correct_answer=bool):
+    @staticmethod
+    def __store_answer_in_database(answer_session=object, answer=str, se_link=str, question_id=long,
+                                   is_answer_read=bool, correct_answer=bool):
         """
-        Stores the currently presented answer in the database.
+        Stores the currently presented answer in the database, and adds it to the users session.
+        The answer is sanitized and its preview is created before it is stored (see ```AnswerFormatter```).
+        The answer is written in the background (see ```InteractionLogger```), so the ID of the
+        answer in the session is the ```PendingKey``` of the answer.
 
         Arguments:
+            answer_session (AnswerSession): The session of the user
             answer (str): The answer text that was retrieved and presented
             se_link (str): The link (url) to the site where answer was retrieved from
-            question_id (long): The ID for the question that was asked (primary key in MySQL db)
+            question_id (PendingKey): The ID for the question that was asked (primary key in MySQL db)
             is_answer_read (bool): Has the read more option been clicked?
             correct_answer (bool): Is this answer accepted by the chat agent user as the correct one?
 
+        Returns:
+            int: The index of the answer in the session
+
         """
+        metrics = get_metrics()
+        with metrics.timer("format_answer"):
+            answer, answer_preview = get_answer_formatter().format(answer)
         # temp dictionary for database insertion
         answer_dict = {
             'answer_text': answer,
+            'answer_preview': answer_preview,
             'stackexchange_link': se_link,
             'question_id': question_id,
             'is_answer_read': is_answer_read,
             'correct_answer': correct_answer
         }
-        answer_dict = MySQLDatabase().insert_into_table_answers(answer_dict)
-        answer_id = answer_dict.get("answer_id")
-        stackexchange_id = answer_dict.get("stackexchange_id")
-        answer = Answer(answer_id, answer, question_id, is_answer_read, correct_answer, stackexchange_id, se_link)
-        self.retrieved_answers_list.append(answer)
-
-    def __update_answer_in_database(self, update_all=bool, update_key=str, update_dict=dict):
+        with metrics.timer("store_answer"):
+            answer_id = get_interaction_logger().log_answer(answer_dict)
+        stackexchange_id = None
+        answer = Answer(answer_id, answer, question_id, is_answer_read, correct_answer, stackexchange_id, se_link,
+                        answer_preview)
+        return answer_session.add_answer(answer)
+
+    def __update_answer_in_database(self, answer_session=object, update_all=bool, update_key=str, update_dict=dict):
         """
         Updates the data for the answer with the passed ID.
+        The update is written in the background (see ```InteractionLogger```).
 
         Arguments:
+            answer_session (AnswerSession): The session of the user the answer was presented to
             update_all (bool): Update all values for this answer
             update_key (str) (None): Key for value to update (if single value)
             update_dict (dict): Value(s) to update
@@ -395,46 +862,40 @@ class ChatAgentXBlock(XBlock):
              bool: True if data was updated, False otherwise.
 
         """
-        index = 0
-        not_found = True
         updated = False
         answer_id = update_dict.get("answer_id")
         # check if the given answer already has been updated
-        while not_found and index < len(self.updated_answers_list):
-            if answer_id == self.updated_answers_list[index]:
-                not_found = False
-            index += 1
-        if not_found:
-            index = -1
-            max_size = len(self.retrieved_answers_list) - 1
+        if not answer_session.is_answer_updated(answer_id):
             # if the answer hasn't been updated, does it exist?
-            while not_found and index <= max_size:
-                answer = self.retrieved_answers_list[index]
-                index += 1
-                if answer.get_answer_id() == answer_id:
-                    not_found = False
-            if not_found is False:
+            index = answer_session.get_index_of_answer(answer_id)
+            if index is not None:
                 if update_key is not None and not self.__does_key_match_answer_dictionary(update_key):
                     raise ValueError("The given key does not match the existing key set.")
-                updated = MySQLDatabase().update_tbl_answers(update_key, update_dict, update_all)
+                get_interaction_logger().log_answer_update(update_key, update_dict, update_all)
+                updated = True
             if updated:
-                self.__update_answer_list(index, update_all, update_key, update_dict)
+                self.__update_answer_list(answer_session, index, update_all, update_key, update_dict)
         return updated
 
-    def __update_answer_list(self, index=int, update_all=bool, update_key=None, update_dict=dict):
+    @staticmethod
+    def __update_answer_list(answer_session=object, index=int, update_all=bool, update_key=None, update_dict=dict):
         """
-        Updates the object data in the list based on the values in the ```update_dict```.
+        Updates the object data in the session based on the values in the ```update_dict```.
         For now, this function only updates for all entries, not singular values.
 
         Arguments:
+            answer_session (AnswerSession): The session containing the answer
             index (int): The index of the Answer object to update
             update_all (bool): Should all attributes be updated?
             update_key (str) (None): If only one value was updated, pass the key to that value in ```update_dict```
             update_dict (dict): Dictionary containing the values that were changed
 
         """
+        orig_answer = answer_session.get_answer(index)
+        if orig_answer is None:
+            # the answer has been removed from the session in the meantime
+            return
         if update_all:
-            orig_answer = self.retrieved_answers_list[index]
             answer_id = orig_answer.get_answer_id()
             answer_text = update_dict.get("answer_text")
             is_answer_read = update_dict.get("is_answer_read")
@@ -442,12 +903,12 @@ class ChatAgentXBlock(XBlock):
             question_id = update_dict.get("question_id")
             stackexchange_id = update_dict.get("stackexchange_id")
             stackexchange_link = orig_answer.get_stackexchange_link()
+            answer_preview = update_dict.get("answer_preview")
             updated_answer = Answer(answer_id, answer_text, question_id, is_answer_read, correct_answer,
-                                    stackexchange_id, stackexchange_link)
-            self.retrieved_answers_list[index] = updated_answer
-            self.updated_answers_list.append(answer_id)
+                                    stackexchange_id, stackexchange_link, answer_preview)
+            answer_session.replace_answer(index, updated_answer)
+            answer_session.set_answer_updated(answer_id)
         else:
-            orig_answer = self.retrieved_answers_list[index]
             answer_id = orig_answer.get_answer_id()
             answer_text = orig_answer.get_answer_text()
             is_answer_read = update_dict.get("is_answer_read")
@@ -455,10 +916,11 @@ class ChatAgentXBlock(XBlock):
             question_id = orig_answer.get_question_id()
             stackexchange_id = orig_answer.get_stackexchange_id()
             stackexchange_link = orig_answer.get_stackexchange_link()
+            answer_preview = orig_answer.get_answer_preview()
             updated_answer = Answer(answer_id, answer_text, question_id, is_answer_read, correct_answer,
-                                    stackexchange_id, stackexchange_link)
-            self.retrieved_answers_list[index] = updated_answer
-            self.updated_answers_list.append(answer_id)
+                                    stackexchange_id, stackexchange_link, answer_preview)
+            answer_session.replace_answer(index, updated_answer)
+            answer_session.set_answer_updated(answer_id)
 
     @staticmethod
     def __does_key_match_answer_dictionary(update_key=str):
@@ -475,6 +937,7 @@ class ChatAgentXBlock(XBlock):
         answer_dictionary = {
             'answer_id': 0,
             'answer_text': "dummy",
+            'answer_preview': "dummy",
             'question_id': 0,
             'is_answer_read': 0,
             'correct_answer': 0,
@@ -0,0 +1,230 @@
+import threading
+import time
+
+import MySQLdb
+
+import dbconfig as config
+from instrumentation import get_metrics
+
+_author_ = "Knut Lucas Andersen"
+
+
+class PoolExhaustedError(MySQLdb.OperationalError):
+    """
+    Raised when no connection could be checked out of the pool before the checkout timeout expired.
+    Inherits from ```MySQLdb.OperationalError```, so it is handled by the existing ```MySQLdb.Error``` checks.
+    """
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe, bounded pool of long-lived MySQL connections.
+
+    Connections are checked out with ```get_connection``` and handed back with ```release_connection```.
+    Idle connections are kept warm and re-used (most recently used first), and are health checked
+    before being handed out again. Stale connections (idle for too long, or failing the health check)
+    are closed and replaced by a new connection.
+    """
+
+    __DEFAULT_POOL_SIZE = 10
+    """
+    The maximum number of connections (idle and checked out) the pool can have open at the same time
+    """
+
+    __DEFAULT_MAX_IDLE_TIME = 3600
+    """
+    The number of seconds a connection can be idle in the pool before it is considered stale.
+    This should be lower than the ```wait_timeout``` of the MySQL server.
+    """
+
+    __DEFAULT_PING_INTERVAL = 30
+    """
+    Connections that have been idle for longer than this (in seconds) are pinged before being re-used
+    """
+
+    __DEFAULT_CHECKOUT_TIMEOUT = 10
+    """
+    The number of seconds to wait for a free connection before giving up
+    """
+
+    def __init__(self, mysql_parameters=dict, pool_size=__DEFAULT_POOL_SIZE, max_idle_time=__DEFAULT_MAX_IDLE_TIME,
+                 ping_interval=__DEFAULT_PING_INTERVAL, checkout_timeout=__DEFAULT_CHECKOUT_TIMEOUT,
+                 connect_function=None):
+        """
+        Constructor for the connection pool. No connections are opened until they are needed.
+
+        Arguments:
+            mysql_parameters (dict): The connection parameters (host, user, passwd, db)
+            pool_size (int): Maximum number of open connections
+            max_idle_time (int): Seconds before an idle connection is considered stale
+            ping_interval (int): Seconds of idle time before a connection is pinged on checkout
+            checkout_timeout (int): Seconds to wait for a free connection
+            connect_function (function): Function opening a connection, called with (host, user, passwd, db).
+                Defaults to ```MySQLdb.connect``` (another function can be given, e.g. a local database
+                with the same interface when benchmarking, see benchmarks/sqliteadapter.py)
+
+        """
+        if pool_size < 1:
+            raise ValueError("The pool size must be at least 1!")
+        self.__mysql_parameters = mysql_parameters
+        self.__pool_size = pool_size
+        self.__max_idle_time = max_idle_time
+        self.__ping_interval = ping_interval
+        self.__checkout_timeout = checkout_timeout
+        self.__connect_function = connect_function if connect_function is not None else MySQLdb.connect
+        self.__idle_connections = list()  # list of tuples: (connection, time it was returned)
+        self.__open_connections = 0
+        self.__condition = threading.Condition(threading.Lock())
+
+    def get_connection(self):
+        """
+        Checks out a connection from the pool. If there are no idle connections, a new connection
+        is opened (as long as the pool is not full). If the pool is full, the call waits until a
+        connection is returned, or until the checkout timeout expires.
+
+        Raises:
+            PoolExhaustedError: No connection became available before the timeout
+            MySQLdb.Error: The connection to the database could not be established
+
+        Returns:
+            MySQLdb.connections.Connection: A connection with autocommit enabled
+
+        """
+        connection = None
+        returned_time = None
+        deadline = time.time() + self.__checkout_timeout
+        with self.__condition:
+            while not self.__idle_connections and self.__open_connections >= self.__pool_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    get_metrics().increment("db_pool_exhausted")
+                    raise PoolExhaustedError("No database connection available (pool size: %d)" % self.__pool_size)
+                self.__condition.wait(remaining)
+            if self.__idle_connections:
+                connection, returned_time = self.__idle_connections.pop()
+            else:
+                # reserve the slot before connecting, so that the pool is never exceeded
+                self.__open_connections += 1
+        try:
+            if connection is None:
+                connection = self.__connect()
+            else:
+                connection = self.__check_connection_health(connection, returned_time)
+        except MySQLdb.Error:
+            self.__discard_slot()
+            raise
+        return connection
+
+    def release_connection(self, connection, discard=False):
+        """
+        Returns a connection to the pool so that it can be re-used.
+
+        Arguments:
+            connection (MySQLdb.connections.Connection): The connection to return
+            discard (bool): Should the connection be closed instead of re-used (e.g. after a failure)?
+
+        """
+        if connection is None:
+            return
+        if discard or not connection.open:
+            self.__close_connection(connection)
+            self.__discard_slot()
+            return
+        with self.__condition:
+            self.__idle_connections.append((connection, time.time()))
+            self.__condition.notify()
+
+    def close_all(self):
+        """
+        Closes all idle connections (e.g. on shutdown). Checked out connections are not affected.
+        """
+        with self.__condition:
+            idle_connections = self.__idle_connections
+            self.__idle_connections = list()
+            self.__open_connections -= len(idle_connections)
+            self.__condition.notify_all()
+        for connection, returned_time in idle_connections:
+            self.__close_connection(connection)
+
+    def __connect(self):
+        """
+        Opens a new connection to the MySQL database.
+
+        Returns:
+            MySQLdb.connections.Connection
+
+        """
+        connection = self.__connect_function(
+            self.__mysql_parameters['host'],
+            self.__mysql_parameters['user'],
+            self.__mysql_parameters['passwd'],
+            self.__mysql_parameters['db']
+        )
+        connection.autocommit(True)
+        return connection
+
+    def __check_connection_health(self, connection, returned_time):
+        """
+        Checks that an idle connection is still usable. Connections that have been idle for longer
+        than ```max_idle_time``` are replaced, and connections idle for longer than ```ping_interval```
+        are pinged (and replaced if the ping fails).
+
+        Arguments:
+            connection (MySQLdb.connections.Connection): The idle connection
+            returned_time (float): When the connection was returned to the pool
+
+        Returns:
+            MySQLdb.connections.Connection: The connection, or a new connection if it was stale
+
+        """
+        idle_time = time.time() - returned_time
+        if idle_time > self.__max_idle_time:
+            self.__close_connection(connection)
+            return self.__connect()
+        if idle_time > self.__ping_interval:
+            try:
+                connection.ping()
+            except MySQLdb.Error:
+                self.__close_connection(connection)
+                return self.__connect()
+        return connection
+
+    def __discard_slot(self):
+        """
+        Frees the slot of a connection that was closed, so that a new connection can be opened
+        """
+        with self.__condition:
+            self.__open_connections -= 1
+            self.__condition.notify()
+
+    @staticmethod
+    def __close_connection(connection):
+        """
+        Closes the connection, ignoring errors since the connection is being thrown away anyway
+        """
+        try:
+            connection.close()
+        except MySQLdb.Error:
+            pass
+
+
+_connection_pool = None
+_connection_pool_lock = threading.Lock()
+
+
+def get_connection_pool():
+    """
+    Returns the process-wide connection pool, creating it on first use.
+    The pool settings are read from ```pool_parameters``` in the config file (if set).
+
+    Returns:
+        ConnectionPool: The connection pool shared by all ```MySQLDatabase``` instances
+
+    """
+    global _connection_pool
+    if _connection_pool is None:
+        with _connection_pool_lock:
+            if _connection_pool is None:
+                pool_parameters = getattr(config, 'pool_parameters', dict())
+                _connection_pool = ConnectionPool(config.mysql_parameters, **pool_parameters)
+    return _connection_pool
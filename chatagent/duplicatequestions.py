@@ -0,0 +1,248 @@
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy
+
+import dbconfig as config
+from mysqldatabase import MySQLDatabase
+from textprocessing import NEGATION_WORDS, STOP_WORDS, tokenize
+
+"""
+This file contains the detection of questions that already have been answered (near-duplicates).
+
+Students often ask the same question with slightly different phrasing. Each answered question is added to
+```DuplicateQuestionIndex```, and new questions are compared against it before StackExchange is searched.
+If a previously answered question is similar enough, its answer is returned directly.
+
+The similarity of two questions is the Jaccard similarity of their sets of terms, where the terms are the
+words (shingles of one word) and the pairs of following words (shingles of two words) of the question. The
+pairs make the order of the words count ('convert int to string' is not 'convert string to int'), and the
+negations are kept ('how to not sort a list' is not 'how to sort a list'). To avoid comparing the
+question against every answered question, the index uses MinHash and Locality-Sensitive Hashing (LSH):
+the MinHash signature of a question is split into bands, and only questions sharing at least one band
+(bucket) with the new question are compared.
+
+See: https://en.wikipedia.org/wiki/MinHash
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+
+class DuplicateQuestionIndex(object):
+    """
+    Index of answered questions, for finding the answer to a near-duplicate question.
+    The index holds at most ```max_entries``` questions (the oldest are removed first).
+    """
+
+    DEFAULT_THRESHOLD = 0.8
+    """
+    The default minimum Jaccard similarity for two questions to be considered duplicates
+    """
+
+    DEFAULT_MAX_ENTRIES = 10000
+    """
+    The default maximum number of questions in the index
+    """
+
+    __NUMBER_OF_BANDS = 16
+    __ROWS_PER_BAND = 4
+    """
+    The MinHash signature has (bands * rows) values. With 16 bands of 4 rows, two questions with a
+    similarity of 0.8 share a bucket with a probability of about 0.999, and with 0.3 of about 0.12.
+    """
+
+    __SHINGLE_SIZE = 2
+    """
+    The maximum number of following words in a term (shingle) of the question
+    """
+
+    __STOP_WORDS = STOP_WORDS - NEGATION_WORDS
+    """
+    The words that are removed from the questions (the negations change the meaning, so they are kept)
+    """
+
+    __PRIME = 2147483647
+    """
+    The Mersenne prime 2^31 - 1, used for the permutations (a * x + b) mod prime. The hash values and the
+    coefficients are below the prime, so a * x + b is below 2^62 and does not overflow the 64 bit integers.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Constructor for the duplicate question index
+
+        Arguments:
+            threshold (float): The minimum Jaccard similarity for two questions to be duplicates
+            max_entries (int): The maximum number of questions in the index
+
+        """
+        self.__threshold = threshold
+        self.__max_entries = max_entries
+        number_of_permutations = self.__NUMBER_OF_BANDS * self.__ROWS_PER_BAND
+        # fixed seed, so that the signatures are the same in every process
+        random_state = numpy.random.RandomState(7)
+        self.__permutation_a = random_state.randint(1, self.__PRIME, size=(number_of_permutations, 1)) \
+            .astype(numpy.uint64)
+        self.__permutation_b = random_state.randint(0, self.__PRIME, size=(number_of_permutations, 1)) \
+            .astype(numpy.uint64)
+        self.__entries = OrderedDict()  # question key => (set of terms, list of bucket keys, answer dict)
+        self.__buckets = dict()  # bucket key => set of question keys
+        self.__lock = threading.Lock()
+
+    def add(self, question=str, answer_dict=dict):
+        """
+        Adds the answered question to the index. If the question already is in the index, its answer is replaced.
+
+        Arguments:
+            question (str): The question that was asked
+            answer_dict (dict): The answer to return for duplicates of this question, e.g.
+                ```{'title': title, 'answer_text': answer_text, 'stackexchange_link': link}```
+
+        """
+        terms = self.__get_terms(question)
+        if len(terms) == 0:
+            return
+        question_key = self.__create_question_key(terms)
+        bucket_keys = self.__get_bucket_keys(terms)
+        with self.__lock:
+            self.__remove_entry(question_key)
+            self.__entries[question_key] = (terms, bucket_keys, answer_dict)
+            for bucket_key in bucket_keys:
+                self.__buckets.setdefault(bucket_key, set()).add(question_key)
+            while len(self.__entries) > self.__max_entries:
+                self.__remove_entry(next(iter(self.__entries)))
+
+    def find(self, question=str):
+        """
+        Finds the most similar answered question, if it is similar enough (see ```threshold```).
+
+        Arguments:
+            question (str): The question that was asked
+
+        Returns:
+            tuple: (similarity, answer_dict) of the most similar answered question || None
+
+        """
+        terms = self.__get_terms(question)
+        if len(terms) == 0:
+            return None
+        bucket_keys = self.__get_bucket_keys(terms)
+        best_match = None
+        with self.__lock:
+            candidates = set()
+            for bucket_key in bucket_keys:
+                candidates.update(self.__buckets.get(bucket_key, ()))
+            for question_key in candidates:
+                candidate_terms, candidate_buckets, answer_dict = self.__entries[question_key]
+                similarity = len(terms & candidate_terms) / float(len(terms | candidate_terms))
+                if similarity >= self.__threshold and (best_match is None or similarity > best_match[0]):
+                    best_match = (similarity, answer_dict)
+        return best_match
+
+    def load_from_database(self):
+        """
+        Adds the answered questions stored in the MySQL database to the index. If a question has several
+        answers, the answer accepted by the user (```correct_answer```) is used, otherwise the newest answer.
+
+        Raises:
+            MySQLdb.Error: If the answers could not be retrieved (the answers read until then are added)
+
+        Returns:
+            int: The number of answers that were read
+
+        """
+        columns = ['question_text', 'answer_text', 'stackexchange_link', 'correct_answer']
+        accepted_questions = set()
+        no_of_answers = 0
+        for row in MySQLDatabase().iter_question_and_answer_records(columns):
+            no_of_answers += 1
+            question = row['question_text']
+            if question in accepted_questions or not row['answer_text']:
+                continue
+            if row['correct_answer']:
+                accepted_questions.add(question)
+            # the titles of the questions are not stored, so the question is shown as the title
+            # (it is text written by a user, and is escaped when shown, see ChatAgentXBlock)
+            self.add(question, {
+                'title': question,
+                'answer_text': row['answer_text'],
+                'stackexchange_link': row['stackexchange_link']
+            })
+        return no_of_answers
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __get_terms(self, question=str):
+        """
+        Returns the terms of the question: the shingles of one up to ```__SHINGLE_SIZE``` following words
+
+        Arguments:
+            question (str): The question that was asked
+
+        Returns:
+            frozenset: The terms (the words of a shingle are separated by a space)
+
+        """
+        tokens = tokenize(question, stop_words=self.__STOP_WORDS)
+        terms = set()
+        for size in range(1, self.__SHINGLE_SIZE + 1):
+            for index in range(0, len(tokens) - size + 1):
+                terms.add(u" ".join(tokens[index:index + size]))
+        return frozenset(terms)
+
+    def __get_bucket_keys(self, terms=frozenset):
+        """
+        Computes the MinHash signature of the terms, and returns the LSH bucket of each band.
+
+        Arguments:
+            terms (frozenset): The terms of the question
+
+        Returns:
+            list: The bucket keys (one per band)
+
+        """
+        hashes = numpy.array([(zlib.crc32(term.encode("utf8") if isinstance(term, unicode) else term) & 0xffffffff)
+                              % self.__PRIME for term in terms], dtype=numpy.uint64)
+        # one row per permutation, one column per term; the signature is the minimum of each row
+        signature = ((self.__permutation_a * hashes + self.__permutation_b) % self.__PRIME).min(axis=1)
+        bands = signature.reshape(self.__NUMBER_OF_BANDS, self.__ROWS_PER_BAND)
+        return [(band_index, bands[band_index].tostring()) for band_index in range(0, self.__NUMBER_OF_BANDS)]
+
+    @staticmethod
+    def __create_question_key(terms=frozenset):
+        """
+        Returns the key identifying the question (questions with the same terms have the same key)
+        """
+        return u"|".join(sorted(terms))
+
+    def __remove_entry(self, question_key=str):
+        """
+        Removes the question from the index (if it exists). Must be called while holding the lock.
+        """
+        entry = self.__entries.pop(question_key, None)
+        if entry is None:
+            return
+        for bucket_key in entry[1]:
+            bucket = self.__buckets.get(bucket_key)
+            if bucket is not None:
+                bucket.discard(question_key)
+                if len(bucket) == 0:
+                    del self.__buckets[bucket_key]
+
+
+def create_duplicate_question_index():
+    """
+    Creates the duplicate question index based on ```duplicate_question_parameters``` in the config file.
+    If ```enabled``` is False, no index is created.
+
+    Returns:
+        DuplicateQuestionIndex: The index || None
+
+    """
+    duplicate_parameters = getattr(config, 'duplicate_question_parameters', dict())
+    if not duplicate_parameters.get('enabled', True):
+        return None
+    return DuplicateQuestionIndex(duplicate_parameters.get('threshold', DuplicateQuestionIndex.DEFAULT_THRESHOLD),
+                                  duplicate_parameters.get('max_entries', DuplicateQuestionIndex.DEFAULT_MAX_ENTRIES))
@@ -0,0 +1,330 @@
+import csv
+import sys
+import time
+from multiprocessing.pool import ThreadPool
+
+import MySQLdb
+import stackexchange
+
+import dbconfig as config
+from answerformatting import get_answer_formatter
+from answerranking import create_answer_ranker
+from mysqldatabase import MySQLDatabase
+from questionranking import create_question_ranker
+from ratelimiter import RateLimitExceededError
+from searchcache import MemoryCacheBackend
+from searchstackexchange import SearchStackExchange
+from stackoverflowindex import LocalSearchStackExchange
+
+"""
+This file contains the import of the questions of an edX course, and the answers to them found in advance.
+
+The questions of a course are imported from a CSV file (with the columns 'edx_question_id', 'question_text'
+and 'question_link') into the table 'tblEdxQuestions'. The answers are then found for all the questions in
+parallel (with the same search, ranking and formatting as the chat agent), and stored in 'tblEdxAnswers'.
+The XBlock placed on the page of a question (```ChatAgentXBlock.edx_question_id```) shows the question and
+its answer in the welcome message, without a request to the StackExchange API (see ```EdxQuestionStore```).
+
+The import is run with:
+    python edxquestions.py import <course id> <questions file (CSV)>
+    python edxquestions.py precompute [<course id>] [--recompute]
+'import' stores the questions and finds the answers for them. 'precompute' finds the answers for the stored
+questions that have none (or for all of them, with '--recompute', e.g. to pick up newer answers).
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+
+def read_course_questions(file_path=str):
+    """
+    Reads the questions of a course from a CSV file (UTF-8, with a header row)
+
+    Arguments:
+        file_path (str): Path to the CSV file, with the columns 'edx_question_id', 'question_text'
+            and 'question_link'
+
+    Raises:
+        ValueError: If a column is missing, or an ID is not a number
+
+    Returns:
+        list: List of dictionaries with the keys ```edx_question_id```, ```question_text``` and ```question_link```
+
+    """
+    question_list = list()
+    with open(file_path, "rb") as questions_file:
+        for row in csv.DictReader(questions_file):
+            if row.get('edx_question_id') is None or row.get('question_text') is None:
+                raise ValueError("The columns 'edx_question_id' and 'question_text' are required.")
+            question_list.append({
+                'edx_question_id': int(row['edx_question_id']),
+                'question_text': row['question_text'].decode("utf-8").strip(),
+                'question_link': (row.get('question_link') or "").decode("utf-8").strip()
+            })
+    return question_list
+
+
+class EdxQuestionImporter(object):
+    """
+    Class for importing the questions of an edX course, and finding their answers in advance
+    """
+
+    ANSWERED = "answered"
+    """
+    Status for questions where an answer was found (and stored)
+    """
+
+    NO_ANSWER = "no_answer"
+    """
+    Status for questions where the search had no results, or the results had no answers
+    """
+
+    FAILED = "failed"
+    """
+    Status for questions where the search or storing failed (e.g. the request limit of the API was reached)
+    """
+
+    DEFAULT_WORKER_COUNT = 4
+    """
+    The default number of questions answered at the same time
+    """
+
+    DEFAULT_NUMBER_OF_CANDIDATES = 5
+    """
+    The default number of search results whose answers are ranked (as in ```ChatAgentXBlock```)
+    """
+
+    def __init__(self, site_name="StackOverflow", worker_count=DEFAULT_WORKER_COUNT,
+                 number_of_candidates=DEFAULT_NUMBER_OF_CANDIDATES):
+        """
+        Constructor for the importer
+
+        Arguments:
+            site_name (str): Name of the StackExchange community site to search
+            worker_count (int): The number of questions answered at the same time
+            number_of_candidates (int): The number of search results whose answers are ranked
+
+        """
+        self.__site_name = site_name
+        self.__worker_count = worker_count
+        self.__number_of_candidates = number_of_candidates
+        self.__question_ranker = create_question_ranker()
+        self.__answer_ranker = create_answer_ranker()
+
+    @staticmethod
+    def import_questions(question_list=list, course_id=None):
+        """
+        Stores the questions of the course (questions that already are stored are updated)
+
+        Arguments:
+            question_list (list): The questions (see ```read_course_questions```)
+            course_id (str): The ID of the edX course
+
+        Returns:
+            bool: True if the questions were stored, False otherwise.
+
+        """
+        rows = [dict(question_dictionary, course_id=course_id) for question_dictionary in question_list]
+        return MySQLDatabase().insert_batch_into_table_edx_questions(rows)
+
+    def precompute_answers(self, question_list=list):
+        """
+        Finds and stores the answers to the questions. The questions are answered in parallel by
+        ```worker_count``` threads (the requests to the API are limited by the shared rate limiter).
+
+        Arguments:
+            question_list (list): The questions (dictionaries with ```edx_question_id``` and ```question_text```)
+
+        Returns:
+            dict: The number of questions with each status, e.g. ```{'answered': 10, 'no_answer': 1, 'failed': 0}```
+
+        """
+        status_count = {self.ANSWERED: 0, self.NO_ANSWER: 0, self.FAILED: 0}
+        if len(question_list) == 0:
+            return status_count
+        pool = ThreadPool(min(self.__worker_count, len(question_list)))
+        try:
+            for status in pool.imap_unordered(self.__precompute_answer, question_list):
+                status_count[status] += 1
+        finally:
+            pool.close()
+            pool.join()
+        return status_count
+
+    def find_answer(self, question=str):
+        """
+        Finds the answer to the question: the search results are ranked by their relevance to the question,
+        and the most relevant answer of the top results is selected and formatted (as in ```ChatAgentXBlock```)
+
+        Arguments:
+            question (str): The question
+
+        Raises:
+            RateLimitExceededError: If the request limit of the API was reached
+
+        Returns:
+            dict: Dictionary with the keys ```title```, ```answer_text```, ```answer_preview```
+            and ```stackexchange_link``` || None if no answer was found
+
+        """
+        search_stackexchange = self.__create_search_stackexchange()
+        if not search_stackexchange.process_search_results_for_question(question, False):
+            return None
+        search_stackexchange.rank_results(self.__question_ranker, question)
+        search_stackexchange.prefetch_answers(self.__number_of_candidates)
+        candidate_list = search_stackexchange.get_list_of_results()[:self.__number_of_candidates]
+        answer_list = list()
+        for index in range(0, len(candidate_list)):
+            answer_list.extend(search_stackexchange.get_question_data(index))
+        if len(answer_list) == 0:
+            return None
+        selected_answer = self.__answer_ranker.rank(answer_list, question)[0]
+        question_obj = candidate_list[0]
+        for candidate in candidate_list:
+            if candidate.get_question_id() == selected_answer.get_question_id():
+                question_obj = candidate
+                break
+        answer_text, answer_preview = get_answer_formatter().format(selected_answer.get_body())
+        return {
+            'title': question_obj.get_title(),
+            'answer_text': answer_text,
+            'answer_preview': answer_preview,
+            'stackexchange_link': question_obj.get_link()
+        }
+
+    def __precompute_answer(self, question_dictionary=dict):
+        """
+        Finds and stores the answer to one question (run by the worker threads)
+
+        Returns:
+            str: The status (```ANSWERED```, ```NO_ANSWER``` or ```FAILED```)
+
+        """
+        # an error only fails this question, the other questions are still answered
+        try:
+            answer = self.find_answer(question_dictionary['question_text'])
+            if answer is None:
+                return self.NO_ANSWER
+            answer['edx_question_id'] = question_dictionary['edx_question_id']
+            if not MySQLDatabase().insert_or_update_edx_answer(answer):
+                return self.FAILED
+        except (AttributeError, RateLimitExceededError, stackexchange.StackExchangeError, MySQLdb.Error), err:
+            print("Error (edX question %s): %s" % (question_dictionary['edx_question_id'], err))
+            return self.FAILED
+        return self.ANSWERED
+
+    def __create_search_stackexchange(self):
+        """
+        Creates the object used for searching (the local index, if set in the config file)
+
+        Returns:
+            SearchStackExchange || LocalSearchStackExchange
+
+        """
+        index_path = getattr(config, 'local_index_parameters', dict()).get('index_path')
+        if index_path is not None:
+            return LocalSearchStackExchange(self.__site_name, index_path)
+        return SearchStackExchange(self.__site_name)
+
+
+class EdxQuestionStore(object):
+    """
+    Cached lookup of the edX questions and their precomputed answers, used by the XBlock.
+    Only questions that exist are cached, so questions imported later are found without waiting for the TTL.
+    """
+
+    DEFAULT_TTL = 300
+    """
+    The default number of seconds a question (and its answer) is cached
+    """
+
+    DEFAULT_MAX_SIZE = 1000
+    """
+    The default maximum number of cached questions
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        """
+        Constructor for the store
+
+        Arguments:
+            ttl (int): Seconds a question is cached
+            max_size (int): The maximum number of cached questions
+
+        """
+        self.__ttl = ttl
+        self.__backend = MemoryCacheBackend(max_size)
+
+    def get_question(self, edx_question_id=int):
+        """
+        Retrieves the edX question and its precomputed answer
+
+        Arguments:
+            edx_question_id (int): ID of the question in edX
+
+        Returns:
+            dict: The question, see ```MySQLDatabase.get_edx_question``` || None
+
+        """
+        key = str(edx_question_id)
+        entry = self.__backend.get(key)
+        if entry is not None:
+            stored_time, edx_question = entry
+            if time.time() - stored_time < self.__ttl:
+                return edx_question
+            self.__backend.remove(key)
+        edx_question = MySQLDatabase().get_edx_question(edx_question_id)
+        if edx_question is not None:
+            self.__backend.put(key, time.time(), edx_question)
+        return edx_question
+
+
+def create_edx_question_importer():
+    """
+    Creates the importer based on ```edx_question_parameters``` in the config file (if set)
+
+    Returns:
+        EdxQuestionImporter: The importer
+
+    """
+    edx_question_parameters = getattr(config, 'edx_question_parameters', dict())
+    return EdxQuestionImporter(
+        worker_count=edx_question_parameters.get('worker_count', EdxQuestionImporter.DEFAULT_WORKER_COUNT),
+        number_of_candidates=edx_question_parameters.get('number_of_candidates',
+                                                         EdxQuestionImporter.DEFAULT_NUMBER_OF_CANDIDATES))
+
+
+def create_edx_question_store():
+    """
+    Creates the store based on ```edx_question_parameters``` in the config file (if set)
+
+    Returns:
+        EdxQuestionStore: The store
+
+    """
+    edx_question_parameters = getattr(config, 'edx_question_parameters', dict())
+    return EdxQuestionStore(edx_question_parameters.get('cache_ttl', EdxQuestionStore.DEFAULT_TTL),
+                            edx_question_parameters.get('cache_size', EdxQuestionStore.DEFAULT_MAX_SIZE))
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    recompute = "--recompute" in arguments
+    arguments = [argument for argument in arguments if argument != "--recompute"]
+    importer = create_edx_question_importer()
+    if len(arguments) == 3 and arguments[0] == "import":
+        course_questions = read_course_questions(arguments[2])
+        if not importer.import_questions(course_questions, arguments[1]):
+            sys.exit(1)
+        print("Imported %d questions" % len(course_questions))
+    elif 1 <= len(arguments) <= 2 and arguments[0] == "precompute":
+        course_questions = MySQLDatabase().get_edx_questions(arguments[1] if len(arguments) == 2 else None,
+                                                             not recompute)
+    else:
+        print("Usage: python edxquestions.py import <course id> <questions file (CSV)>\n"
+              "       python edxquestions.py precompute [<course id>] [--recompute]")
+        sys.exit(1)
+    start_time = time.time()
+    result = importer.precompute_answers(course_questions)
+    print("Answered %d questions in %.1f seconds (no answer: %d, failed: %d)"
+          % (result[EdxQuestionImporter.ANSWERED], time.time() - start_time, result[EdxQuestionImporter.NO_ANSWER],
+             result[EdxQuestionImporter.FAILED]))
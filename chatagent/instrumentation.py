@@ -0,0 +1,365 @@
+import json
+import logging
+import threading
+import time
+
+import dbconfig as config
+
+"""
+This file contains the instrumentation of the chat pipeline: timers for the stages of a chat turn, and
+counters (e.g. for the search cache, the requests to the StackExchange API and the database statements).
+
+The stages are timed with ```Metrics.timer```, and the counters are increased with ```Metrics.increment```:
+    with get_metrics().timer("search"):
+        ...
+    get_metrics().increment("search_cache", {'result': 'hit'})
+The timings of each stage are collected in a histogram, and are exposed (together with the counters) by the
+XBlock, as JSON (```get_metrics```) or in the Prometheus text format (```metrics```). The stages timed within
+a chat turn (see ```Metrics.trace```) can also be logged as one JSON line per turn (logger 'chatagent.trace'),
+so that the stage that made a slow answer slow can be found. Nested stages are included in the outer stage.
+
+The instrumentation is disabled by default (see ```instrumentation_parameters``` in the config file). When
+disabled, the timers and counters return immediately, and the database cursors are not wrapped.
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+
+class _NoOpTimer(object):
+    """
+    Timer used when the instrumentation is disabled (shared, since it does nothing)
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NO_OP_TIMER = _NoOpTimer()
+
+
+class _StageTimer(object):
+    """
+    Times a stage, and adds the time to the metrics (and the current trace)
+    """
+
+    def __init__(self, metrics=object, stage=str):
+        self.__metrics = metrics
+        self.__stage = stage
+        self.__start_time = None
+
+    def __enter__(self):
+        self.__start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.__metrics.observe(self.__stage, time.time() - self.__start_time)
+        return False
+
+
+class _Trace(object):
+    """
+    Collects the stage timings and counters of one chat turn (in the thread running the turn),
+    and logs them as JSON when the turn is finished
+    """
+
+    def __init__(self, metrics=object, name=str, local=threading.local):
+        self.__metrics = metrics
+        self.__name = name
+        self.__local = local
+        self.__start_time = None
+        self.stages = dict()  # stage => seconds
+        self.counters = dict()  # counter => value
+
+    def __enter__(self):
+        self.__local.trace = self
+        self.__start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.time() - self.__start_time
+        self.__local.trace = None
+        self.__metrics.observe(self.__name, duration)
+        self.__metrics.log_trace(self.__name, duration, self.stages, self.counters, exc_type is not None)
+        return False
+
+
+class _InstrumentedCursor(object):
+    """
+    Database cursor counting and timing the executed statements (other calls are passed on to the cursor)
+    """
+
+    def __init__(self, metrics=object, cursor=object):
+        self.__metrics = metrics
+        self.__cursor = cursor
+
+    def execute(self, query, args=None):
+        self.__metrics.increment("db_statements")
+        with self.__metrics.timer("db_statement"):
+            return self.__cursor.execute(query, args)
+
+    def executemany(self, query, args):
+        self.__metrics.increment("db_statements")
+        with self.__metrics.timer("db_statement"):
+            return self.__cursor.executemany(query, args)
+
+    def __getattr__(self, name):
+        return getattr(self.__cursor, name)
+
+
+class Metrics(object):
+    """
+    Thread-safe collection of the stage timers and counters
+    """
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    """
+    The default upper bounds (seconds) of the buckets of the timer histograms
+    """
+
+    __PREFIX = "chatagent_"
+    """
+    Prefix of the names of the metrics in the Prometheus format
+    """
+
+    def __init__(self, enabled=False, log_traces=False, slow_trace_threshold=0.0, buckets=DEFAULT_BUCKETS):
+        """
+        Constructor for the metrics
+
+        Arguments:
+            enabled (bool): Should the timers and counters be collected?
+            log_traces (bool): Should the stage timings of each chat turn be logged (see ```trace```)?
+            slow_trace_threshold (float): Only the turns that took at least this many seconds are logged
+            buckets (tuple): The upper bounds (seconds) of the buckets of the timer histograms
+
+        """
+        self.__enabled = enabled
+        self.__log_traces = log_traces
+        self.__slow_trace_threshold = slow_trace_threshold
+        self.__buckets = tuple(sorted(buckets))
+        self.__timers = dict()  # stage => [count, sum, max, list of bucket counts]
+        self.__counters = dict()  # (counter, labels) => value
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__logger = logging.getLogger("chatagent.trace")
+
+    def is_enabled(self):
+        return self.__enabled
+
+    def timer(self, stage=str):
+        """
+        Returns a context manager timing the stage, e.g. ```with metrics.timer("search"): ...```
+
+        Arguments:
+            stage (str): The name of the stage
+
+        Returns:
+            object: The timer (context manager)
+
+        """
+        if not self.__enabled:
+            return _NO_OP_TIMER
+        return _StageTimer(self, stage)
+
+    def trace(self, name=str):
+        """
+        Returns a context manager for a chat turn. The turn itself is timed as the stage ```name```, and the
+        stages timed and the counters increased (in the same thread) during the turn are logged at the end
+        of the turn (if ```log_traces``` is set).
+
+        Arguments:
+            name (str): The name of the trace, e.g. 'chat_turn'
+
+        Returns:
+            object: The trace (context manager)
+
+        """
+        if not self.__enabled:
+            return _NO_OP_TIMER
+        return _Trace(self, name, self.__local)
+
+    def observe(self, stage=str, seconds=float):
+        """
+        Adds the time spent in the stage
+
+        Arguments:
+            stage (str): The name of the stage
+            seconds (float): The time spent
+
+        """
+        if not self.__enabled:
+            return
+        with self.__lock:
+            timer = self.__timers.get(stage)
+            if timer is None:
+                timer = [0, 0.0, 0.0, [0] * len(self.__buckets)]
+                self.__timers[stage] = timer
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+            for index, upper_bound in enumerate(self.__buckets):
+                if seconds <= upper_bound:
+                    timer[3][index] += 1
+                    break
+        trace = getattr(self.__local, 'trace', None)
+        if trace is not None:
+            trace.stages[stage] = trace.stages.get(stage, 0.0) + seconds
+
+    def increment(self, counter=str, labels=None, amount=1):
+        """
+        Increases the counter
+
+        Arguments:
+            counter (str): The name of the counter, e.g. 'api_requests'
+            labels (dict): The labels of the counter, e.g. ```{'method': 'search'}``` (None: no labels)
+            amount (int): The amount to add
+
+        """
+        if not self.__enabled:
+            return
+        key = (counter, tuple(sorted(labels.items())) if labels else ())
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + amount
+        trace = getattr(self.__local, 'trace', None)
+        if trace is not None:
+            trace_key = counter + _format_labels(key[1])
+            trace.counters[trace_key] = trace.counters.get(trace_key, 0) + amount
+
+    def instrument_cursor(self, cursor=object):
+        """
+        Returns the database cursor wrapped, so that the statements are counted and timed
+        (the cursor is returned as it is if the instrumentation is disabled)
+
+        Arguments:
+            cursor (MySQLdb.cursors.Cursor): The cursor
+
+        Returns:
+            object: The cursor
+
+        """
+        if not self.__enabled:
+            return cursor
+        return _InstrumentedCursor(self, cursor)
+
+    def log_trace(self, name=str, duration=float, stages=dict, counters=dict, failed=bool):
+        """
+        Logs the stage timings and counters of the chat turn as one JSON line (if ```log_traces``` is set,
+        and the turn took at least ```slow_trace_threshold``` seconds)
+        """
+        if not self.__log_traces or duration < self.__slow_trace_threshold:
+            return
+        self.__logger.info(json.dumps({
+            'trace': name,
+            'duration': round(duration, 6),
+            'failed': failed,
+            'stages': dict((stage, round(seconds, 6)) for stage, seconds in stages.items()),
+            'counters': counters
+        }, sort_keys=True))
+
+    def get_snapshot(self):
+        """
+        Returns the current values of the timers and counters
+
+        Returns:
+            dict:
+            |  {
+            |      'enabled': enabled,
+            |      'timers': {stage: {'count': count, 'sum': seconds, 'max': seconds, 'mean': seconds}},
+            |      'counters': [{'name': counter, 'labels': labels, 'value': value}]
+            |  }
+
+        """
+        with self.__lock:
+            timers = dict((stage, {'count': timer[0], 'sum': timer[1], 'max': timer[2],
+                                   'mean': timer[1] / timer[0] if timer[0] > 0 else 0.0})
+                          for stage, timer in self.__timers.items())
+            counters = [{'name': counter, 'labels': dict(labels), 'value': value}
+                        for (counter, labels), value in sorted(self.__counters.items())]
+        return {'enabled': self.__enabled, 'timers': timers, 'counters': counters}
+
+    def to_prometheus(self):
+        """
+        Returns the timers and counters in the Prometheus text format. The timers are exposed as the histogram
+        ```chatagent_stage_seconds``` (with the label 'stage'), and the counters as ```chatagent_<counter>_total```.
+
+        Returns:
+            str: The metrics
+
+        See:
+            https://prometheus.io/docs/instrumenting/exposition_formats/
+
+        """
+        lines = list()
+        with self.__lock:
+            timers = sorted((stage, timer[0], timer[1], list(timer[3])) for stage, timer in self.__timers.items())
+            counters = sorted(self.__counters.items())
+        histogram = self.__PREFIX + "stage_seconds"
+        lines.append("# HELP %s Time spent in each stage of the chat pipeline" % histogram)
+        lines.append("# TYPE %s histogram" % histogram)
+        for stage, count, total, bucket_counts in timers:
+            cumulative_count = 0
+            for upper_bound, bucket_count in zip(self.__buckets, bucket_counts):
+                cumulative_count += bucket_count
+                lines.append('%s_bucket{stage="%s",le="%s"} %d' % (histogram, _escape(stage), repr(upper_bound),
+                                                                   cumulative_count))
+            lines.append('%s_bucket{stage="%s",le="+Inf"} %d' % (histogram, _escape(stage), count))
+            lines.append('%s_sum{stage="%s"} %s' % (histogram, _escape(stage), repr(total)))
+            lines.append('%s_count{stage="%s"} %d' % (histogram, _escape(stage), count))
+        previous_counter = None
+        for (counter, labels), value in counters:
+            name = self.__PREFIX + counter + "_total"
+            if counter != previous_counter:
+                lines.append("# TYPE %s counter" % name)
+                previous_counter = counter
+            lines.append("%s%s %d" % (name, _format_labels(labels), value))
+        return u"\n".join(lines) + u"\n"
+
+    def reset(self):
+        """
+        Removes all timings and counters
+        """
+        with self.__lock:
+            self.__timers.clear()
+            self.__counters.clear()
+
+
+def _format_labels(labels=tuple):
+    """
+    Returns the labels in the Prometheus format, e.g. '{method="search"}' (empty if there are no labels)
+    """
+    if not labels:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, _escape(value)) for name, value in labels) + "}"
+
+
+def _escape(value=object):
+    """
+    Escapes the label value (Prometheus format)
+    """
+    return unicode(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """
+    Returns the metrics shared by the process, creating them on first use.
+    The settings are read from ```instrumentation_parameters``` in the config file (if set),
+    except ```access_token```, which is used by the metrics handlers of the XBlock.
+
+    Returns:
+        Metrics: The metrics
+
+    """
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                instrumentation_parameters = getattr(config, 'instrumentation_parameters', dict())
+                _metrics = Metrics(**dict((name, value) for name, value in instrumentation_parameters.items()
+                                          if name != 'access_token'))
+    return _metrics
@@ -0,0 +1,164 @@
+import csv
+import datetime
+import json
+import sys
+from collections import OrderedDict
+
+from mysqldatabase import MySQLDatabase
+
+"""
+This file contains the export of the logged chat interactions (answers with their question, user and
+StackExchange link) to CSV or JSON Lines files, e.g. for research.
+
+The rows are streamed from the database (see ```MySQLDatabase.iter_question_and_answer_records```)
+and written one at a time, so the export runs in constant memory regardless of the size of the log.
+Columns can be left out (e.g. the long 'answer_text').
+
+The export is run with:
+    python interactionexport.py <csv|jsonl> <output file> [--exclude column,column] [--columns column,column]
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+
+def get_export_columns(columns=None, exclude=None):
+    """
+    Returns the names of the columns to export.
+
+    Arguments:
+        columns (list): The columns to export (None: all columns, see ```MySQLDatabase.EXPORT_COLUMNS```)
+        exclude (list): The columns to leave out
+
+    Returns:
+        list: The names of the columns, in the order they are exported
+
+    """
+    if columns is None:
+        columns = [name for name, column in MySQLDatabase.EXPORT_COLUMNS]
+    if exclude is not None:
+        columns = [name for name in columns if name not in exclude]
+    return columns
+
+
+def export_to_csv(file_path=str, columns=None, exclude=None, where=None, where_args=dict,
+                  chunk_size=MySQLDatabase.DEFAULT_CHUNK_SIZE):
+    """
+    Exports the interactions to a CSV file (UTF-8, with a header row).
+
+    Arguments:
+        file_path (str): The path of the file to write
+        columns (list): The columns to export (None: all columns)
+        exclude (list): The columns to leave out
+        where (str): (Optional) The WHERE clause (see ```MySQLDatabase.iter_question_and_answer_records```)
+        where_args (dict): (Requires ```where```) Dictionary with values for the where clause
+        chunk_size (int): The number of rows retrieved from the database at a time
+
+    Returns:
+        int: The number of exported rows
+
+    """
+    columns = get_export_columns(columns, exclude)
+    no_of_rows = 0
+    with open(file_path, "wb") as export_file:
+        writer = csv.writer(export_file)
+        writer.writerow(columns)
+        for row in MySQLDatabase().iter_question_and_answer_records(columns, where, where_args, chunk_size):
+            writer.writerow([_to_csv_value(row[name]) for name in columns])
+            no_of_rows += 1
+    return no_of_rows
+
+
+def export_to_jsonl(file_path=str, columns=None, exclude=None, where=None, where_args=dict,
+                    chunk_size=MySQLDatabase.DEFAULT_CHUNK_SIZE):
+    """
+    Exports the interactions to a JSON Lines file (one JSON object per line, UTF-8).
+
+    Arguments:
+        file_path (str): The path of the file to write
+        columns (list): The columns to export (None: all columns)
+        exclude (list): The columns to leave out
+        where (str): (Optional) The WHERE clause (see ```MySQLDatabase.iter_question_and_answer_records```)
+        where_args (dict): (Requires ```where```) Dictionary with values for the where clause
+        chunk_size (int): The number of rows retrieved from the database at a time
+
+    Returns:
+        int: The number of exported rows
+
+    """
+    columns = get_export_columns(columns, exclude)
+    no_of_rows = 0
+    with open(file_path, "wb") as export_file:
+        for row in MySQLDatabase().iter_question_and_answer_records(columns, where, where_args, chunk_size):
+            ordered_row = OrderedDict((name, _to_unicode(row[name])) for name in columns)
+            export_file.write(json.dumps(ordered_row, default=_to_json_value, ensure_ascii=False).encode("utf8"))
+            export_file.write("\n")
+            no_of_rows += 1
+    return no_of_rows
+
+
+def _to_csv_value(value=object):
+    """
+    Converts the value from the database to a value that can be written by the CSV writer
+
+    Arguments:
+        value (object): The value
+
+    Returns:
+        str: The value (unicode is encoded as UTF-8, dates as ISO 8601)
+
+    """
+    if value is None:
+        return ""
+    if isinstance(value, unicode):
+        return value.encode("utf8")
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def _to_unicode(value=object):
+    """
+    Decodes the text returned as ```str``` by the database (UTF-8), so that it can be combined with unicode
+    by the JSON encoder. Other values are returned unchanged.
+
+    Arguments:
+        value (object): The value
+
+    Returns:
+        object: The value (text as unicode)
+
+    """
+    if isinstance(value, str):
+        return value.decode("utf8", "replace")
+    return value
+
+
+def _to_json_value(value=object):
+    """
+    Converts the values that the JSON encoder does not support (dates, decimals)
+
+    Arguments:
+        value (object): The value
+
+    Returns:
+        str: The value as text (dates as ISO 8601)
+
+    """
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+if __name__ == "__main__":
+    export_functions = {'csv': export_to_csv, 'jsonl': export_to_jsonl}
+    arguments = sys.argv[1:]
+    options = dict()
+    while len(arguments) > 2 and arguments[-2] in ("--exclude", "--columns"):
+        options[arguments[-2]] = arguments[-1].split(",")
+        arguments = arguments[:-2]
+    if len(arguments) != 2 or arguments[0] not in export_functions:
+        print("Usage: python interactionexport.py <csv|jsonl> <output file> "
+              "[--exclude column,column] [--columns column,column]")
+        sys.exit(1)
+    exported = export_functions[arguments[0]](arguments[1], options.get("--columns"), options.get("--exclude"))
+    print("Exported %d rows to %s" % (exported, arguments[1]))
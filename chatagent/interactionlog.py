@@ -0,0 +1,361 @@
+import Queue
+import atexit
+import threading
+import time
+
+import dbconfig as config
+from mysqldatabase import MySQLDatabase
+
+"""
+This file contains the write-behind logging of the chat interactions (questions, answers and updates).
+
+Instead of storing each interaction in the database before the user gets a response, the interactions
+are put in a queue and written by a background thread in batches. A batch is written when it reaches
+the batch size, or when the flush interval has passed since the first interaction in the batch was logged.
+The primary keys of the stored rows are not known when the interaction is logged, so a ```PendingKey```
+is returned instead, which is set when the batch is written (and can be used in later interactions).
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+
+class PendingKey(object):
+    """
+    The primary key of a row that is waiting to be written to the database.
+    The key is set when the row has been written (or ```PRIMARY_KEY_NOT_FOUND``` if it failed).
+    """
+
+    def __init__(self):
+        """
+        Constructor for the pending key
+        """
+        self.__key = None
+        self.__resolved = threading.Event()
+        self.__callbacks = list()
+        self.__lock = threading.Lock()
+
+    def get_key(self):
+        return self.__key
+
+    def set_key(self, key=long):
+        with self.__lock:
+            self.__key = key
+            self.__resolved.set()
+            callbacks = self.__callbacks
+            self.__callbacks = list()
+        for callback in callbacks:
+            try:
+                callback(key)
+            except Exception as err:
+                print("Error (Pending key callback): %s" % err)
+
+    def add_callback(self, callback=object):
+        """
+        Adds a function that is called with the key when it is set (right away, if it already is set).
+        The function is called by the thread writing the interactions, so it should return quickly.
+
+        Arguments:
+            callback (function): Function taking the key as argument
+
+        """
+        with self.__lock:
+            if not self.__resolved.is_set():
+                self.__callbacks.append(callback)
+                return
+        callback(self.__key)
+
+    def is_resolved(self):
+        return self.__resolved.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Waits until the row has been written.
+
+        Arguments:
+            timeout (float): Maximum number of seconds to wait (None: wait until written)
+
+        Returns:
+            long: The primary key || None (if the row wasn't written within the timeout)
+
+        """
+        self.__resolved.wait(timeout)
+        return self.__key
+
+
+class InteractionLogger(object):
+    """
+    Writes the chat interactions to the MySQL database in batches, in a background thread.
+    The queue is written to the database before the process exits.
+    """
+
+    DEFAULT_BATCH_SIZE = 100
+    """
+    The default maximum number of interactions written in one batch
+    """
+
+    DEFAULT_FLUSH_INTERVAL = 2.0
+    """
+    The default number of seconds an interaction can wait in the queue before the batch is written
+    """
+
+    DEFAULT_MAX_QUEUE_SIZE = 10000
+    """
+    The default maximum number of interactions in the queue (logging blocks when the queue is full)
+    """
+
+    __QUESTION = "question"
+    __ANSWER = "answer"
+    __ANSWER_UPDATE = "answer_update"
+    __FLUSH = "flush"
+    __STOP = "stop"
+
+    __MAX_UPDATE_ATTEMPTS = 5
+    """
+    The number of batches an update waits for the answer it updates to be written (the answer can be
+    written by another process, see ```answersession.SQLiteAnswerSessionStore```), before it is dropped
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_queue_size=DEFAULT_MAX_QUEUE_SIZE):
+        """
+        Constructor for the interaction logger. The background thread is started when the first
+        interaction is logged.
+
+        Arguments:
+            batch_size (int): Maximum number of interactions written in one batch
+            flush_interval (float): Seconds an interaction can wait before the batch is written
+            max_queue_size (int): Maximum number of interactions in the queue
+
+        """
+        self.__batch_size = batch_size
+        self.__flush_interval = flush_interval
+        self.__queue = Queue.Queue(max_queue_size)
+        self.__lock = threading.Lock()
+        self.__writer = None
+
+    def log_question(self, question_dictionary=dict):
+        """
+        Adds the question to the queue.
+
+        Arguments:
+            question_dictionary (dict): The question data (see ```MySQLDatabase.insert_into_table_questions```)
+
+        Returns:
+            PendingKey: The primary key of the question, set when it has been written
+
+        """
+        question_key = PendingKey()
+        self.__put((self.__QUESTION, question_dictionary, question_key))
+        return question_key
+
+    def log_answer(self, answer_dictionary=dict):
+        """
+        Adds the answer to the queue. The ```question_id``` can be the ```PendingKey``` of a logged question.
+
+        Arguments:
+            answer_dictionary (dict): The answer data (see ```MySQLDatabase.insert_into_table_answers```)
+
+        Returns:
+            PendingKey: The primary key of the answer, set when it has been written
+
+        """
+        answer_key = PendingKey()
+        self.__put((self.__ANSWER, answer_dictionary, answer_key))
+        return answer_key
+
+    def log_answer_update(self, update_key=None, update_dict=dict, update_all=bool):
+        """
+        Adds the update of an answer to the queue. The ```answer_id``` (and ```question_id```)
+        can be the ```PendingKey``` of a logged answer (and question).
+
+        Arguments:
+            update_key (str) (None): Key for value to update (if only one value is to be changed)
+            update_dict (dict): Value(s) to update (see ```MySQLDatabase.update_tbl_answers```)
+            update_all (bool): True: Update all values. False: Update value based on passed key
+
+        """
+        self.__put((self.__ANSWER_UPDATE, (update_key, update_dict, update_all), 1))
+
+    def flush(self, timeout=None):
+        """
+        Writes the interactions in the queue to the database, and waits until they are written.
+
+        Arguments:
+            timeout (float): Maximum number of seconds to wait (None: wait until written)
+
+        Returns:
+            bool: True if the queue was written within the timeout, False otherwise
+
+        """
+        if self.__writer is None:
+            return True
+        flushed = threading.Event()
+        self.__put((self.__FLUSH, None, flushed))
+        flushed.wait(timeout)
+        return flushed.is_set()
+
+    def shutdown(self, timeout=None):
+        """
+        Writes the interactions in the queue to the database, and stops the background thread.
+
+        Arguments:
+            timeout (float): Maximum number of seconds to wait for the queue to be written
+
+        """
+        with self.__lock:
+            writer = self.__writer
+            self.__writer = None
+        if writer is None:
+            return
+        self.__queue.put((self.__STOP, None, None))
+        writer.join(timeout)
+
+    def __put(self, event=tuple):
+        """
+        Adds the event to the queue, and starts the background thread (if it isn't running)
+
+        Arguments:
+            event (tuple): (event_type, data, key)
+
+        """
+        with self.__lock:
+            if self.__writer is None:
+                self.__writer = threading.Thread(target=self.__run, name="InteractionLogWriter")
+                self.__writer.daemon = True
+                self.__writer.start()
+        self.__queue.put(event)
+
+    def __run(self):
+        """
+        Collects the events in the queue, and writes them in batches (run by the background thread)
+        """
+        batch = list()
+        deadline = None
+        running = True
+        while running:
+            timeout = None if deadline is None else max(deadline - time.time(), 0)
+            try:
+                event_type, data, key = self.__queue.get(timeout=timeout)
+            except Queue.Empty:
+                event_type, data, key = self.__FLUSH, None, None
+            if event_type == self.__STOP:
+                running = False
+            elif event_type != self.__FLUSH:
+                batch.append((event_type, data, key))
+                if deadline is None:
+                    deadline = time.time() + self.__flush_interval
+                if len(batch) < self.__batch_size:
+                    continue
+            self.__write_batch(batch)
+            batch = list()
+            deadline = None
+            if event_type == self.__FLUSH and key is not None:
+                key.set()
+
+    def __write_batch(self, batch=list):
+        """
+        Writes the batch to the database. Questions are written first, then answers, and then
+        the updates, so that the keys they depend on are set before they are written.
+
+        Arguments:
+            batch (list): List of events (event_type, data, key)
+
+        """
+        if len(batch) == 0:
+            return
+        questions = [(data, key) for event_type, data, key in batch if event_type == self.__QUESTION]
+        answers = [(data, key) for event_type, data, key in batch if event_type == self.__ANSWER]
+        updates = [(data, attempt) for event_type, data, attempt in batch if event_type == self.__ANSWER_UPDATE]
+        try:
+            if len(questions) > 0:
+                pk_list = MySQLDatabase().insert_batch_into_table_questions([data for data, key in questions])
+                for (data, key), pk_question in zip(questions, pk_list):
+                    key.set_key(pk_question)
+            answer_rows = list()
+            for data, key in answers:
+                row = self.__resolve_keys(data)
+                if row is None:
+                    key.set_key(MySQLDatabase.PRIMARY_KEY_NOT_FOUND)
+                else:
+                    answer_rows.append((row, key))
+            if len(answer_rows) > 0:
+                pk_list = MySQLDatabase().insert_batch_into_table_answers([row for row, key in answer_rows])
+                for (row, key), pk_answer in zip(answer_rows, pk_list):
+                    key.set_key(pk_answer)
+            update_rows = list()
+            for (update_key, update_dict, update_all), attempt in updates:
+                row = self.__resolve_keys(update_dict)
+                if row is not None:
+                    update_rows.append((update_key, row, update_all))
+                elif attempt < self.__MAX_UPDATE_ATTEMPTS and self.__is_pending(update_dict):
+                    # the answer has not been written yet (by another process), so it is tried in the next batch
+                    self.__retry((self.__ANSWER_UPDATE, (update_key, update_dict, update_all), attempt + 1))
+            MySQLDatabase().update_batch_tbl_answers(update_rows)
+        except Exception as err:
+            print("Error (Write interaction log): %s", err)
+        finally:
+            # rows that weren't written should not keep anyone waiting for their key
+            for event_type, data, key in batch:
+                if isinstance(key, PendingKey) and not key.is_resolved():
+                    key.set_key(MySQLDatabase.PRIMARY_KEY_NOT_FOUND)
+
+    def __retry(self, event=tuple):
+        """
+        Adds the event to the queue again (run by the background thread, so it does not wait if the queue is full)
+        """
+        try:
+            self.__queue.put_nowait(event)
+        except Queue.Full:
+            print("Error (Write interaction log): the queue is full, the update is dropped")
+
+    @staticmethod
+    def __is_pending(dictionary=dict):
+        """
+        Returns True if a ```PendingKey``` in the dictionary has not been set yet
+        """
+        return any(isinstance(value, PendingKey) and value.get_key() is None for value in dictionary.values())
+
+    @staticmethod
+    def __resolve_keys(dictionary=dict):
+        """
+        Returns a copy of the dictionary where the ```PendingKey``` values are replaced by their key.
+
+        Arguments:
+            dictionary (dict): The interaction data
+
+        Returns:
+            dict: The data with the keys set || None (if a key it depends on wasn't written)
+
+        """
+        resolved = dict()
+        for name, value in dictionary.items():
+            if isinstance(value, PendingKey):
+                value = value.get_key()
+                if value is None or value == MySQLDatabase.PRIMARY_KEY_NOT_FOUND:
+                    return None
+            resolved[name] = value
+        return resolved
+
+
+_interaction_logger = None
+_interaction_logger_lock = threading.Lock()
+
+
+def get_interaction_logger():
+    """
+    Returns the process-wide interaction logger, creating it on first use. The logger settings are read
+    from ```interaction_log_parameters``` in the config file (if set). The queue is written to the
+    database when the process exits.
+
+    Returns:
+        InteractionLogger: The interaction logger
+
+    """
+    global _interaction_logger
+    if _interaction_logger is None:
+        with _interaction_logger_lock:
+            if _interaction_logger is None:
+                log_parameters = getattr(config, 'interaction_log_parameters', dict())
+                _interaction_logger = InteractionLogger(**log_parameters)
+                atexit.register(_interaction_logger.shutdown)
+    return _interaction_logger
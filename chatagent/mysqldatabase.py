@@ -1,7 +1,8 @@
 
 import MySQLdb
 
-import dbconfig as config
+from connectionpool import get_connection_pool
+from instrumentation import get_metrics
 
 _author_ = "Knut Lucas Andersen"
 
@@ -12,8 +13,9 @@ class MySQLDatabase:
     The main goal of this class is to save test data from user experiments.
     """
 
-    __db = None  # the database connection
-    __mysql_parameters = None  # parameters for database connection
+    __db = None  # the database connection (checked out from the connection pool)
+    __connection_failed = False  # has an operation on the connection failed? (it is then not re-used)
+    __pool = None  # the connection pool shared by all instances
     # Constant values: Error values
     PRIMARY_KEY_NOT_FOUND = -1
     # "Constant" values: Table names
@@ -23,29 +25,55 @@ class MySQLDatabase:
     __TBL_STACKEXCHANGE = "tblStackExchange"
     __TBL_QUESTIONS = "tblChatQuestions"
     __TBL_FEEDBACK_QUESTIONS = "tblFeedbackQuestions"
+    __TBL_EDX_QUESTIONS = "tblEdxQuestions"
+    __TBL_EDX_ANSWERS = "tblEdxAnswers"
     # "Constant" values: Primary keys
     __PK_USERS = "chatUserID"
     __PK_QUESTIONS = "chatQuestionID"
     __PK_ANSWERS = "chatAnswersID"
     __PK_STACKEXCHANGE = "stackexchangeID"
+    __PK_EDX_QUESTIONS = "edx_questionID"
+    # "Constant" values: The columns that can be exported (name => column), in the default order
+    EXPORT_COLUMNS = [
+        ('answer_id', "tblChatAnswers.chatAnswersID"),
+        ('answer_text', "tblChatAnswers.answer_text"),
+        ('answer_preview', "tblChatAnswers.answer_preview"),
+        ('is_answer_read', "tblChatAnswers.is_answer_read"),
+        ('correct_answer', "tblChatAnswers.correct_answer"),
+        ('question_id', "tblChatQuestions.chatQuestionID"),
+        ('edx_question_id', "tblChatQuestions.edx_questionID"),
+        ('question_text', "tblChatQuestions.question_text"),
+        ('asked_by_user', "tblChatQuestions.asked_by_user"),
+        ('user_id', "tblChatUsers.chatUserID"),
+        ('username', "tblChatUsers.username"),
+        ('stackexchange_id', "tblStackExchange.stackexchangeID"),
+        ('stackexchange_link', "tblStackExchange.stackexchange_link"),
+        ('lookup_date', "tblStackExchange.lookup_date"),
+    ]
+    DEFAULT_CHUNK_SIZE = 1000
+    # The answer values that can be updated one at a time (update_key => column in tblChatAnswers)
+    __UPDATE_ANSWER_COLUMNS = {
+        'answer_text': "answer_text",
+        'answer_preview': "answer_preview",
+        'is_answer_read': "is_answer_read",
+        'correct_answer': "correct_answer",
+        'stackexchange_id': "fk_tblStackExchange",
+        'question_id': "fk_tblChatQuestions",
+    }
 
     def __init__(self):
         """
-        Constructor connecting to the MySQL database.
+        Constructor for the MySQL database. The connection is checked out from the
+        process-wide connection pool when it is first needed, and returned to the
+        pool when the operation is finished.
+
+        See:
+            ```connectionpool.ConnectionPool```
+
         """
-        try:
-            # retrieve connection parameters from config file
-            self.__mysql_parameters = config.mysql_parameters
-            # attempt to connect to the database
-            self.__db = MySQLdb.connect(
-                self.__mysql_parameters['host'],
-                self.__mysql_parameters['user'],
-                self.__mysql_parameters['passwd'],
-                self.__mysql_parameters['db']
-            )
-            self.__db.autocommit(True)
-        except MySQLdb.Error as err:
-            print("Error during connection: %s", err)
+        self.__db = None
+        self.__connection_failed = False
+        self.__pool = get_connection_pool()
 
     def get_all_question_and_answer_records(self, where=None, where_args=dict):
         """
@@ -61,6 +89,7 @@ class MySQLDatabase:
         See:
             | ```MySQLCursor.fetchall()```
             | ```MySQLdb.cursors.DictCursor```
+            | ```iter_question_and_answer_records``` (for retrieving the records without loading all into memory)
 
         Returns:
             dict: Dictionary containing the result of the query || None
@@ -84,11 +113,80 @@ class MySQLDatabase:
                 cursor.execute(query)
             result_set = cursor.fetchall()
         except MySQLdb.Error as err:
+            self.__connection_failed = True
             print("MySQLdb.Error (Retrieve QA): %s", err)
         finally:
-            self.__close_db_connection()
+            self.__release_db_connection()
         return result_set
 
+    def iter_question_and_answer_records(self, columns=None, where=None, where_args=dict,
+                                         chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Generator retrieving the answers joined with their question, user and StackExchange link.
+        The rows are read from a server-side cursor in chunks of ```chunk_size```, so only one chunk
+        is kept in memory at a time. The connection is kept until the generator is finished (or closed).
+
+        Arguments:
+            columns (list): The names of the columns to retrieve (see ```EXPORT_COLUMNS```).
+                None retrieves all columns.
+            where (str):
+                |  (Optional) The WHERE clause string (use ```%(where_args_key)s``` for values).
+                |  E.g: 'WHERE tblChatAnswers.correct_answer = %(correct_answer)s',
+                |  and where_args = {'correct_answer': True}
+            where_args (dict): (Requires ```where```) Dictionary with values for the where clause
+            chunk_size (int): The number of rows retrieved from the server at a time
+
+        See:
+            | ```MySQLCursor.fetchmany()```
+            | ```MySQLdb.cursors.SSDictCursor```
+
+        Raises:
+            ValueError: If one of the columns does not exist
+            MySQLdb.Error: If the rows could not be retrieved (so that a partial result is not taken as complete)
+
+        Returns:
+            generator: Yields one dictionary (column name => value) per answer
+
+        """
+        export_columns = dict(self.EXPORT_COLUMNS)
+        if columns is None:
+            columns = [name for name, column in self.EXPORT_COLUMNS]
+        for name in columns:
+            if name not in export_columns:
+                raise ValueError("The column '" + name + "' cannot be exported.")
+        query = "SELECT " + ", ".join([export_columns[name] + " AS " + name for name in columns]) \
+                + " FROM " + self.__TBL_ANSWERS \
+                + " JOIN " + self.__TBL_QUESTIONS + " ON " \
+                + self.__TBL_ANSWERS + ".fk_tblChatQuestions = " + self.__TBL_QUESTIONS + "." + self.__PK_QUESTIONS \
+                + " JOIN " + self.__TBL_CHAT_USERS + " ON " \
+                + self.__TBL_QUESTIONS + ".fk_tblChatUsers = " + self.__TBL_CHAT_USERS + "." + self.__PK_USERS \
+                + " JOIN " + self.__TBL_STACKEXCHANGE + " ON " \
+                + self.__TBL_ANSWERS + ".fk_tblStackExchange = " \
+                + self.__TBL_STACKEXCHANGE + "." + self.__PK_STACKEXCHANGE
+        if where is not None:
+            query += " " + where
+        query += " ORDER BY " + self.__TBL_ANSWERS + "." + self.__PK_ANSWERS + ";"
+        finished = False
+        try:
+            cursor = self.__get_db_cursor(MySQLdb.cursors.SSDictCursor)
+            if where is not None:
+                cursor.execute(query, where_args)
+            else:
+                cursor.execute(query)
+            rows = cursor.fetchmany(chunk_size)
+            while len(rows) > 0:
+                for row in rows:
+                    yield row
+                rows = cursor.fetchmany(chunk_size)
+            finished = True
+        except MySQLdb.Error as err:
+            self.__connection_failed = True
+            print("MySQLdb.Error (Iterate QA): %s", err)
+            raise
+        finally:
+            # unread rows of a server-side cursor block the connection, so it is not re-used
+            self.__release_db_connection(not finished)
+
     def insert_into_table_chat_users(self, user_dictionary=dict):
         """
         Checks if user is stored in database, if not the username is stored in the MySQL database.
@@ -105,6 +203,7 @@ class MySQLDatabase:
         # check if user exists to avoid duplicate insertion
         pk_user = self.__check_if_user_exists(user_dictionary)
         if pk_user > self.PRIMARY_KEY_NOT_FOUND:
+            self.__release_db_connection()
             return pk_user
         # user doesn't exists, store user in database
         query = "INSERT INTO " + self.__TBL_CHAT_USERS + " VALUES (" \
@@ -116,14 +215,16 @@ class MySQLDatabase:
             cursor.execute(query, user_dictionary)
             pk_user = cursor.lastrowid
         except MySQLdb.Error as err:
+            self.__connection_failed = True
             print("MySQLdb.Error: %s", err)
         finally:
-            self.__close_db_connection()
+            self.__release_db_connection()
         return pk_user
 
     def insert_into_table_questions(self, question_dictionary=dict):
         """
-        Stores the Question data in the MySQL database
+        Stores the Question data in the MySQL database. If the question already is stored,
+        the primary key of the stored question is returned (see ```__get_upsert_question_query```).
 
         Arguments:
             question_dictionary (dict):
@@ -135,27 +236,20 @@ class MySQLDatabase:
                 |  - user_id (int): The user ID of the user interacting with the application
 
         Returns:
-            long: The primary key of the inserted question || ```PRIMARY_KEY_NOT_FOUND```
+            long: The primary key of the inserted (or already stored) question || ```PRIMARY_KEY_NOT_FOUND```
 
         """
-        pk_question = self.__check_if_question_exists(question_dictionary)
-        if pk_question > self.PRIMARY_KEY_NOT_FOUND:
-            return pk_question
-        query = "INSERT INTO " + self.__TBL_QUESTIONS + " VALUES (" \
-                + "null, " \
-                + "%(edx_question_id)s, " \
-                + "%(question_text)s, " \
-                + "%(asked_by_user)s, " \
-                + "%(user_id)s " \
-                + ");"
+        pk_question = self.PRIMARY_KEY_NOT_FOUND
+        query = self.__get_upsert_question_query()
         try:
             cursor = self.__get_db_cursor()
             cursor.execute(query, question_dictionary)
             pk_question = cursor.lastrowid
         except MySQLdb.Error as err:
+            self.__connection_failed = True
             print("MySQLdb.Error (INS Q): %s", err)
         finally:
-            self.__close_db_connection()
+            self.__release_db_connection()
         return pk_question
 
     def insert_into_table_answers(self, answer_dictionary=dict):
@@ -166,6 +260,7 @@ class MySQLDatabase:
             answer_dictionary (dict):
                 |  Expects a dictionary containing the following keys/values:
                 |  - answer_text (str): The answer that was found
+                |  - answer_preview (str): The shortened answer shown before 'read more'
                 |  - is_answer_read (bool): Has the 'read more' been clicked?
                 |  - correct_answer (bool): Value for whether or not this answer was accepted by the user
                 |  - question_id (int): The (MySQL) Question ID of the question that was asked
@@ -177,14 +272,7 @@ class MySQLDatabase:
             has been added with key ```answer_id```
 
         """
-        query = "INSERT INTO " + self.__TBL_ANSWERS + " VALUES (" \
-                + "null, " \
-                + "%(answer_text)s, " \
-                + "%(is_answer_read)s, " \
-                + "%(correct_answer)s, " \
-                + "%(stackexchange_id)s, " \
-                + "%(question_id)s " \
-                + ");"
+        query = self.__get_insert_answer_query()
         try:
             cursor = self.__get_db_cursor()
             # insert (or retrieve) the link and get its primary key
@@ -200,9 +288,10 @@ class MySQLDatabase:
             # add the primary key for the inserted data
             answer_dictionary.update({'answer_id': cursor.lastrowid})
         except MySQLdb.Error as err:
+            self.__connection_failed = True
             print("MySQLdb.Error (INS ANS): %s", err)
         finally:
-            self.__close_db_connection()
+            self.__release_db_connection()
         return answer_dictionary
 
     def insert_into_table_user_feedback(self, user_feedback_dictionary=dict):
@@ -235,9 +324,10 @@ class MySQLDatabase:
             cursor.execute(query, user_feedback_dictionary)
             data_saved = True
         except MySQLdb.Error as err:
+            self.__connection_failed = True
             print("MySQLdb.Error: %s", err)
         finally:
-            self.__close_db_connection()
+            self.__release_db_connection()
         return data_saved
 
     def update_tbl_answers(self, update_key=None, answer_dictionary=dict, update_all=bool):
@@ -250,6 +340,7 @@ class MySQLDatabase:
                 |  Expects a dictionary containing one or more of the following keys/values:
                 |  - answer_id (long): Mandatory. The ID of answer to update
                 |  - answer_text (str): The answer text
+                |  - answer_preview (str): The shortened answer text (required if ```update_all```)
                 |  - is_answer_read (bool): Has the 'read more' been clicked?
                 |  - correct_answer (bool): Value for whether or not this answer was accepted by the user
                 |  - question_id (int): The (MySQL) Question ID of the question that was asked
@@ -259,6 +350,9 @@ class MySQLDatabase:
         Returns:
             bool: True if data was updated, false otherwise.
 
+        Raises:
+            ValueError: If the answer ID is not an integer, or the value of ```update_key``` can not be updated
+
         """
         data_saved = False
         answer_id = answer_dictionary.get("answer_id")
@@ -267,24 +361,381 @@ class MySQLDatabase:
         if update_all:
             query = "UPDATE " + self.__TBL_ANSWERS + " SET " \
                     + "answer_text=%(answer_text)s, " \
+                    + "answer_preview=%(answer_preview)s, " \
                     + "is_answer_read=%(is_answer_read)s, " \
                     + "correct_answer=%(correct_answer)s, " \
                     + "fk_tblStackExchange=%(stackexchange_id)s, " \
                     + "fk_tblChatQuestions=%(question_id)s " \
                     + "WHERE chatAnswersID=%(answer_id)s"
         else:
-            # TODO: Add check for value(s) to change. For now, it just updates the 'is_answer_read'
             query = "UPDATE " + self.__TBL_ANSWERS + " SET " \
-                    + "is_answer_read=%(" + update_key + ")s " \
+                    + self.__get_update_answer_column(update_key) + "=%(" + update_key + ")s " \
                     + "WHERE chatAnswersID=%(answer_id)s"
         try:
             cursor = self.__get_db_cursor()
             cursor.execute(query, answer_dictionary)
             data_saved = True
         except MySQLdb.Error as err:
+            self.__connection_failed = True
             print("MySQLdb.Error (UPD ANS): %s", err)
         finally:
-            self.__close_db_connection()
+            self.__release_db_connection()
+        return data_saved
+
+    def insert_batch_into_table_questions(self, question_list=list):
+        """
+        Stores a batch of questions in the MySQL database in one transaction.
+        Questions that already are stored are not stored again (see ```__get_upsert_question_query```).
+
+        Arguments:
+            question_list (list): List of question dictionaries (see ```insert_into_table_questions```)
+
+        Returns:
+            list: The primary keys of the questions (in the same order) || ```PRIMARY_KEY_NOT_FOUND```
+
+        """
+        pk_list = [self.PRIMARY_KEY_NOT_FOUND] * len(question_list)
+        if len(question_list) == 0:
+            return pk_list
+        query = self.__get_upsert_question_query()
+        try:
+            cursor = self.__get_db_cursor()
+            cursor.execute("START TRANSACTION;")
+            for index, question_dictionary in enumerate(question_list):
+                cursor.execute(query, question_dictionary)
+                pk_list[index] = cursor.lastrowid
+            self.__db.commit()
+        except MySQLdb.Error as err:
+            self.__connection_failed = True
+            print("MySQLdb.Error (INS Q BATCH): %s", err)
+            pk_list = [self.PRIMARY_KEY_NOT_FOUND] * len(question_list)
+            self.__rollback()
+        finally:
+            self.__release_db_connection()
+        return pk_list
+
+    def insert_batch_into_table_answers(self, answer_list=list):
+        """
+        Stores a batch of answers (and their Stack* links) in the MySQL database in one transaction.
+        Links that already are stored are not stored again (see ```__get_upsert_stackexchange_query```).
+
+        Arguments:
+            answer_list (list): List of answer dictionaries (see ```insert_into_table_answers```)
+
+        Returns:
+            list: The primary keys of the answers (in the same order) || ```PRIMARY_KEY_NOT_FOUND```
+
+        """
+        pk_list = [self.PRIMARY_KEY_NOT_FOUND] * len(answer_list)
+        if len(answer_list) == 0:
+            return pk_list
+        link_query = self.__get_upsert_stackexchange_query()
+        answer_query = self.__get_insert_answer_query()
+        try:
+            cursor = self.__get_db_cursor()
+            cursor.execute("START TRANSACTION;")
+            link_keys = dict()  # the same link is often used by several answers in the batch
+            for index, answer_dictionary in enumerate(answer_list):
+                link = answer_dictionary.get('stackexchange_link')
+                stackexchange_id = link_keys.get(link)
+                if stackexchange_id is None:
+                    cursor.execute(link_query, {'stackexchange_link': link})
+                    stackexchange_id = cursor.lastrowid
+                    link_keys[link] = stackexchange_id
+                row = dict(answer_dictionary)
+                row.pop('stackexchange_link', None)
+                row['stackexchange_id'] = stackexchange_id
+                cursor.execute(answer_query, row)
+                pk_list[index] = cursor.lastrowid
+            self.__db.commit()
+        except MySQLdb.Error as err:
+            self.__connection_failed = True
+            print("MySQLdb.Error (INS ANS BATCH): %s", err)
+            pk_list = [self.PRIMARY_KEY_NOT_FOUND] * len(answer_list)
+            self.__rollback()
+        finally:
+            self.__release_db_connection()
+        return pk_list
+
+    def update_batch_tbl_answers(self, update_list=list):
+        """
+        Updates a batch of answers in one transaction. Single value updates (```update_all``` is False)
+        with the same value are combined into one UPDATE statement for all the answers.
+
+        Arguments:
+            update_list (list): List of tuples (update_key, answer_dictionary, update_all),
+                see ```update_tbl_answers```
+
+        Returns:
+            bool: True if data was updated, false otherwise.
+
+        Raises:
+            ValueError: If an answer ID is not an integer, or the value of an ```update_key``` can not be updated
+
+        """
+        if len(update_list) == 0:
+            return True
+        data_saved = False
+        update_all_query = "UPDATE " + self.__TBL_ANSWERS + " SET " \
+                           + "answer_text=%(answer_text)s, " \
+                           + "answer_preview=%(answer_preview)s, " \
+                           + "is_answer_read=%(is_answer_read)s, " \
+                           + "correct_answer=%(correct_answer)s, " \
+                           + "fk_tblStackExchange=%(stackexchange_id)s, " \
+                           + "fk_tblChatQuestions=%(question_id)s " \
+                           + "WHERE chatAnswersID=%(answer_id)s"
+        update_all_rows = list()
+        answer_ids_by_value = dict()  # (column, value) => list of answer ids
+        for update_key, answer_dictionary, update_all in update_list:
+            answer_id = answer_dictionary.get("answer_id")
+            if type(answer_id) is not long and type(answer_id) is not int:
+                raise ValueError("Answer ID must be an Integer!")
+            if update_all:
+                update_all_rows.append(answer_dictionary)
+            else:
+                column = self.__get_update_answer_column(update_key)
+                value = answer_dictionary.get(update_key)
+                answer_ids_by_value.setdefault((column, value), list()).append(answer_id)
+        try:
+            cursor = self.__get_db_cursor()
+            cursor.execute("START TRANSACTION;")
+            if len(update_all_rows) > 0:
+                cursor.executemany(update_all_query, update_all_rows)
+            for (column, value), answer_ids in answer_ids_by_value.items():
+                query = "UPDATE " + self.__TBL_ANSWERS + " SET " \
+                        + column + "=%s " \
+                        + "WHERE " + self.__PK_ANSWERS + " IN (" + ", ".join(["%s"] * len(answer_ids)) + ")"
+                cursor.execute(query, [value] + answer_ids)
+            self.__db.commit()
+            data_saved = True
+        except MySQLdb.Error as err:
+            self.__connection_failed = True
+            print("MySQLdb.Error (UPD ANS BATCH): %s", err)
+            self.__rollback()
+        finally:
+            self.__release_db_connection()
+        return data_saved
+
+    def __get_update_answer_column(self, update_key=str):
+        """
+        Returns the column in tblChatAnswers for the value to update
+
+        Arguments:
+            update_key (str): Key for the value to update (see ```update_tbl_answers```)
+
+        Returns:
+            str: The column name
+
+        Raises:
+            ValueError: If the value can not be updated
+
+        """
+        column = self.__UPDATE_ANSWER_COLUMNS.get(update_key)
+        if column is None:
+            raise ValueError("Unknown answer value to update: %s" % update_key)
+        return column
+
+    def get_frequent_questions(self, number_of_questions=int, history_size=int):
+        """
+        Retrieves the questions asked most often among the latest answers (each presented answer is
+        one time the question was asked). Questions asked equally often are ordered by when they were last asked.
+
+        Arguments:
+            number_of_questions (int): The maximum number of questions to retrieve
+            history_size (int): The number of latest answers to count the questions in
+
+        Returns:
+            list: List of dictionaries with the keys ```question_text```, ```times_asked``` and ```last_answer_id```,
+            the most frequent question first
+
+        """
+        result_set = list()
+        query = "SELECT question_text, COUNT(*) AS times_asked, MAX(" + self.__PK_ANSWERS + ") AS last_answer_id " \
+                + "FROM " + self.__TBL_ANSWERS + " JOIN " + self.__TBL_QUESTIONS + " ON " \
+                + "fk_tblChatQuestions = " + self.__PK_QUESTIONS + " " \
+                + "WHERE " + self.__PK_ANSWERS + " > (SELECT MAX(" + self.__PK_ANSWERS + ") FROM " \
+                + self.__TBL_ANSWERS + ") - %(history_size)s " \
+                + "GROUP BY " + self.__PK_QUESTIONS + ", question_text " \
+                + "ORDER BY times_asked DESC, last_answer_id DESC " \
+                + "LIMIT %(number_of_questions)s;"
+        try:
+            cursor = self.__get_db_cursor()
+            cursor.execute(query, {'history_size': history_size, 'number_of_questions': number_of_questions})
+            result_set = list(cursor.fetchall())
+        except MySQLdb.Error as err:
+            self.__connection_failed = True
+            print("MySQLdb.Error (GET FREQ Q): %s", err)
+        finally:
+            self.__release_db_connection()
+        return result_set
+
+    def insert_batch_into_table_edx_questions(self, question_list=list):
+        """
+        Stores a batch of edX questions in the MySQL database in one transaction.
+        Questions that already are stored (same ```edx_question_id```) are updated.
+
+        Arguments:
+            question_list (list):
+                |  List of dictionaries containing the following keys/values:
+                |  - edx_question_id (int): ID of the question in edX
+                |  - course_id (str): ID of the edX course the question belongs to || None
+                |  - question_text (str): The question
+                |  - question_link (str): The link (URL) to the page of the question in the course
+
+        Returns:
+            bool: True if the questions were stored, False otherwise.
+
+        """
+        if len(question_list) == 0:
+            return True
+        data_saved = False
+        query = "INSERT INTO " + self.__TBL_EDX_QUESTIONS + " (" \
+                + self.__PK_EDX_QUESTIONS + ", course_id, question_text, question_link) VALUES (" \
+                + "%(edx_question_id)s, " \
+                + "%(course_id)s, " \
+                + "%(question_text)s, " \
+                + "%(question_link)s" \
+                + ") ON DUPLICATE KEY UPDATE " \
+                + "course_id=VALUES(course_id), " \
+                + "question_text=VALUES(question_text), " \
+                + "question_link=VALUES(question_link);"
+        try:
+            cursor = self.__get_db_cursor()
+            cursor.execute("START TRANSACTION;")
+            cursor.executemany(query, question_list)
+            self.__db.commit()
+            data_saved = True
+        except MySQLdb.Error as err:
+            self.__connection_failed = True
+            print("MySQLdb.Error (INS EDX Q BATCH): %s", err)
+            self.__rollback()
+        finally:
+            self.__release_db_connection()
+        return data_saved
+
+    def get_edx_questions(self, course_id=None, without_answer=False):
+        """
+        Retrieves the stored edX questions
+
+        Arguments:
+            course_id (str): Only retrieve the questions of this course (None: all courses)
+            without_answer (bool): Only retrieve the questions that have no precomputed answer
+
+        Returns:
+            list: List of dictionaries with the keys ```edx_question_id```, ```course_id```,
+            ```question_text``` and ```question_link```
+
+        """
+        result_set = list()
+        query = "SELECT " + self.__TBL_EDX_QUESTIONS + "." + self.__PK_EDX_QUESTIONS + " AS edx_question_id, " \
+                + "course_id, question_text, question_link FROM " + self.__TBL_EDX_QUESTIONS
+        if without_answer:
+            query += " LEFT JOIN " + self.__TBL_EDX_ANSWERS + " ON " \
+                     + self.__TBL_EDX_ANSWERS + "." + self.__PK_EDX_QUESTIONS + " = " \
+                     + self.__TBL_EDX_QUESTIONS + "." + self.__PK_EDX_QUESTIONS
+        where_clauses = list()
+        if course_id is not None:
+            where_clauses.append("course_id = %(course_id)s")
+        if without_answer:
+            where_clauses.append(self.__TBL_EDX_ANSWERS + "." + self.__PK_EDX_QUESTIONS + " IS NULL")
+        if len(where_clauses) > 0:
+            query += " WHERE " + " AND ".join(where_clauses)
+        query += " ORDER BY edx_question_id;"
+        try:
+            cursor = self.__get_db_cursor()
+            cursor.execute(query, {'course_id': course_id})
+            result_set = list(cursor.fetchall())
+        except MySQLdb.Error as err:
+            self.__connection_failed = True
+            print("MySQLdb.Error (GET EDX Q): %s", err)
+        finally:
+            self.__release_db_connection()
+        return result_set
+
+    def get_edx_question(self, edx_question_id=int):
+        """
+        Retrieves the edX question together with its precomputed answer (if any)
+
+        Arguments:
+            edx_question_id (int): ID of the question in edX
+
+        Returns:
+            dict: Dictionary with the keys ```edx_question_id```, ```course_id```, ```question_text```,
+            ```question_link```, and (None if there is no precomputed answer) ```title```, ```answer_text```,
+            ```answer_preview```, ```stackexchange_link``` and ```computed_date``` || None
+
+        """
+        result = None
+        query = "SELECT " + self.__TBL_EDX_QUESTIONS + "." + self.__PK_EDX_QUESTIONS + " AS edx_question_id, " \
+                + "course_id, question_text, question_link, title, answer_text, answer_preview, " \
+                + "stackexchange_link, computed_date FROM " + self.__TBL_EDX_QUESTIONS \
+                + " LEFT JOIN " + self.__TBL_EDX_ANSWERS + " ON " \
+                + self.__TBL_EDX_ANSWERS + "." + self.__PK_EDX_QUESTIONS + " = " \
+                + self.__TBL_EDX_QUESTIONS + "." + self.__PK_EDX_QUESTIONS \
+                + " LEFT JOIN " + self.__TBL_STACKEXCHANGE + " ON " \
+                + self.__TBL_STACKEXCHANGE + "." + self.__PK_STACKEXCHANGE + " = fk_tblStackExchange" \
+                + " WHERE " + self.__TBL_EDX_QUESTIONS + "." + self.__PK_EDX_QUESTIONS + " = %(edx_question_id)s;"
+        try:
+            cursor = self.__get_db_cursor()
+            cursor.execute(query, {'edx_question_id': edx_question_id})
+            result = cursor.fetchone()
+        except MySQLdb.Error as err:
+            self.__connection_failed = True
+            print("MySQLdb.Error (GET EDX Q): %s", err)
+        finally:
+            self.__release_db_connection()
+        return result
+
+    def insert_or_update_edx_answer(self, answer_dictionary=dict):
+        """
+        Stores the precomputed answer to an edX question (replacing the previous answer, if any)
+
+        Arguments:
+            answer_dictionary (dict):
+                |  Expects a dictionary containing the following keys/values:
+                |  - edx_question_id (int): ID of the question in edX
+                |  - title (str): The title of the StackExchange question the answer belongs to
+                |  - answer_text (str): The (formatted) answer
+                |  - answer_preview (str): The shortened answer shown before 'read more'
+                |  - stackexchange_link (str): The link (URL) to the page where the answer was retrieved from
+
+        Returns:
+            bool: True if the answer was stored, False otherwise.
+
+        """
+        data_saved = False
+        query = "INSERT INTO " + self.__TBL_EDX_ANSWERS + " (" \
+                + self.__PK_EDX_QUESTIONS + ", title, answer_text, answer_preview, fk_tblStackExchange, " \
+                + "computed_date) VALUES (" \
+                + "%(edx_question_id)s, " \
+                + "%(title)s, " \
+                + "%(answer_text)s, " \
+                + "%(answer_preview)s, " \
+                + "%(stackexchange_id)s, " \
+                + "NOW()" \
+                + ") ON DUPLICATE KEY UPDATE " \
+                + "title=VALUES(title), " \
+                + "answer_text=VALUES(answer_text), " \
+                + "answer_preview=VALUES(answer_preview), " \
+                + "fk_tblStackExchange=VALUES(fk_tblStackExchange), " \
+                + "computed_date=VALUES(computed_date);"
+        try:
+            cursor = self.__get_db_cursor()
+            cursor.execute("START TRANSACTION;")
+            cursor.execute(self.__get_upsert_stackexchange_query(),
+                           {'stackexchange_link': answer_dictionary.get('stackexchange_link')})
+            row = dict(answer_dictionary)
+            row.pop('stackexchange_link', None)
+            row['stackexchange_id'] = cursor.lastrowid
+            cursor.execute(query, row)
+            self.__db.commit()
+            data_saved = True
+        except MySQLdb.Error as err:
+            self.__connection_failed = True
+            print("MySQLdb.Error (INS EDX ANS): %s", err)
+            self.__rollback()
+        finally:
+            self.__release_db_connection()
         return data_saved
 
     def __select_all_records_from_tables(self, table_list):
@@ -323,14 +774,17 @@ class MySQLDatabase:
             cursor.execute(query % tuple(table_list))
             result_set = cursor.fetchall()
         except MySQLdb.Error as err:
+            self.__connection_failed = True
             print("MySQLdb.Error (Select all): %s", err)
         finally:
-            self.__close_db_connection()
+            self.__release_db_connection()
         return result_set
 
     def __insert_into_table_stackexchange(self, stackexchange_dictionary=dict):
         """
         Stores the link to StackOverflow where the answer(s) was retrieved from in the MySQL database.
+        If the link already is stored, the primary key of the stored link is returned
+        (see ```__get_upsert_stackexchange_query```).
         Note! This function does not close the database connection.
 
         Arguments:
@@ -342,19 +796,14 @@ class MySQLDatabase:
             long: The primary key of the inserted link
 
         """
-        pk_stackexchange = self.__check_if_stackexchange_link_exists(stackexchange_dictionary)
-        if pk_stackexchange > self.PRIMARY_KEY_NOT_FOUND:
-            return pk_stackexchange
-        query = "INSERT INTO " + self.__TBL_STACKEXCHANGE + " VALUES (" \
-                + "null, " \
-                + "%(stackexchange_link)s, " \
-                + "NOW()" \
-                + ");"
+        pk_stackexchange = self.PRIMARY_KEY_NOT_FOUND
+        query = self.__get_upsert_stackexchange_query()
         try:
             cursor = self.__get_db_cursor()
             cursor.execute(query, stackexchange_dictionary)
             pk_stackexchange = cursor.lastrowid
         except MySQLdb.Error as err:
+            self.__connection_failed = True
             print("MySQLdb.Error (INS SO): %s", err)
         return pk_stackexchange
 
@@ -383,64 +832,6 @@ class MySQLDatabase:
             print("Error: %s", err)
         return self.PRIMARY_KEY_NOT_FOUND
 
-    def __check_if_question_exists(self, question_dictionary=dict):
-        """
-        Checks if the given question is already registered in the database.
-
-        Arguments:
-            question_dictionary (dict):
-                |  Expects a dictionary containing the following keys/values:
-                |  - edx_question_id (int): ID of question in EDX
-                |    (if question is from e.g. course test) || None
-                |  - question_text (str): The question that was asked
-                |  - asked_by_user (bool): Is this question asked/phrased by the user?
-                |  - user_id (int): The user ID of the user interacting with the application
-
-        Returns:
-            long: Primary key || ```PRIMARY_KEY_NOT_FOUND```
-
-        """
-        try:
-            pk_name = self.__PK_QUESTIONS
-            table_name = self.__TBL_QUESTIONS
-            where = "WHERE question_text = %(question_text)s"
-            where_args = {'question_text': question_dictionary.get('question_text')}
-            question_id = self.__get_primary_key_of_table(pk_name, table_name, where, where_args)
-            if question_id > self.PRIMARY_KEY_NOT_FOUND:
-                return question_id
-        except ValueError as err:
-            print("Error: %s", err)
-        except MySQLdb.Error as err:
-            print("MySQLdb.Error (SO_ID): %s", err)
-        return self.PRIMARY_KEY_NOT_FOUND
-
-    def __check_if_stackexchange_link_exists(self, stackexchange_dictionary=dict):
-        """
-        Checks if the given link is already registered in the database.
-
-        Arguments:
-            stackexchange_dictionary (dict):
-                |  The link to the relevant stackexchange page.
-                |  Expects key to be ```stackexchange_link```.
-
-        Returns:
-            long: Primary key || ```PRIMARY_KEY_NOT_FOUND```
-
-        """
-        try:
-            pk_name = self.__PK_STACKEXCHANGE
-            table_name = self.__TBL_STACKEXCHANGE
-            where = "WHERE stackexchange_link = %(stackexchange_link)s"
-            where_args = {'stackexchange_link': stackexchange_dictionary.get('stackexchange_link')}
-            stackexchange_id = self.__get_primary_key_of_table(pk_name, table_name, where, where_args)
-            if stackexchange_id > self.PRIMARY_KEY_NOT_FOUND:
-                return stackexchange_id
-        except ValueError as err:
-            print("Error: %s", err)
-        except MySQLdb.Error as err:
-            print("MySQLdb.Error (SO_ID): %s", err)
-        return self.PRIMARY_KEY_NOT_FOUND
-
     def __get_primary_key_of_table(self, pk_name=str, table_name=str, where=str, where_args=dict):
         """
         Retrieves the primary key of the given entry in the given table
@@ -486,12 +877,93 @@ class MySQLDatabase:
                 return self.PRIMARY_KEY_NOT_FOUND
             primary_key = result_set[pk_name]
         except MySQLdb.Error as err:
+            self.__connection_failed = True
             print("MySQLdb.Error (GET PK): %s", err)
         return primary_key
 
-    def __get_db_cursor(self):
+    def __get_upsert_question_query(self):
+        """
+        Returns the query for storing a question. The question is identified by the SHA1 hash of the
+        (lower case) question text, stored in the column ```question_hash``` which has a UNIQUE index.
+        If the question already is stored, nothing is changed, and ```LAST_INSERT_ID()```
+        (and thereby ```cursor.lastrowid```) is set to the primary key of the stored question.
+
+        Returns:
+            str: The query (expects the keys of the question dictionary)
+
+        """
+        return "INSERT INTO " + self.__TBL_QUESTIONS + " (" \
+               + self.__PK_QUESTIONS + ", edx_questionID, question_text, asked_by_user, fk_tblChatUsers, " \
+               + "question_hash) VALUES (" \
+               + "null, " \
+               + "%(edx_question_id)s, " \
+               + "%(question_text)s, " \
+               + "%(asked_by_user)s, " \
+               + "%(user_id)s, " \
+               + "SHA1(LOWER(%(question_text)s))" \
+               + ") ON DUPLICATE KEY UPDATE " \
+               + self.__PK_QUESTIONS + "=LAST_INSERT_ID(" + self.__PK_QUESTIONS + ");"
+
+    def __get_upsert_stackexchange_query(self):
+        """
+        Returns the query for storing a StackExchange link. The link is identified by its SHA1 hash, stored
+        in the column ```stackexchange_link_hash``` which has a UNIQUE index. If the link already is stored,
+        nothing is changed, and ```LAST_INSERT_ID()``` (and thereby ```cursor.lastrowid```) is set to the
+        primary key of the stored link.
+
+        Returns:
+            str: The query (expects the key ```stackexchange_link```)
+
+        """
+        return "INSERT INTO " + self.__TBL_STACKEXCHANGE + " (" \
+               + self.__PK_STACKEXCHANGE + ", stackexchange_link, lookup_date, stackexchange_link_hash) VALUES (" \
+               + "null, " \
+               + "%(stackexchange_link)s, " \
+               + "NOW(), " \
+               + "SHA1(%(stackexchange_link)s)" \
+               + ") ON DUPLICATE KEY UPDATE " \
+               + self.__PK_STACKEXCHANGE + "=LAST_INSERT_ID(" + self.__PK_STACKEXCHANGE + ");"
+
+    def __get_insert_answer_query(self):
+        """
+        Returns the query for storing an answer
+
+        Returns:
+            str: The query (expects the keys of the answer dictionary, with ```stackexchange_id```)
+
+        """
+        return "INSERT INTO " + self.__TBL_ANSWERS + " (" \
+               + self.__PK_ANSWERS + ", answer_text, answer_preview, is_answer_read, correct_answer, " \
+               + "fk_tblStackExchange, fk_tblChatQuestions) VALUES (" \
+               + "null, " \
+               + "%(answer_text)s, " \
+               + "%(answer_preview)s, " \
+               + "%(is_answer_read)s, " \
+               + "%(correct_answer)s, " \
+               + "%(stackexchange_id)s, " \
+               + "%(question_id)s " \
+               + ");"
+
+    def __rollback(self):
+        """
+        Rolls back the current transaction (if there is a connection)
+        """
+        if self.__db is None:
+            return
+        try:
+            self.__db.rollback()
+        except MySQLdb.Error as err:
+            self.__connection_failed = True
+            print("MySQLdb.Error (Rollback): %s", err)
+
+    def __get_db_cursor(self, cursor_class=MySQLdb.cursors.DictCursor):
         """
         Returns a cursor for executing database operations.
+        If this instance does not have a connection, one is checked out from the connection pool.
+        The executed statements are counted and timed if the instrumentation is enabled (see ```instrumentation```).
+
+        Arguments:
+            cursor_class (class): The type of cursor (e.g. ```MySQLdb.cursors.SSDictCursor``` for server-side)
 
         See:
             ```MySQLdb.cursors.DictCursor```
@@ -500,21 +972,27 @@ class MySQLDatabase:
             MySQLdb.connect.cursor
 
         """
-        return self.__db.cursor(MySQLdb.cursors.DictCursor)
+        metrics = get_metrics()
+        if self.__db is None:
+            with metrics.timer("db_checkout"):
+                self.__db = self.__pool.get_connection()
+        return metrics.instrument_cursor(self.__db.cursor(cursor_class))
 
-    def __close_db_connection(self):
+    def __release_db_connection(self, discard=False):
         """
-        Closes the cursor and the connection to the database
+        Returns the connection to the connection pool, so that it can be re-used.
+        If an operation on the connection failed (e.g. the server has gone away), the connection is
+        closed instead, so that the next request does not get a broken connection.
+
+        Arguments:
+            discard (bool): Should the connection be closed instead of re-used?
+
         """
+        db = self.__db
+        self.__db = None
+        discard = discard or self.__connection_failed
+        self.__connection_failed = False
         try:
-            self.__db.cursor(MySQLdb.cursors.DictCursor).close()
-            self.__db.close()
-        except MySQLdb.ProgrammingError as err:
-            # if the error is that the connection is already closed, ignore it
-            if str(err) == "closing a closed connection":
-                pass
-            else:
-                print("MySQLdb.ProgrammingError: %s", err)
+            self.__pool.release_connection(db, discard)
         except MySQLdb.Error as err:
-            print("MySQLdb.Error (Close Connection): %s", err)
-
+            print("MySQLdb.Error (Release Connection): %s", err)
@@ -0,0 +1,236 @@
+import math
+import sqlite3
+import threading
+from collections import Counter
+
+import dbconfig as config
+from textprocessing import tokenize
+
+"""
+This file contains the re-ranking of the search results (questions) against the question asked by the user.
+
+The search results from StackExchange are ordered by the API (e.g. by activity or votes), which is not
+necessarily the order of relevance to the question that was asked. ```QuestionRanker``` scores the title
+(and the body, if it was retrieved) of each result against the question with BM25, and orders the results
+by their score. The document frequencies used by BM25 are kept in a local SQLite database
+(```DocumentFrequencyStore```), which is updated with every search result that has not been seen before.
+This means that the statistics grow with the questions that actually are asked in the course.
+
+See: https://en.wikipedia.org/wiki/Okapi_BM25
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+
+class DocumentFrequencyStore(object):
+    """
+    Stores the number of documents (questions) each term occurs in, together with the number of documents
+    and their total length, in a local SQLite database. Each document is only counted once.
+    """
+
+    def __init__(self, database_path=str):
+        """
+        Constructor for the document frequency store. The tables are created if they do not exist.
+
+        Arguments:
+            database_path (str): Path to the SQLite database file (':memory:' for a store that is not kept)
+
+        """
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(database_path, check_same_thread=False)
+        with self.__lock:
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS documents ("
+                                      "document_key TEXT PRIMARY KEY, "
+                                      "length REAL NOT NULL)")
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS document_frequency ("
+                                      "term TEXT PRIMARY KEY, "
+                                      "frequency INTEGER NOT NULL)")
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS statistics ("
+                                      "name TEXT PRIMARY KEY, "
+                                      "value REAL NOT NULL)")
+            self.__connection.execute("INSERT OR IGNORE INTO statistics VALUES ('documents', 0)")
+            self.__connection.execute("INSERT OR IGNORE INTO statistics VALUES ('total_length', 0)")
+            self.__connection.commit()
+
+    def add_documents(self, document_list=list):
+        """
+        Adds the documents that have not been added before to the statistics.
+
+        Arguments:
+            document_list (list): List of tuples (document_key, length, set of terms)
+
+        """
+        with self.__lock:
+            added_documents = 0
+            added_length = 0.0
+            term_counter = Counter()
+            for document_key, length, terms in document_list:
+                cursor = self.__connection.execute("INSERT OR IGNORE INTO documents VALUES (?, ?)",
+                                                   (document_key, length))
+                if cursor.rowcount == 1:
+                    added_documents += 1
+                    added_length += length
+                    term_counter.update(terms)
+            if added_documents == 0:
+                return
+            self.__connection.executemany("INSERT OR IGNORE INTO document_frequency VALUES (?, 0)",
+                                          [(term,) for term in term_counter])
+            self.__connection.executemany("UPDATE document_frequency SET frequency = frequency + ? WHERE term = ?",
+                                          [(count, term) for term, count in term_counter.items()])
+            self.__connection.execute("UPDATE statistics SET value = value + ? WHERE name = 'documents'",
+                                      (added_documents,))
+            self.__connection.execute("UPDATE statistics SET value = value + ? WHERE name = 'total_length'",
+                                      (added_length,))
+            self.__connection.commit()
+
+    def get_statistics(self, terms=list):
+        """
+        Returns the statistics needed for scoring the given terms.
+
+        Arguments:
+            terms (list): The terms
+
+        Returns:
+            tuple: (number of documents, average document length, dict with the document frequency of each term)
+
+        """
+        terms = list(set(terms))
+        with self.__lock:
+            statistics = dict(self.__connection.execute("SELECT name, value FROM statistics").fetchall())
+            frequencies = dict()
+            if len(terms) > 0:
+                placeholders = ", ".join("?" * len(terms))
+                frequencies = dict(self.__connection.execute("SELECT term, frequency FROM document_frequency "
+                                                             "WHERE term IN (" + placeholders + ")", terms).fetchall())
+        no_of_documents = int(statistics['documents'])
+        average_length = statistics['total_length'] / no_of_documents if no_of_documents > 0 else 0.0
+        return no_of_documents, average_length, frequencies
+
+
+class QuestionRanker(object):
+    """
+    Class for re-ranking the search results (```StackExchangeQuestions```) by their BM25 score
+    against the question asked by the user.
+    """
+
+    DEFAULT_K1 = 1.2
+    """
+    Controls how fast the score saturates when a term occurs several times in a document
+    """
+
+    DEFAULT_B = 0.75
+    """
+    Controls how much the score is normalized by the length of the document (0: not at all, 1: fully)
+    """
+
+    DEFAULT_TITLE_WEIGHT = 3.0
+    """
+    The number of times a term in the title counts compared to a term in the body
+    """
+
+    def __init__(self, document_frequency_store=DocumentFrequencyStore, k1=DEFAULT_K1, b=DEFAULT_B,
+                 title_weight=DEFAULT_TITLE_WEIGHT):
+        """
+        Constructor for the question ranker.
+
+        Arguments:
+            document_frequency_store (DocumentFrequencyStore): The store with the document frequencies
+            k1 (float): BM25 parameter for term frequency saturation
+            b (float): BM25 parameter for length normalization
+            title_weight (float): The weight of the terms in the title compared to the terms in the body
+
+        """
+        self.__store = document_frequency_store
+        self.__k1 = k1
+        self.__b = b
+        self.__title_weight = title_weight
+
+    def rank(self, question_list=list, question=str):
+        """
+        Orders the search results by their relevance to the question. Results with the same score keep
+        their original order. The results are added to the document frequencies (if not seen before).
+
+        Arguments:
+            question_list (list): List of ```StackExchangeQuestions``` (the search results)
+            question (str): The question that was asked
+
+        Returns:
+            list: The search results, ordered by relevance (most relevant first)
+
+        """
+        scores = self.get_scores(question_list, question)
+        order = sorted(range(0, len(question_list)), key=lambda index: -scores[index])
+        return [question_list[index] for index in order]
+
+    def get_scores(self, question_list=list, question=str):
+        """
+        Computes the BM25 score of each search result against the question.
+
+        Arguments:
+            question_list (list): List of ```StackExchangeQuestions```
+            question (str): The question that was asked
+
+        Returns:
+            list: The score of each search result (same order as ```question_list```)
+
+        """
+        document_vectors = [self.__create_document_vector(question_obj) for question_obj in question_list]
+        self.__store.add_documents([(question_obj.get_link(), sum(vector.values()), set(vector))
+                                    for question_obj, vector in zip(question_list, document_vectors)])
+        query_terms = set(tokenize(question))
+        if len(query_terms) == 0:
+            return [0.0] * len(question_list)
+        no_of_documents, average_length, frequencies = self.__store.get_statistics(query_terms)
+        term_weights = dict()
+        for term in query_terms:
+            document_frequency = frequencies.get(term, 0)
+            if document_frequency > 0:
+                term_weights[term] = math.log(1.0 + (no_of_documents - document_frequency + 0.5) /
+                                              (document_frequency + 0.5))
+        scores = list()
+        for vector in document_vectors:
+            length_norm = self.__k1 * (1.0 - self.__b + self.__b * sum(vector.values()) / max(average_length, 1.0))
+            score = 0.0
+            # the query is short, so only the terms of the query are looked up in the (sparse) document vector
+            for term, weight in term_weights.items():
+                term_frequency = vector.get(term, 0.0)
+                if term_frequency > 0:
+                    score += weight * term_frequency * (self.__k1 + 1.0) / (term_frequency + length_norm)
+            scores.append(score)
+        return scores
+
+    def __create_document_vector(self, question_obj):
+        """
+        Creates the sparse term vector of the search result, where terms in the title are weighted
+        by ```title_weight```.
+
+        Arguments:
+            question_obj (StackExchangeQuestions): The search result
+
+        Returns:
+            dict: term => (weighted) term frequency
+
+        """
+        vector = dict()
+        for term, count in Counter(tokenize(question_obj.get_title(), True)).items():
+            vector[term] = count * self.__title_weight
+        for term, count in Counter(tokenize(question_obj.get_body(), True)).items():
+            vector[term] = vector.get(term, 0.0) + count
+        return vector
+
+
+def create_question_ranker():
+    """
+    Creates the question ranker based on ```question_ranking_parameters``` in the config file.
+    If no database path is given, the document frequencies are kept in memory (per process).
+
+    Returns:
+        QuestionRanker: The question ranker
+
+    """
+    ranking_parameters = getattr(config, 'question_ranking_parameters', dict())
+    store = DocumentFrequencyStore(ranking_parameters.get('sqlite_path') or ":memory:")
+    return QuestionRanker(store,
+                          ranking_parameters.get('k1', QuestionRanker.DEFAULT_K1),
+                          ranking_parameters.get('b', QuestionRanker.DEFAULT_B),
+                          ranking_parameters.get('title_weight', QuestionRanker.DEFAULT_TITLE_WEIGHT))
@@ -0,0 +1,393 @@
+import threading
+import time
+
+import dbconfig as config
+from instrumentation import get_metrics
+
+"""
+This file contains the classes used for limiting the number of requests made to the StackExchange API.
+
+The API allows a limited number of requests per day for each key (the quota), and at most 30 requests
+per second from each IP address. In addition, the API can ask the client to wait before calling the
+same method again (the 'backoff' field in the response). ```RateLimiter``` keeps the requests within
+these limits for the whole process, and ```SingleFlight``` makes identical requests that are made at the
+same time share one request to the API.
+
+The quota is shared by all the processes using the key, while each process has its own ```RateLimiter```.
+The remaining quota is therefore taken from the responses of the API ('quota_remaining'), and each process
+paces its requests as if it had its share of it (```process_count``` in ```rate_limit_parameters```).
+
+See: https://api.stackexchange.com/docs/throttle
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+
+class RateLimitExceededError(Exception):
+    """
+    Raised when a request could not be made within the maximum waiting time
+    """
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket. Tokens are added at a fixed rate up to the capacity of the bucket,
+    and each request takes one token. This allows bursts of up to ```capacity``` requests, while
+    the average rate is kept at ```rate``` requests per second.
+    """
+
+    def __init__(self, rate=float, capacity=float):
+        """
+        Constructor for the token bucket. The bucket starts full.
+
+        Arguments:
+            rate (float): The number of tokens added per second
+            capacity (float): The maximum number of tokens in the bucket
+
+        """
+        self.__rate = float(rate)
+        self.__capacity = float(capacity)
+        self.__tokens = float(capacity)
+        self.__last_update = time.time()
+        self.__lock = threading.Lock()
+
+    def try_acquire(self):
+        """
+        Takes a token, if there is one.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the number of seconds until a token is available
+
+        """
+        with self.__lock:
+            self.__add_tokens()
+            if self.__tokens >= 1.0:
+                self.__tokens -= 1.0
+                return 0.0
+            if self.__rate <= 0:
+                return float('inf')
+            return (1.0 - self.__tokens) / self.__rate
+
+    def return_token(self):
+        """
+        Puts back a token that was taken, but not used
+        """
+        with self.__lock:
+            self.__tokens = min(self.__tokens + 1.0, self.__capacity)
+
+    def __add_tokens(self):
+        """
+        Adds the tokens for the time since the last update. Must be called while holding the lock.
+        """
+        now = time.time()
+        self.__tokens = min(self.__tokens + (now - self.__last_update) * self.__rate, self.__capacity)
+        self.__last_update = now
+
+
+class DailyQuota(object):
+    """
+    Thread-safe tracking of the remaining daily quota, which is reset at midnight (UTC).
+    Requests are not paced while there is plenty of quota left for the rest of the day. When the remaining
+    quota per second until the reset falls below ```pacing_threshold``` of the daily average, the requests
+    are spread evenly over the time until the reset, so the quota is not used up before then.
+    """
+
+    __SECONDS_PER_DAY = 86400.0
+
+    def __init__(self, daily_quota=int, pacing_threshold=float, process_count=int):
+        """
+        Constructor for the daily quota. The quota is full until the API reports the remaining quota.
+
+        Arguments:
+            daily_quota (int): The number of requests per day for the key
+            pacing_threshold (float): Share (0-1) of the daily average rate below which the requests are paced
+            process_count (int): The number of processes sharing the quota (each paces within its share)
+
+        """
+        self.__daily_quota = daily_quota
+        self.__process_count = max(process_count, 1)
+        self.__pacing_rate = pacing_threshold * daily_quota / self.__SECONDS_PER_DAY
+        self.__remaining = daily_quota
+        self.__reset_time = self.__get_next_reset(time.time())
+        self.__last_request = 0.0
+        self.__lock = threading.Lock()
+
+    def try_acquire(self):
+        """
+        Takes a request from the quota, if it can be made now.
+
+        Returns:
+            float: 0 if the request can be made, otherwise the number of seconds until it can be made
+
+        """
+        with self.__lock:
+            now = self.__update(time.time())
+            if self.__remaining <= 0:
+                return self.__reset_time - now
+            seconds_to_reset = self.__reset_time - now
+            if self.__remaining / seconds_to_reset >= self.__pacing_rate:
+                wait_time = 0.0
+            else:
+                # the share of the process is spread evenly over the time until the reset
+                interval = seconds_to_reset * self.__process_count / self.__remaining
+                wait_time = self.__last_request + interval - now
+            if wait_time > 0:
+                return wait_time
+            self.__remaining -= 1
+            self.__last_request = now
+            return 0.0
+
+    def set_remaining(self, quota_remaining=int):
+        """
+        Sets the remaining quota reported by the API (which includes the requests of the other processes)
+
+        Arguments:
+            quota_remaining (int): The number of requests remaining of the quota
+
+        """
+        with self.__lock:
+            self.__update(time.time())
+            self.__remaining = quota_remaining
+
+    def get_unpaced_requests(self):
+        """
+        Returns:
+            int: The number of requests the process can make before the requests are paced
+
+        """
+        with self.__lock:
+            now = self.__update(time.time())
+            unpaced = self.__remaining - self.__pacing_rate * (self.__reset_time - now)
+            return max(int(unpaced / self.__process_count), 0)
+
+    def __update(self, now=float):
+        """
+        Resets the quota if the reset time has passed. Must be called while holding the lock.
+
+        Returns:
+            float: The given time
+
+        """
+        if now >= self.__reset_time:
+            self.__remaining = self.__daily_quota
+            self.__reset_time = self.__get_next_reset(now)
+        return now
+
+    def __get_next_reset(self, now=float):
+        """
+        Returns:
+            float: The time of the next reset of the quota (midnight, UTC)
+
+        """
+        return (int(now // self.__SECONDS_PER_DAY) + 1) * self.__SECONDS_PER_DAY
+
+
+class RateLimiter(object):
+    """
+    Limits the requests to the StackExchange API for the whole process: the daily quota (see ```DailyQuota```),
+    a token bucket for the requests per second, and the backoff times given by the API for each method.
+    Requests wait until they are allowed, for at most ```max_wait``` seconds.
+    """
+
+    DEFAULT_DAILY_QUOTA = 10000
+    """
+    The default number of requests per day (the quota for an application key)
+    """
+
+    DEFAULT_PACING_THRESHOLD = 0.5
+    """
+    The default share of the daily average rate (quota per second until the reset) below which the
+    requests are paced, i.e. half the quota can be used at once (e.g. when many students ask at once)
+    """
+
+    DEFAULT_PROCESS_COUNT = 1
+    """
+    The default number of processes using the key
+    """
+
+    DEFAULT_REQUESTS_PER_SECOND = 30
+    """
+    The default maximum number of requests per second (the limit of the API for each IP address)
+    """
+
+    DEFAULT_MAX_WAIT = 10
+    """
+    The default maximum number of seconds a request waits before ```RateLimitExceededError``` is raised
+    """
+
+    def __init__(self, daily_quota=DEFAULT_DAILY_QUOTA, pacing_threshold=DEFAULT_PACING_THRESHOLD,
+                 process_count=DEFAULT_PROCESS_COUNT, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+                 max_wait=DEFAULT_MAX_WAIT):
+        """
+        Constructor for the rate limiter
+
+        Arguments:
+            daily_quota (int): The number of requests per day
+            pacing_threshold (float): Share of the daily average rate below which the requests are paced
+            process_count (int): The number of processes using the key (e.g. the workers of the LMS)
+            requests_per_second (int): The maximum number of requests per second
+            max_wait (float): The maximum number of seconds a request waits
+
+        """
+        self.__daily_quota = daily_quota
+        self.__quota = DailyQuota(daily_quota, pacing_threshold, process_count)
+        self.__second_bucket = TokenBucket(requests_per_second, requests_per_second)
+        self.__max_wait = max_wait
+        self.__backoff_expires = dict()  # method => time when requests can be made again
+        self.__lock = threading.Lock()
+
+    def acquire(self, method=str):
+        """
+        Waits until a request to the given method is allowed.
+
+        Arguments:
+            method (str): The API method (e.g. 'search'), used for the backoff
+
+        Raises:
+            RateLimitExceededError: If the request is not allowed within the maximum waiting time
+
+        """
+        deadline = time.time() + self.__max_wait
+        self.__wait_for_backoff(method, deadline)
+        while True:
+            wait_time = self.__second_bucket.try_acquire()
+            if wait_time == 0:
+                wait_time = self.__quota.try_acquire()
+                if wait_time == 0:
+                    return
+                self.__second_bucket.return_token()
+            if time.time() + wait_time > deadline:
+                get_metrics().increment("api_throttled", {'method': method})
+                raise RateLimitExceededError("The request limit of the StackExchange API has been reached. "
+                                             "Please try again later.")
+            time.sleep(wait_time)
+
+    def set_backoff(self, method=str, seconds=float):
+        """
+        Registers that the API has asked for no more requests to the method for the given time.
+
+        Arguments:
+            method (str): The API method
+            seconds (float): The number of seconds to wait
+
+        """
+        with self.__lock:
+            expires = time.time() + seconds
+            self.__backoff_expires[method] = max(expires, self.__backoff_expires.get(method, 0))
+
+    def get_daily_quota(self):
+        return self.__daily_quota
+
+    def get_available_requests(self):
+        """
+        Returns the number of requests the process can make before the requests are paced
+        (e.g. so that background requests can leave the quota to the users)
+
+        Returns:
+            int: The number of requests
+
+        """
+        return self.__quota.get_unpaced_requests()
+
+    def set_quota_remaining(self, quota_remaining=int):
+        """
+        Updates the limiter with the remaining quota reported by the API
+        (which includes the requests made by the other processes using the key)
+
+        Arguments:
+            quota_remaining (int): The number of requests remaining of the quota
+
+        """
+        self.__quota.set_remaining(quota_remaining)
+
+    def __wait_for_backoff(self, method=str, deadline=float):
+        """
+        Waits until the backoff for the method (if any) has expired
+
+        Raises:
+            RateLimitExceededError: If the backoff expires after the deadline
+
+        """
+        with self.__lock:
+            expires = self.__backoff_expires.get(method)
+            if expires is not None and expires <= time.time():
+                del self.__backoff_expires[method]
+                expires = None
+        if expires is None:
+            return
+        if expires > deadline:
+            get_metrics().increment("api_throttled", {'method': method})
+            raise RateLimitExceededError("The StackExchange API has asked to wait before searching again. "
+                                         "Please try again later.")
+        time.sleep(max(expires - time.time(), 0))
+
+
+class SingleFlight(object):
+    """
+    Makes identical calls that are made at the same time share the result of one call.
+    The first caller with a given key runs the function, and the others wait for its result (or error).
+    """
+
+    def __init__(self):
+        """
+        Constructor for the single-flight group
+        """
+        self.__calls = dict()  # key => [finished event, result, error]
+        self.__lock = threading.Lock()
+
+    def do(self, key=object, function=object):
+        """
+        Runs the function, unless a call with the same key already is running,
+        in which case the result of that call is returned.
+
+        Arguments:
+            key (object): The key identifying the call (must be hashable)
+            function (function): The function to run (without arguments)
+
+        Returns:
+            object: The result of the function
+
+        """
+        with self.__lock:
+            call = self.__calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = [threading.Event(), None, None]
+                self.__calls[key] = call
+        if not is_leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1]
+        try:
+            call[1] = function()
+        except Exception as err:
+            call[2] = err
+            raise
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+            call[0].set()
+        return call[1]
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    Returns the process-wide rate limiter, creating it on first use.
+    The settings are read from ```rate_limit_parameters``` in the config file (if set).
+
+    Returns:
+        RateLimiter: The rate limiter shared by all requests to the StackExchange API
+
+    """
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                rate_limit_parameters = getattr(config, 'rate_limit_parameters', dict())
+                _rate_limiter = RateLimiter(**rate_limit_parameters)
+    return _rate_limiter
@@ -0,0 +1,142 @@
+"""
+This file contains the base class for the compact records holding search results and answers.
+
+The records use ```__slots__```, so that no dictionary is created for each object (up to 100 search results
+are created per search, and they are kept in the search cache and in the sessions of the users). The values
+are set by the constructor, and are read with the getters. A record can be converted to a tuple or dict of
+its values (nested records are converted as well), e.g. for caching, and back again.
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+
+class Record(object):
+    """
+    Base class for the records. The subclasses define ```__slots__```, ```FIELDS``` (the names of the
+    arguments of the constructor, in order) and ```_get_values``` (the values, in the same order).
+    """
+
+    __slots__ = ()
+
+    FIELDS = ()
+    """
+    The names of the fields (the arguments of the constructor, in order)
+    """
+
+    NESTED_FIELDS = dict()
+    """
+    Fields containing records: field name => (record class, is the value a list of records?)
+    """
+
+    def _get_values(self):
+        """
+        Returns the values of the fields
+
+        Returns:
+            tuple: The values, in the order of ```FIELDS```
+
+        """
+        raise NotImplementedError()
+
+    def to_tuple(self):
+        """
+        Returns the values of the record as a tuple (nested records are converted to tuples)
+
+        Returns:
+            tuple: The values, in the order of ```FIELDS```
+
+        """
+        return tuple(_convert_nested(value, Record.to_tuple, tuple) for value in self._get_values())
+
+    def to_dict(self):
+        """
+        Returns the values of the record as a dict (nested records are converted to dicts)
+
+        Returns:
+            dict: field name => value
+
+        """
+        return dict((field, _convert_nested(value, Record.to_dict, list))
+                    for field, value in zip(self.FIELDS, self._get_values()))
+
+    @classmethod
+    def from_tuple(cls, values=tuple):
+        """
+        Creates a record from the values returned by ```to_tuple```
+
+        Arguments:
+            values (tuple): The values, in the order of ```FIELDS```
+
+        Returns:
+            Record: The record
+
+        """
+        return cls(*[cls.__create_nested(field, value) for field, value in zip(cls.FIELDS, values)])
+
+    @classmethod
+    def from_dict(cls, values=dict):
+        """
+        Creates a record from the values returned by ```to_dict```. Fields that are missing are set to None.
+
+        Arguments:
+            values (dict): field name => value
+
+        Returns:
+            Record: The record
+
+        """
+        return cls(*[cls.__create_nested(field, values.get(field)) for field in cls.FIELDS])
+
+    def __reduce__(self):
+        # pickle the values as a tuple (much smaller than the default pickling of objects with slots)
+        return _create_record, (self.__class__, self.to_tuple())
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._get_values() == other._get_values()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "%s%r" % (self.__class__.__name__, self._get_values())
+
+    @classmethod
+    def __create_nested(cls, field=str, value=object):
+        """
+        Converts a tuple or dict (or a list of them) of a nested field back to record(s)
+        """
+        if value is None or field not in cls.NESTED_FIELDS:
+            return value
+        record_class, is_list = cls.NESTED_FIELDS[field]
+        if is_list:
+            return [_to_record(record_class, item) for item in value]
+        return _to_record(record_class, value)
+
+
+def _convert_nested(value=object, convert=object, list_type=type):
+    """
+    Converts the value with ```convert``` if it is a record (or a list of records)
+    """
+    if isinstance(value, Record):
+        return convert(value)
+    if isinstance(value, list):
+        return list_type(convert(item) if isinstance(item, Record) else item for item in value)
+    return value
+
+
+def _to_record(record_class=type, value=object):
+    """
+    Creates a record from a tuple or dict (records are returned as they are)
+    """
+    if isinstance(value, Record):
+        return value
+    if isinstance(value, dict):
+        return record_class.from_dict(value)
+    return record_class.from_tuple(value)
+
+
+def _create_record(record_class=type, values=tuple):
+    """
+    Creates a record when unpickling (see ```Record.__reduce__```)
+    """
+    return record_class.from_tuple(values)
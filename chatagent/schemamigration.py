@@ -0,0 +1,224 @@
+import sys
+
+import MySQLdb
+
+from connectionpool import get_connection_pool
+
+"""
+This file contains the migrations of the MySQL database schema.
+
+The script 'create_db.sql' creates the database from scratch (and removes all data). Databases that
+already contain data are upgraded in place by running the migrations in this file, which are applied
+in order of their version number. The applied versions are recorded in the table 'tblSchemaVersion',
+so each migration is only run once. A database without this table is treated as version 0
+(created by the first version of 'create_db.sql').
+
+When the schema is changed, add a migration to ```MIGRATIONS``` (with the next version number), and
+make the same change in 'create_db.sql' (including the version in the INSERT into 'tblSchemaVersion').
+
+The migrations are run with:
+    python schemamigration.py            (upgrade to the latest version)
+    python schemamigration.py <version>  (upgrade to the given version)
+    python schemamigration.py --status   (show the current version and the pending migrations)
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+
+MIGRATIONS = [
+    (1, "Hashed, unique lookup columns for question_text and stackexchange_link (duplicates are merged)", [
+        "ALTER TABLE tblChatQuestions ADD COLUMN question_hash CHAR(40) NULL;",
+        "UPDATE tblChatQuestions SET question_hash = SHA1(LOWER(question_text));",
+        # the answers to duplicate questions are moved to the first of them, before the duplicates are removed
+        "UPDATE tblChatAnswers a "
+        "JOIN tblChatQuestions q ON q.chatQuestionID = a.fk_tblChatQuestions "
+        "JOIN (SELECT question_hash, MIN(chatQuestionID) AS first_id FROM tblChatQuestions "
+        "GROUP BY question_hash) f ON f.question_hash = q.question_hash "
+        "SET a.fk_tblChatQuestions = f.first_id WHERE q.chatQuestionID <> f.first_id;",
+        "DELETE q FROM tblChatQuestions q "
+        "JOIN (SELECT question_hash, MIN(chatQuestionID) AS first_id FROM tblChatQuestions "
+        "GROUP BY question_hash) f ON f.question_hash = q.question_hash "
+        "WHERE q.chatQuestionID <> f.first_id;",
+        "ALTER TABLE tblChatQuestions "
+        "MODIFY question_hash CHAR(40) NOT NULL COMMENT 'SHA1 of the lower case question_text', "
+        "ADD UNIQUE INDEX question_hash_UNIQUE (question_hash ASC);",
+        "ALTER TABLE tblStackExchange ADD COLUMN stackexchange_link_hash CHAR(40) NULL;",
+        "UPDATE tblStackExchange SET stackexchange_link_hash = SHA1(stackexchange_link);",
+        "UPDATE tblChatAnswers a "
+        "JOIN tblStackExchange s ON s.stackexchangeID = a.fk_tblStackExchange "
+        "JOIN (SELECT stackexchange_link_hash, MIN(stackexchangeID) AS first_id FROM tblStackExchange "
+        "GROUP BY stackexchange_link_hash) f ON f.stackexchange_link_hash = s.stackexchange_link_hash "
+        "SET a.fk_tblStackExchange = f.first_id WHERE s.stackexchangeID <> f.first_id;",
+        "DELETE s FROM tblStackExchange s "
+        "JOIN (SELECT stackexchange_link_hash, MIN(stackexchangeID) AS first_id FROM tblStackExchange "
+        "GROUP BY stackexchange_link_hash) f ON f.stackexchange_link_hash = s.stackexchange_link_hash "
+        "WHERE s.stackexchangeID <> f.first_id;",
+        "ALTER TABLE tblStackExchange "
+        "MODIFY stackexchange_link_hash CHAR(40) NOT NULL COMMENT 'SHA1 of the stackexchange_link', "
+        "ADD UNIQUE INDEX stackexchange_link_hash_UNIQUE (stackexchange_link_hash ASC);",
+    ]),
+    (2, "Covering indexes for filtering on user, date, correct_answer and is_answer_read", [
+        "ALTER TABLE tblChatQuestions "
+        "ADD INDEX user_asked_by_user_idx (fk_tblChatUsers ASC, asked_by_user ASC, edx_questionID ASC);",
+        "ALTER TABLE tblStackExchange ADD INDEX lookup_date_idx (lookup_date ASC);",
+        "ALTER TABLE tblChatAnswers "
+        "ADD INDEX correct_answer_idx (correct_answer ASC, is_answer_read ASC, "
+        "fk_tblChatQuestions ASC, fk_tblStackExchange ASC), "
+        "ADD INDEX is_answer_read_idx (is_answer_read ASC, fk_tblChatQuestions ASC, fk_tblStackExchange ASC);",
+    ]),
+    (3, "Preview of the answer shown before 'read more'", [
+        "ALTER TABLE tblChatAnswers ADD COLUMN answer_preview TEXT NULL AFTER answer_text;",
+    ]),
+    (4, "Course of the edX questions, and their precomputed answers", [
+        "ALTER TABLE tblEdxQuestions "
+        "ADD COLUMN course_id VARCHAR(250) NULL AFTER edx_questionID, "
+        "ADD INDEX course_id_idx (course_id ASC), "
+        "COMMENT = 'questions of the edX courses';",
+        "CREATE TABLE IF NOT EXISTS tblEdxAnswers ("
+        "edx_questionID INT NOT NULL, "
+        "title LONGTEXT NOT NULL, "
+        "answer_text LONGTEXT NOT NULL, "
+        "answer_preview TEXT NULL, "
+        "fk_tblStackExchange INT NOT NULL, "
+        "computed_date DATETIME NOT NULL, "
+        "PRIMARY KEY (edx_questionID), "
+        "INDEX fk_tblEdxAnswers_tblStackExchange1_idx (fk_tblStackExchange ASC), "
+        "CONSTRAINT fk_tblEdxAnswers_tblEdxQuestions1 FOREIGN KEY (edx_questionID) "
+        "REFERENCES tblEdxQuestions (edx_questionID) ON DELETE CASCADE ON UPDATE NO ACTION, "
+        "CONSTRAINT fk_tblEdxAnswers_tblStackExchange1 FOREIGN KEY (fk_tblStackExchange) "
+        "REFERENCES tblStackExchange (stackexchangeID) ON DELETE NO ACTION ON UPDATE NO ACTION) "
+        "ENGINE = InnoDB COMMENT = 'answers to the edX questions, found in advance (see edxquestions.py)';",
+    ]),
+]
+"""
+List of the migrations (version, description, list of statements), in order of version
+"""
+
+
+class SchemaMigration(object):
+    """
+    Class for upgrading the schema of an existing MySQL database to the version used by the code.
+    """
+
+    __TBL_SCHEMA_VERSION = "tblSchemaVersion"
+
+    def __init__(self, migrations=MIGRATIONS):
+        """
+        Constructor for the schema migration.
+
+        Arguments:
+            migrations (list): List of the migrations (version, description, list of statements)
+
+        """
+        self.__migrations = sorted(migrations, key=lambda migration: migration[0])
+        self.__pool = get_connection_pool()
+
+    def get_latest_version(self):
+        """
+        Returns:
+            int: The version of the newest migration
+
+        """
+        if len(self.__migrations) == 0:
+            return 0
+        return self.__migrations[-1][0]
+
+    def get_current_version(self):
+        """
+        Retrieves the schema version of the database.
+
+        Returns:
+            int: The highest applied version (0 if no migrations have been applied)
+
+        """
+        connection = self.__pool.get_connection()
+        try:
+            cursor = connection.cursor(MySQLdb.cursors.DictCursor)
+            self.__create_version_table(cursor)
+            cursor.execute("SELECT MAX(version) AS version FROM " + self.__TBL_SCHEMA_VERSION + ";")
+            version = cursor.fetchone()['version']
+        finally:
+            self.__pool.release_connection(connection)
+        if version is None:
+            return 0
+        return int(version)
+
+    def get_pending_migrations(self, target_version=None):
+        """
+        Returns the migrations that have not been applied to the database.
+
+        Arguments:
+            target_version (int): The version to upgrade to (None: the latest version)
+
+        Returns:
+            list: List of the pending migrations (version, description, list of statements)
+
+        """
+        if target_version is None:
+            target_version = self.get_latest_version()
+        current_version = self.get_current_version()
+        return [migration for migration in self.__migrations if current_version < migration[0] <= target_version]
+
+    def migrate(self, target_version=None):
+        """
+        Applies the pending migrations in order, and records each applied version.
+        If a migration fails, the following migrations are not applied.
+
+        Note! MySQL commits schema changes (ALTER TABLE) immediately, so a migration that fails
+        halfway is not rolled back. The error must be fixed manually before the migration is re-run.
+
+        Arguments:
+            target_version (int): The version to upgrade to (None: the latest version)
+
+        Returns:
+            int: The schema version of the database after the migrations
+
+        """
+        for version, description, statements in self.get_pending_migrations(target_version):
+            connection = self.__pool.get_connection()
+            discard = False
+            try:
+                cursor = connection.cursor(MySQLdb.cursors.DictCursor)
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute("INSERT INTO " + self.__TBL_SCHEMA_VERSION + " (version, description, applied_date) "
+                               "VALUES (%s, %s, NOW());", (version, description))
+                print("Applied migration %d: %s" % (version, description))
+            except MySQLdb.Error as err:
+                print("MySQLdb.Error (Migration %d): %s" % (version, err))
+                discard = True
+                break
+            finally:
+                self.__pool.release_connection(connection, discard)
+        return self.get_current_version()
+
+    def __create_version_table(self, cursor):
+        """
+        Creates the table recording the applied versions (if it doesn't exist)
+
+        Arguments:
+            cursor (MySQLdb.cursors.DictCursor): The cursor to use
+
+        """
+        cursor.execute("CREATE TABLE IF NOT EXISTS " + self.__TBL_SCHEMA_VERSION + " ("
+                       "version INT NOT NULL, "
+                       "description VARCHAR(250) NOT NULL, "
+                       "applied_date DATETIME NOT NULL, "
+                       "PRIMARY KEY (version)) "
+                       "ENGINE = InnoDB "
+                       "COMMENT = 'applied schema migrations';")
+
+
+if __name__ == "__main__":
+    schema_migration = SchemaMigration()
+    if len(sys.argv) == 2 and sys.argv[1] == "--status":
+        print("Current version: %d (latest: %d)" % (schema_migration.get_current_version(),
+                                                     schema_migration.get_latest_version()))
+        for pending_version, pending_description, pending_statements in schema_migration.get_pending_migrations():
+            print("Pending migration %d: %s" % (pending_version, pending_description))
+    elif len(sys.argv) <= 2:
+        target = int(sys.argv[1]) if len(sys.argv) == 2 else None
+        print("Schema version: %d" % schema_migration.migrate(target))
+    else:
+        print("Usage: python schemamigration.py [<version> | --status]")
+        sys.exit(1)
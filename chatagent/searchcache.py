@@ -0,0 +1,319 @@
+import cPickle as pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import dbconfig as config
+
+"""
+This file contains the cache for search results retrieved from StackExchange.
+
+Search results are cached by the site that was searched, the (normalized) question and the type of
+search that was used. The cache has a time-to-live (TTL) for each entry, and the number of entries is
+bounded; when the cache is full, the least recently used entry is removed. Where the entries are stored
+is decided by the backend, which is either in memory (```MemoryCacheBackend```) or in a local SQLite
+database (```SQLiteCacheBackend```) that survives restarts and can be shared between processes.
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+
+class MemoryCacheBackend(object):
+    """
+    Cache backend storing the entries in memory (per process).
+    """
+
+    def __init__(self, max_size=int):
+        """
+        Constructor for the in-memory cache backend
+
+        Arguments:
+            max_size (int): The maximum number of entries to keep
+
+        """
+        self.__max_size = max_size
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key=str):
+        """
+        Retrieves the entry stored with the given key, and marks it as recently used
+
+        Arguments:
+            key (str): The cache key
+
+        Returns:
+            tuple: (stored_time, value) || None
+
+        """
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            if entry is not None:
+                # re-insert the entry to mark it as the most recently used
+                self.__entries[key] = entry
+            return entry
+
+    def put(self, key=str, stored_time=float, value=object):
+        """
+        Stores the value with the given key. If the cache is full, the least recently used entry is removed.
+
+        Arguments:
+            key (str): The cache key
+            stored_time (float): When the value was stored (unix epoch time)
+            value (object): The value to store
+
+        """
+        with self.__lock:
+            self.__entries.pop(key, None)
+            self.__entries[key] = (stored_time, value)
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+
+    def remove(self, key=str):
+        """
+        Removes the entry with the given key (if it exists)
+
+        Arguments:
+            key (str): The cache key
+
+        """
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def clear(self):
+        """
+        Removes all entries from the cache
+        """
+        with self.__lock:
+            self.__entries.clear()
+
+
+class SQLiteCacheBackend(object):
+    """
+    Cache backend storing the entries in a local SQLite database. The values are pickled before they are stored.
+    """
+
+    def __init__(self, database_path=str, max_size=int, table_name="search_cache"):
+        """
+        Constructor for the SQLite cache backend. The table is created if it does not exist.
+
+        Arguments:
+            database_path (str): Path to the SQLite database file
+            max_size (int): The maximum number of entries to keep
+            table_name (str): The table the entries are stored in (so other caches can share the file)
+
+        """
+        self.__max_size = max_size
+        self.__table_name = table_name
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(database_path, check_same_thread=False)
+        with self.__lock:
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS " + self.__table_name + " ("
+                                      "cache_key TEXT PRIMARY KEY, "
+                                      "stored_time REAL NOT NULL, "
+                                      "last_access REAL NOT NULL, "
+                                      "cache_value BLOB NOT NULL)")
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS " + self.__table_name + "_last_access_idx "
+                                      "ON " + self.__table_name + " (last_access)")
+            self.__connection.commit()
+
+    def get(self, key=str):
+        """
+        Retrieves the entry stored with the given key, and marks it as recently used
+
+        Arguments:
+            key (str): The cache key
+
+        Returns:
+            tuple: (stored_time, value) || None
+
+        """
+        with self.__lock:
+            row = self.__connection.execute("SELECT stored_time, cache_value FROM " + self.__table_name + " "
+                                            "WHERE cache_key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.__connection.execute("UPDATE " + self.__table_name + " SET last_access = ? WHERE cache_key = ?",
+                                      (time.time(), key))
+            self.__connection.commit()
+        return row[0], pickle.loads(str(row[1]))
+
+    def put(self, key=str, stored_time=float, value=object):
+        """
+        Stores the value with the given key. If the cache is full, the least recently used entries are removed.
+
+        Arguments:
+            key (str): The cache key
+            stored_time (float): When the value was stored (unix epoch time)
+            value (object): The value to store (must be picklable)
+
+        """
+        pickled_value = sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self.__lock:
+            self.__connection.execute("INSERT OR REPLACE INTO " + self.__table_name + " VALUES (?, ?, ?, ?)",
+                                      (key, stored_time, time.time(), pickled_value))
+            self.__connection.execute("DELETE FROM " + self.__table_name + " WHERE cache_key IN ("
+                                      "SELECT cache_key FROM " + self.__table_name + " "
+                                      "ORDER BY last_access DESC LIMIT -1 OFFSET ?)", (self.__max_size,))
+            self.__connection.commit()
+
+    def remove(self, key=str):
+        """
+        Removes the entry with the given key (if it exists)
+
+        Arguments:
+            key (str): The cache key
+
+        """
+        with self.__lock:
+            self.__connection.execute("DELETE FROM " + self.__table_name + " WHERE cache_key = ?", (key,))
+            self.__connection.commit()
+
+    def clear(self):
+        """
+        Removes all entries from the cache
+        """
+        with self.__lock:
+            self.__connection.execute("DELETE FROM " + self.__table_name)
+            self.__connection.commit()
+
+
+class SearchCache(object):
+    """
+    Cache for search results, keyed on the site, the normalized question and the search mode.
+    """
+
+    DEFAULT_TTL = 3600
+    """
+    The default number of seconds a search result is kept in the cache
+    """
+
+    DEFAULT_MAX_SIZE = 1000
+    """
+    The default number of search results kept in the cache
+    """
+
+    def __init__(self, backend=None, ttl=DEFAULT_TTL):
+        """
+        Constructor for the search cache
+
+        Arguments:
+            backend (object): The backend storing the entries (```MemoryCacheBackend``` or ```SQLiteCacheBackend```).
+                If None, an in-memory backend with ```DEFAULT_MAX_SIZE``` entries is used.
+            ttl (int): The number of seconds before a cached search result expires
+
+        """
+        if backend is None:
+            backend = MemoryCacheBackend(self.DEFAULT_MAX_SIZE)
+        self.__backend = backend
+        self.__ttl = ttl
+
+    def get(self, site_name=str, question=str, use_adv_search=bool):
+        """
+        Retrieves the cached search results for the given question
+
+        Arguments:
+            site_name (str): Name of the StackExchange site that was searched
+            question (str): The question that was searched for
+            use_adv_search (bool): Was ```search_advanced``` used?
+
+        Returns:
+            list: The cached search results || None (if not cached, or if the entry has expired)
+
+        """
+        key = self.create_key(site_name, question, use_adv_search)
+        entry = self.__backend.get(key)
+        if entry is None:
+            return None
+        stored_time, value = entry
+        if time.time() - stored_time > self.__ttl:
+            self.__backend.remove(key)
+            return None
+        return value
+
+    def put(self, site_name=str, question=str, use_adv_search=bool, results=list):
+        """
+        Stores the search results for the given question
+
+        Arguments:
+            site_name (str): Name of the StackExchange site that was searched
+            question (str): The question that was searched for
+            use_adv_search (bool): Was ```search_advanced``` used?
+            results (list): The search results to store
+
+        """
+        key = self.create_key(site_name, question, use_adv_search)
+        self.__backend.put(key, time.time(), results)
+
+    def get_age(self, site_name=str, question=str, use_adv_search=bool):
+        """
+        Returns how long ago the search results for the given question were cached
+
+        Arguments:
+            site_name (str): Name of the StackExchange site that was searched
+            question (str): The question that was searched for
+            use_adv_search (bool): Was ```search_advanced``` used?
+
+        Returns:
+            float: Seconds since the results were stored || None (if not cached, or if the entry has expired)
+
+        """
+        entry = self.__backend.get(self.create_key(site_name, question, use_adv_search))
+        if entry is None:
+            return None
+        age = time.time() - entry[0]
+        if age > self.__ttl:
+            return None
+        return age
+
+    def get_ttl(self):
+        return self.__ttl
+
+    def clear(self):
+        """
+        Removes all entries from the cache
+        """
+        self.__backend.clear()
+
+    @staticmethod
+    def create_key(site_name=str, question=str, use_adv_search=bool):
+        """
+        Creates the cache key. The question is normalized (lower case, and with
+        surrounding and repeated whitespace removed), so that questions that only
+        differ in casing or spacing share the same entry.
+
+        Arguments:
+            site_name (str): Name of the StackExchange site that was searched
+            question (str): The question that was searched for
+            use_adv_search (bool): Was ```search_advanced``` used?
+
+        Returns:
+            str: The cache key
+
+        """
+        normalized_question = " ".join(question.lower().split())
+        search_mode = "advanced" if use_adv_search else "intitle"
+        key = site_name + "|" + search_mode + "|" + normalized_question
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return key
+
+
+def create_search_cache():
+    """
+    Creates the search cache based on ```cache_parameters``` in the config file.
+    If no settings are given, an in-memory cache with the default TTL and size is used.
+
+    Returns:
+        SearchCache: The search cache
+
+    """
+    cache_parameters = getattr(config, 'cache_parameters', dict())
+    ttl = cache_parameters.get('ttl', SearchCache.DEFAULT_TTL)
+    max_size = cache_parameters.get('max_size', SearchCache.DEFAULT_MAX_SIZE)
+    if cache_parameters.get('backend', 'memory') == 'sqlite':
+        backend = SQLiteCacheBackend(cache_parameters['sqlite_path'], max_size)
+    else:
+        backend = MemoryCacheBackend(max_size)
+    return SearchCache(backend, ttl)
@@ -1,6 +1,12 @@
 import json
 import stackexchange
 
+from instrumentation import get_metrics
+from record import Record
+from searchcache import create_search_cache
+from stackexchangesite import get_site
+from textprocessing import tokenize
+
 """
 This file contains all classes that are used to objectify, handle and process search results.
 It can be debated whether or not creating my own objects is a good idea, since the Py-StackExchange
@@ -24,10 +30,17 @@ class SearchStackExchange:
     with the StackExchange community
     """
 
-    __PAGE_SIZE = 100
+    __PAGE_SIZE = 20
+    """
+    The number of results on each page of the search. Only the top results are ranked and answered,
+    so the first page is kept small; the following pages are only retrieved if the user moves past
+    the results on the first page (see ```LazySearchResults```)
+    """
+
+    __MAX_RESULTS = 100
     """
     The amount of pages returned can be very large depending on search parameters and search used.
-    Regardless, it is doubtful that more than 100 pages will contain the answer, and if so the
+    Regardless, it is doubtful that more than 100 results will contain the answer, and if so the
     user should re-phrase the question to get more consistent results
     """
 
@@ -36,9 +49,27 @@ class SearchStackExchange:
     Client ID for StackExchange API, see: https://api.stackexchange.com/docs/authentication
     """
 
-    __STACK_EXCHANGE_KEY = "DMercir86DS8ZhXwHZ)vxg(("
+    __ANSWER_PAGE_SIZE = 100
+    """
+    The number of answers retrieved per request when retrieving the answers of several questions
+    """
+
+    __SEARCH_FILTER_FIELDS = ('question.question_id', 'question.title', 'question.link', 'question.score',
+                              'question.accepted_answer_id', 'question.answer_count')
+    """
+    The fields included in the search results (see ```RateLimitedSite.get_filter```)
+    """
+
+    __ANSWER_FILTER_FIELDS = ('answer.answer_id', 'answer.question_id', 'answer.body', 'answer.score',
+                              'answer.is_accepted', 'answer.creation_date', 'answer.owner', 'shallow_user.reputation')
     """
-    Key for StackExchange API, see: https://api.stackexchange.com/docs/authentication
+    The fields included when retrieving answers (the owner is only included for the reputation)
+    """
+
+    __SEARCH_FALLBACK_FILTER = "default"
+    __ANSWER_FALLBACK_FILTER = "withbody"
+    """
+    The built-in filters used if the filters above could not be created
     """
 
     NO_KEY_VALUE_FOR_ENTRY = -1
@@ -48,6 +79,11 @@ class SearchStackExchange:
 
     __site = None
 
+    __search_cache = create_search_cache()
+    """
+    Cache for search results, shared by all instances in the process (see ```searchcache.SearchCache```)
+    """
+
     def __init__(self, site_name=str):
         """
         Constructor for the class searching the given StackExchange site for information.
@@ -58,20 +94,32 @@ class SearchStackExchange:
                 Please note that the name is case-sensitive
 
         """
-        self.__result_list = list()
-        # use debugging
-        self.__use_debugging()
+        self.__result_list = LazySearchResults()
+        self.__site_name = site_name
+        self.__last_search = None  # tuple: (question, use_adv_search)
         self.__site = self.__convert_user_input_to_stackexchange_site(site_name)
 
-    def process_search_results_for_question(self, question=str, use_adv_search=bool):
+    @classmethod
+    def get_search_cache(cls):
+        """
+        Returns:
+            SearchCache: The cache for search results, shared by all instances in the process
+
+        """
+        return cls.__search_cache
+
+    def process_search_results_for_question(self, question=str, use_adv_search=bool, use_cache=True):
         """
         Runs a search against the set StackExchange site, looking for questions that
         matches the content of ```question```. There are two options for the search,
         ```search``` and ```search_advanced```. The executed search is selected from
         the passed value ```use_adv_search```. The function returns either True or False
         depending on whether or not the search executed successfully, and if any results
-        were found. The results are stored in a list, which can be retrieved by calling
-        ```get_list_of_results```.
+        were found. The results are stored in a ```LazySearchResults```, which can be retrieved by
+        calling ```get_list_of_results```. Only the first result page is retrieved by the search;
+        the following pages are retrieved (and converted) when the results are accessed.
+        Search results are cached, so that repeating a question (within the time-to-live of the cache)
+        does not make a new request to the API (unless ```use_cache``` is False, e.g. to refresh the cache).
 
         Note! ```search_advanced``` can easily return several thousands of hits just
         because one of the words in a given page matches question. Use this with
@@ -80,6 +128,7 @@ class SearchStackExchange:
         Arguments:
             question (str): The question to search for
             use_adv_search (bool): Should ```search_advanced``` be used?
+            use_cache (bool): Should cached search results be used? (the cache is updated either way)
 
         See:
             |  ```stackexchange.Site.search```
@@ -90,78 +139,166 @@ class SearchStackExchange:
             ```True```: search was successful.
 
         """
+        # has this question been searched for recently?
+        cached_results = None
+        if use_cache:
+            cached_results = self.__search_cache.get(self.__site_name, question, use_adv_search)
+            get_metrics().increment("search_cache", {'result': "miss" if cached_results is None else "hit"})
+        if cached_results is not None:
+            self.__result_list = LazySearchResults(cached_results)
+            self.__last_search = (question, use_adv_search)
+            return True
         site = self.__site
         # execute the selected search
         if use_adv_search:
             # Note! This returns basically everything without any filtering
             # Therefore, ensure that the result has at least one answer
-            search = site.search_advanced(q=question, answers=1)
+            search = site.search_advanced(q=question, answers=1, pagesize=self.__PAGE_SIZE,
+                                          filter=self.__get_search_filter())
         else:
-            search = site.search(intitle=question, pagesize=self.__PAGE_SIZE)
+            search = site.search(intitle=question, pagesize=self.__PAGE_SIZE, filter=self.__get_search_filter())
         # was a result returned?
         if (search is None) or (len(search.items) == 0):
             return False
-
-        # Note! If a large result set is returned, it may go through the first result page twice
-        # I'm not sure why this happens, but it only happens for the first result page, and only
-        # if the result set consists of more than one result page.
-
-        for result_sets in search[:self.__PAGE_SIZE]:
-            # retrieve the data
-            accepted_answer_id = int(self.__is_key_in_json('accepted_answer_id', result_sets.json))
-            answer_count = int(self.__is_key_in_json('answer_count', result_sets.json))
-            creation_date = result_sets.creation_date
-            is_answered = bool(self.__is_key_in_json('is_answered', result_sets.json))
-            link = str(self.__is_key_in_json('link', result_sets.json))
-            question_id = result_sets.id
-            score = result_sets.score
-            title = result_sets.title
-            view_count = result_sets.view_count
-            # check if this question has an owner/user
-            if hasattr(result_sets, 'owner'):
-                display_name = result_sets.owner.display_name
-                profile_link = result_sets.owner.link
-                reputation = result_sets.owner.reputation
-                user_id = result_sets.owner.id
-                user_type = result_sets.owner.user_type
-                # create object of the User
-                user_obj = StackExchangeUser(display_name, profile_link, reputation, user_id, user_type)
-            else:
-                user_obj = None
-            # create object of the Question
-            question_obj = StackExchangeQuestions(accepted_answer_id, answer_count, creation_date, is_answered, link,
-                                                  question_id, score, title, view_count, user_obj)
-            self.__result_list.append(question_obj)
+        self.__result_list = LazySearchResults(first_page=search, convert=self.__convert_to_question,
+                                               max_results=self.__MAX_RESULTS)
+        self.__last_search = (question, use_adv_search)
+        self.__search_cache.put(self.__site_name, question, use_adv_search, self.__result_list.get_loaded_results())
         return True
 
+    def __convert_to_question(self, result_sets=stackexchange.Question):
+        """
+        Converts the question returned by py-stackexchange to ```StackExchangeQuestions```
+
+        Arguments:
+            result_sets (stackexchange.Question): The question from the search result
+
+        Returns:
+            StackExchangeQuestions: The question
+
+        """
+        # retrieve the data (fields left out by the search filter are not set)
+        accepted_answer_id = int(self.__is_key_in_json('accepted_answer_id', result_sets.json))
+        answer_count = int(self.__is_key_in_json('answer_count', result_sets.json))
+        creation_date = getattr(result_sets, 'creation_date', None)
+        is_answered = bool(result_sets.json.get('is_answered', False))
+        link = str(self.__is_key_in_json('link', result_sets.json))
+        question_id = result_sets.id
+        score = result_sets.score
+        title = result_sets.title
+        view_count = getattr(result_sets, 'view_count', self.NO_KEY_VALUE_FOR_ENTRY)
+        # the body is only included if the filter of the search includes it
+        body = getattr(result_sets, 'body', None)
+        # check if this question has an owner/user
+        if hasattr(result_sets, 'owner'):
+            display_name = result_sets.owner.display_name
+            profile_link = result_sets.owner.link
+            reputation = result_sets.owner.reputation
+            user_id = result_sets.owner.id
+            user_type = result_sets.owner.user_type
+            # create object of the User
+            user_obj = StackExchangeUser(display_name, profile_link, reputation, user_id, user_type)
+        else:
+            user_obj = None
+        # create object of the Question
+        return StackExchangeQuestions(accepted_answer_id, answer_count, creation_date, is_answered, link,
+                                      question_id, score, title, view_count, user_obj, body)
+
     def get_list_of_results(self):
         """
-        Returns a list containing the data from the search. Content varies depending on the executed search
+        Returns a list containing the data from the search. Content varies depending on the executed search.
+        Please note that taking the length of the list retrieves all the result pages (see ```LazySearchResults```).
 
         Returns:
-             list: List with search result data
+             LazySearchResults: List with search result data
         """
         return self.__result_list
 
+    def rank_results(self, question_ranker=object, question=str):
+        """
+        Re-orders the search results that have been retrieved by their relevance to the question
+        (results on pages that are retrieved later are added after these).
+
+        Arguments:
+            question_ranker (QuestionRanker): The ranker scoring the results against the question
+            question (str): The question that was asked
+
+        See:
+            |  ```questionranking.QuestionRanker```
+
+        """
+        self.__result_list.set_loaded_results(question_ranker.rank(self.__result_list.get_loaded_results(), question))
+
     def get_question_data(self, index=int):
         """
-        Retrieves the Question object from the result list. The Question object
-        is based on the JSON model found in the stackexchange library.
+        Retrieves the answers to the Question object at the given index in the result list.
+        If the answers have been prefetched (see ```prefetch_answers```), no request is made to the API.
 
         Arguments:
             index: Index of question object to retrieve
 
         Returns:
-            list:
+            list: List of ```StackExchangeAnswer```
 
         """
-        site = self.__site
-        site.be_inclusive()
         question_obj = self.__result_list[index]
-        q_id = question_obj.get_question_id()
-        question = site.question(q_id)
-        answer_list = question.answers
-        return answer_list
+        if question_obj.get_answers() is None:
+            self.__fetch_answers([question_obj])
+        return question_obj.get_answers()
+
+    def prefetch_answers(self, number_of_questions=int):
+        """
+        Retrieves the answers for the first ```number_of_questions``` questions in the result list
+        in one (batched) request, and stores them on the Question objects. This means that looking
+        at the answers of another result does not require another request. The cached search results
+        are updated, so that the answers are cached together with the questions.
+
+        Arguments:
+            number_of_questions (int): The number of questions to retrieve answers for
+
+        See:
+            |  https://api.stackexchange.com/docs/answers-on-questions
+
+        """
+        question_list = [question_obj for question_obj in self.__result_list[:number_of_questions]
+                         if question_obj.get_answers() is None]
+        if len(question_list) == 0:
+            return
+        self.__fetch_answers(question_list)
+        if self.__last_search is not None:
+            question, use_adv_search = self.__last_search
+            self.__search_cache.put(self.__site_name, question, use_adv_search,
+                                    self.__result_list.get_loaded_results())
+
+    def __fetch_answers(self, question_list=list):
+        """
+        Retrieves the answers for the given questions. The API accepts up to 100 semicolon-separated
+        question IDs, so all the answers are retrieved in one request (unless there are more answers
+        than fit on one page, in which case the remaining pages are retrieved as well).
+
+        Arguments:
+            question_list (list): List of ```StackExchangeQuestions``` to retrieve the answers for
+
+        """
+        answer_dict = dict((question_obj.get_question_id(), list()) for question_obj in question_list)
+        question_ids = ";".join([str(question_id) for question_id in answer_dict])
+        parameters = {
+            'filter': self.__site.get_filter(self.__ANSWER_FILTER_FIELDS, self.__ANSWER_FALLBACK_FILTER),
+            'pagesize': self.__ANSWER_PAGE_SIZE,
+            'sort': 'votes'
+        }
+        answers = self.__site.build('questions/' + question_ids + '/answers', stackexchange.Answer, 'answers',
+                                    parameters)
+        for answer in answers:
+            owner = self.__is_key_in_json('owner', answer.json)
+            reputation = self.NO_KEY_VALUE_FOR_ENTRY
+            if owner != self.NO_KEY_VALUE_FOR_ENTRY:
+                reputation = self.__is_key_in_json('reputation', owner)
+            answer_obj = StackExchangeAnswer(answer.id, answer.question_id, getattr(answer, 'body', ""), answer.score,
+                                             answer.is_accepted, answer.creation_date, reputation)
+            answer_dict[answer.question_id].append(answer_obj)
+        for question_obj in question_list:
+            question_obj.set_answers(answer_dict[question_obj.get_question_id()])
 
     def __is_key_in_json(self, key=str, json_dict=json):
         """
@@ -181,15 +318,17 @@ class SearchStackExchange:
         else:
             return self.NO_KEY_VALUE_FOR_ENTRY
 
-    @staticmethod
-    def __use_debugging():
-        stackexchange.impose_throttling = True
-        stackexchange.throttle_stop = False
-        stackexchange.web.WebRequestManager.debug = True
+    def __get_search_filter(self):
+        """
+        Returns the filter used for the search (created once, see ```RateLimitedSite.get_filter```)
+        """
+        return self.__site.get_filter(self.__SEARCH_FILTER_FIELDS, self.__SEARCH_FALLBACK_FILTER)
 
-    def __convert_user_input_to_stackexchange_site(self, site_name=str):
+    @staticmethod
+    def __convert_user_input_to_stackexchange_site(site_name=str):
         """
-        Returns the StackExchange site based on ```site_name```
+        Returns the StackExchange site based on ```site_name```. The site is shared by all searches
+        in the process (see ```stackexchangesite.get_site```).
 
         Arguments:
             site_name (str): Name of site to convert to StackExchange.Site.
@@ -197,27 +336,134 @@ class SearchStackExchange:
                 Example: "StackOverflow"
 
         Returns:
-            stackexchange.Site: The selected StackExchange site
+            RateLimitedSite: The selected StackExchange site (requests are rate limited, see ```ratelimiter```)
 
         Raises:
             AttributeError: Error if site name is not found
 
         """
-        selected_site = getattr(stackexchange.sites, site_name)
-        selected_site = stackexchange.Site(selected_site, self.__STACK_EXCHANGE_KEY)
-        return selected_site
+        return get_site(site_name)
+
+
+class LazySearchResults(object):
+    """
+    List of search results (```StackExchangeQuestions```), where the result pages after the first are retrieved
+    from StackExchange and converted when they are accessed. A page is retrieved when an index past the results
+    that already are loaded is accessed, and each page is only retrieved once. Taking the length (or
+    accessing a negative index) retrieves all the pages, up to ```max_results```.
+    """
+
+    def __init__(self, results=None, first_page=None, convert=None, max_results=None):
+        """
+        Constructor for the lazy search results
+
+        Arguments:
+            results (list): Results that already are converted (e.g. cached results)
+            first_page (stackexchange.StackExchangeResultset): The first page of the search
+            convert (function): Function converting an item of a page to ```StackExchangeQuestions```
+            max_results (int): The maximum number of results (None: no limit)
+
+        """
+        self.__results = list(results) if results is not None else list()
+        self.__pending_page = first_page  # page that has been retrieved, but not converted
+        self.__last_page = None  # the last page that was converted
+        self.__convert = convert
+        self.__max_results = max_results
+        # the first page is converted right away, the following pages when they are accessed
+        self.__load(1)
+
+    def get_loaded_results(self):
+        """
+        Returns the results that have been loaded, without retrieving more pages
+
+        Returns:
+            list: List of ```StackExchangeQuestions```
+
+        """
+        return list(self.__results)
+
+    def set_loaded_results(self, results=list):
+        """
+        Replaces the results that have been loaded (e.g. with the same results in another order)
+
+        Arguments:
+            results (list): List of ```StackExchangeQuestions```
+
+        """
+        self.__results[:] = results
 
+    def is_complete(self):
+        """
+        Returns:
+            bool: True if all the results have been loaded
+        """
+        return self.__pending_page is None and not self.__has_more_pages()
 
-class StackExchangeUser(object):
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.stop is None or index.stop < 0 or (index.start or 0) < 0:
+                self.__load()
+            else:
+                self.__load(index.stop)
+        elif index < 0:
+            self.__load()
+        else:
+            self.__load(index + 1)
+        return self.__results[index]
+
+    def __len__(self):
+        self.__load()
+        return len(self.__results)
+
+    def __iter__(self):
+        index = 0
+        while True:
+            self.__load(index + 1)
+            if index >= len(self.__results):
+                return
+            yield self.__results[index]
+            index += 1
+
+    def __load(self, count=None):
+        """
+        Converts pages (and retrieves the next pages) until ```count``` results are loaded
+
+        Arguments:
+            count (int): The number of results needed (None: all)
+
+        """
+        if count is None or (self.__max_results is not None and count > self.__max_results):
+            count = self.__max_results
+        while count is None or len(self.__results) < count:
+            if self.__pending_page is None:
+                if not self.__has_more_pages():
+                    return
+                self.__pending_page = self.__last_page.fetch_next()
+            page = self.__pending_page
+            self.__pending_page = None
+            self.__last_page = page
+            items = page.items
+            if self.__max_results is not None:
+                items = items[:self.__max_results - len(self.__results)]
+            self.__results.extend([self.__convert(item) for item in items])
+
+    def __has_more_pages(self):
+        """
+        Returns True if there are more pages to retrieve (and room for more results)
+        """
+        if self.__last_page is None or not self.__last_page.has_more:
+            return False
+        return self.__max_results is None or len(self.__results) < self.__max_results
+
+
+class StackExchangeUser(Record):
     """
-    Object class for creating objects of the ```owner``` data retrieved from StackExchange.
+    Record of the ```owner``` data retrieved from StackExchange.
     """
 
-    __display_name = None  # str
-    __link = None  # str/url
-    __reputation = None  # int
-    __user_id = None  # int
-    __user_type = None  # str
+    __slots__ = ('__display_name', '__link', '__reputation', '__user_id', '__user_type')
+
+    FIELDS = ('display_name', 'link', 'reputation', 'user_id', 'user_type')
 
     def __init__(self, display_name=str, link=str, reputation=int, user_id=int, user_type=str):
         """
@@ -252,25 +498,103 @@ class StackExchangeUser(object):
     def get_user_type(self):
         return self.__user_type
 
+    def _get_values(self):
+        return self.__display_name, self.__link, self.__reputation, self.__user_id, self.__user_type
+
 
-class StackExchangeQuestions(object):
+class StackExchangeAnswer(Record):
     """
-    Object class for creating objects of the questions retrieved from StackExchange.
+    Record of the answers retrieved from StackExchange.
     """
 
-    __accepted_answer_id = None  # int
-    __answer_count = None  # int
-    __creation_date = None  # date (unix epoch time)
-    __is_answered = None  # bool
-    __link = None  # str (url)
-    __question_id = None  # int
-    __score = None  # int
-    __title = None  # string
-    __view_count = None  # int
-    __user = None  # object (Owner)
+    __slots__ = ('__answer_id', '__question_id', '__body', '__score', '__is_accepted', '__creation_date',
+                 '__owner_reputation', '__body_terms')
+
+    FIELDS = ('answer_id', 'question_id', 'body', 'score', 'is_accepted', 'creation_date', 'owner_reputation')
+
+    def __init__(self, answer_id=int, question_id=int, body=str, score=int, is_accepted=bool, creation_date=None,
+                 owner_reputation=int):
+        """
+        Constructs an object of the Answer found at StackExchange
+
+        Arguments:
+        answer_id (int):
+        question_id (int): The ID of the question this answer belongs to
+        body (str): The answer (html)
+        score (int):
+        is_accepted (bool):
+        creation_date (date):
+        owner_reputation (int): The reputation of the user that posted the answer
+
+        """
+        self.__answer_id = answer_id
+        self.__question_id = question_id
+        self.__body = body
+        self.__score = score
+        self.__is_accepted = is_accepted
+        self.__creation_date = creation_date
+        self.__owner_reputation = owner_reputation
+        self.__body_terms = None
+
+    def get_answer_id(self):
+        return self.__answer_id
+
+    def get_question_id(self):
+        return self.__question_id
+
+    def get_body(self):
+        return self.__body
+
+    def get_score(self):
+        return self.__score
+
+    def get_is_accepted(self):
+        return self.__is_accepted
+
+    def get_creation_date(self):
+        return self.__creation_date
+
+    def get_owner_reputation(self):
+        return self.__owner_reputation
+
+    def get_body_terms(self):
+        """
+        Returns the terms in the body (without HTML and stop words). The terms are found the first time,
+        and kept on the record, so answers kept in the search cache are not tokenized again.
+
+        Returns:
+            frozenset: The terms (see ```textprocessing.tokenize```)
+
+        """
+        if self.__body_terms is None:
+            self.__body_terms = frozenset(tokenize(self.__body or u"", True))
+        return self.__body_terms
+
+    def _get_values(self):
+        return (self.__answer_id, self.__question_id, self.__body, self.__score, self.__is_accepted,
+                self.__creation_date, self.__owner_reputation)
+
+
+class StackExchangeQuestions(Record):
+    """
+    Record of the questions retrieved from StackExchange.
+    The answers are set once, when they are retrieved (see ```set_answers```).
+    """
+
+    __slots__ = ('__accepted_answer_id', '__answer_count', '__creation_date', '__is_answered', '__link',
+                 '__question_id', '__score', '__title', '__view_count', '__user', '__body', '__answers')
+
+    FIELDS = ('accepted_answer_id', 'answer_count', 'creation_date', 'is_answered', 'link', 'question_id', 'score',
+              'title', 'view_count', 'user', 'body', 'answers')
+
+    NESTED_FIELDS = {
+        'user': (StackExchangeUser, False),
+        'answers': (StackExchangeAnswer, True)
+    }
 
     def __init__(self, accepted_answer_id=int, answer_count=int, creation_date=str, is_answered=bool,
-                 link=str, question_id=int, score=int, title=str, view_count=int, user=StackExchangeUser):
+                 link=str, question_id=int, score=int, title=str, view_count=int, user=StackExchangeUser, body=None,
+                 answers=None):
         """
         Constructs an object of the Question found at StackExchange
         
@@ -279,14 +603,14 @@ class StackExchangeQuestions(object):
         answer_count (int):
         creation_date (str):
         is_answered (bool):
-        last_activity_date (str):
-        last_edit_date (str):
         link (str):
         question_id (int):
         score (int):
         title (str):
         view_count (int):
-        owner (Owner):
+        user (StackExchangeUser): The owner of the question (None if the question has no owner)
+        body (str): The question (html), if it was retrieved
+        answers (list): List of ```StackExchangeAnswer```, if they were retrieved
         
         """
         self.__accepted_answer_id = accepted_answer_id
@@ -299,6 +623,8 @@ class StackExchangeQuestions(object):
         self.__title = title
         self.__view_count = view_count
         self.__user = user
+        self.__body = body
+        self.__answers = answers
 
     def get_accepted_answer_id(self):
         return self.__accepted_answer_id
@@ -329,3 +655,17 @@ class StackExchangeQuestions(object):
 
     def get_user(self):
         return self.__user
+
+    def get_body(self):
+        return self.__body
+
+    def get_answers(self):
+        return self.__answers
+
+    def set_answers(self, answers=list):
+        self.__answers = answers
+
+    def _get_values(self):
+        return (self.__accepted_answer_id, self.__answer_count, self.__creation_date, self.__is_answered, self.__link,
+                self.__question_id, self.__score, self.__title, self.__view_count, self.__user, self.__body,
+                self.__answers)
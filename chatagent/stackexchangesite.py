@@ -0,0 +1,286 @@
+import re
+import threading
+import time
+import urllib
+
+import requests
+import stackexchange
+from requests.adapters import HTTPAdapter
+
+import dbconfig as config
+from instrumentation import get_metrics
+from ratelimiter import RateLimitExceededError, SingleFlight, get_rate_limiter
+
+"""
+This file contains the StackExchange site used for all requests to the StackExchange API.
+
+```RateLimitedSite``` extends ```stackexchange.Site```, so that every request made by py-stackexchange
+goes through the process-wide rate limiter (see ```ratelimiter.RateLimiter```):
+    - a request waits until it is allowed by the daily quota and the requests per second, instead of failing
+    - the 'backoff' field in the response is honoured for the following requests to the same method
+      (py-stackexchange creates a new request manager per request, so its own backoff is never used)
+    - identical requests made at the same time (e.g. many students asking the same question) share one request
+
+The requests are sent through a ```requests.Session``` kept by the site, instead of the request manager of
+py-stackexchange (which opens a new connection for every request, and keeps every response in an unbounded
+cache). The session keeps the connections alive between requests, and the responses are compressed (gzip).
+There is one site per site name in the process (see ```get_site```), and the sites listed in the config file
+are created when the module is imported, so that no set-up is done when a question is asked.
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+
+class RateLimitedSite(stackexchange.Site):
+    """
+    StackExchange site where the requests to the API are rate limited and coalesced.
+    """
+
+    __single_flight = SingleFlight()
+    """
+    Identical requests in progress, shared by all sites in the process
+    """
+
+    __filters = dict()
+    """
+    The filters created by ```get_filter```, shared by all sites in the process (filters are not site-specific)
+    """
+
+    __filter_retry_times = dict()
+    """
+    When creating a filter that failed can be tried again (unix epoch time), by the fields of the filter
+    """
+
+    __filters_in_progress = set()
+    """
+    The filters being created (other requests use the fallback meanwhile), by the fields of the filter
+    """
+
+    __filters_lock = threading.Lock()
+
+    __FILTER_RETRY_INTERVAL = 300
+    """
+    The number of seconds the fallback is used after creating a filter failed, before it is tried again
+    """
+
+    WRAPPER_FIELDS = ('.backoff', '.error_id', '.error_message', '.error_name', '.has_more', '.items',
+                      '.quota_max', '.quota_remaining')
+    """
+    The fields of the response wrapper that are included in every filter (needed by py-stackexchange and the limiter)
+    """
+
+    DEFAULT_API_ROOT = "https://api.stackexchange.com/"
+    """
+    The default root URL of the API (the API version and method are added to it)
+    """
+
+    DEFAULT_TIMEOUT = 10
+    """
+    The default number of seconds to wait for a response from the API
+    """
+
+    DEFAULT_POOL_SIZE = 10
+    """
+    The default number of connections kept alive to the API
+    """
+
+    def __init__(self, domain=str, app_key=None, api_root=DEFAULT_API_ROOT, timeout=DEFAULT_TIMEOUT,
+                 pool_size=DEFAULT_POOL_SIZE):
+        """
+        Constructor for the rate limited StackExchange site
+
+        Arguments:
+            domain (str): The domain of the site, e.g. ```stackexchange.sites.StackOverflow```
+            app_key (str): Key for the StackExchange API
+            api_root (str): The root URL of the API (e.g. a local server when testing)
+            timeout (float): The number of seconds to wait for a response
+            pool_size (int): The number of connections kept alive to the API
+
+        """
+        # the responses are not cached by py-stackexchange (see ```searchcache``` for cached search results)
+        stackexchange.Site.__init__(self, domain, app_key, 0)
+        self.__rate_limiter = get_rate_limiter()
+        self.__api_root = api_root.rstrip("/") + "/"
+        self.__timeout = timeout
+        self.__session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.__session.mount("http://", adapter)
+        self.__session.mount("https://", adapter)
+        self.__session.headers['Accept-Encoding'] = "gzip"
+
+    def _request(self, to, params):
+        """
+        Makes the request to the API (see ```stackexchange.Site._request```) when the rate limiter allows it.
+        If the same request already is in progress, its response is returned instead.
+
+        Arguments:
+            to (str): The API method, e.g. 'search' or 'questions/1;2/answers'
+            params (dict): The parameters of the request
+
+        Returns:
+            dict: The JSON response
+
+        Raises:
+            RateLimitExceededError: If the request could not be made within the maximum waiting time
+
+        """
+        params['site'] = params.get('site', self.root_domain)
+        request_key = (to, tuple(sorted((key, repr(value)) for key, value in params.items())))
+        return self.__single_flight.do(request_key, lambda: self.__make_request(to, params))
+
+    def __make_request(self, to=str, params=dict):
+        """
+        Waits for the rate limiter, makes the request, and registers the backoff and remaining quota of the response
+        """
+        method = self.__get_method_name(to)
+        with get_metrics().timer("rate_limit_wait"):
+            self.__rate_limiter.acquire(method)
+        response = self.__send_request(to, params)
+        if 'backoff' in response:
+            self.__rate_limiter.set_backoff(method, response['backoff'])
+        if 'quota_remaining' in response:
+            self.__rate_limiter.set_quota_remaining(response['quota_remaining'])
+        return response
+
+    def __send_request(self, to=str, params=dict):
+        """
+        Sends the request through the session of the site, and returns the JSON response.
+        The parameters are converted the same way as in ```stackexchange.Site._request```.
+
+        Raises:
+            stackexchange.StackExchangeError: If the API returned an error, or could not be reached
+
+        """
+        request_params = dict()
+        for key, value in params.items():
+            if value is None:
+                continue
+            if key in ('fromdate', 'todate'):
+                request_params[key] = str(int(value))
+            else:
+                request_params[key] = self._kw_to_str(value)
+        if self.app_key is not None:
+            request_params['key'] = self.app_key
+        path = "/".join([urllib.quote(part) for part in to.split("/")])
+        url = self.__api_root + self.api_version + "/" + path
+        metrics = get_metrics()
+        metrics.increment("api_requests", {'method': self.__get_method_name(to)})
+        try:
+            with metrics.timer("api_request"):
+                http_response = self.__session.get(url, params=request_params, timeout=self.__timeout)
+                response = http_response.json()
+        except (requests.RequestException, ValueError), err:
+            metrics.increment("api_errors", {'method': self.__get_method_name(to)})
+            raise stackexchange.StackExchangeError(stackexchange.StackExchangeError.UNKNOWN, "request_failed",
+                                                   str(err))
+        if http_response.status_code != 200:
+            metrics.increment("api_errors", {'method': self.__get_method_name(to)})
+            raise stackexchange.StackExchangeError(response.get('error_id', stackexchange.StackExchangeError.UNKNOWN),
+                                                   response.get('error_name'), response.get('error_message'))
+        if 'quota_remaining' in response and 'quota_max' in response:
+            self.rate_limit = (response['quota_remaining'], response['quota_max'])
+            self.requests_used = self.rate_limit[1] - self.rate_limit[0]
+            self.requests_left = self.rate_limit[0]
+        return response
+
+    def get_filter(self, include=tuple, fallback=str):
+        """
+        Returns the filter that includes only the given fields (and ```WRAPPER_FIELDS```).
+        The filter is created with the API the first time it is used, and is reused for the rest of the process.
+        While the filter is being created, or if it cannot be created, ```fallback``` is returned (creating it
+        is tried again after ```__FILTER_RETRY_INTERVAL``` seconds).
+
+        Arguments:
+            include (tuple): The fields to include, e.g. ('question.title', 'question.link')
+            fallback (str): The filter to use if the filter cannot be created, e.g. 'default'
+
+        Returns:
+            str: The filter
+
+        See:
+            |  https://api.stackexchange.com/docs/filters
+            |  https://api.stackexchange.com/docs/create-filter
+
+        """
+        include = tuple(include)
+        created_filter = self.__filters.get(include)
+        if created_filter is not None:
+            return created_filter
+        with self.__filters_lock:
+            if include in self.__filters:
+                return self.__filters[include]
+            if include in self.__filters_in_progress or self.__filter_retry_times.get(include, 0) > time.time():
+                return fallback
+            self.__filters_in_progress.add(include)
+        # the lock is not held while waiting for the limiter and the API
+        created_filter = None
+        try:
+            params = {'include': ";".join(self.WRAPPER_FIELDS + include), 'base': 'none', 'unsafe': 'false'}
+            self.__rate_limiter.acquire('filters/create')
+            response = self.__send_request('filters/create', params)
+            created_filter = response['items'][0]['filter']
+        except (stackexchange.StackExchangeError, RateLimitExceededError, KeyError, IndexError), err:
+            print("StackExchangeError (Create filter): %s", err)
+        finally:
+            with self.__filters_lock:
+                self.__filters_in_progress.discard(include)
+                if created_filter is not None:
+                    self.__filters[include] = created_filter
+                    self.__filter_retry_times.pop(include, None)
+                else:
+                    self.__filter_retry_times[include] = time.time() + self.__FILTER_RETRY_INTERVAL
+        if created_filter is None:
+            return fallback
+        return created_filter
+
+    @staticmethod
+    def __get_method_name(to=str):
+        """
+        Returns the name of the API method, where the IDs are left out
+        (the backoff applies to the method, e.g. 'questions/{ids}/answers', regardless of the IDs)
+        """
+        return "/".join(["{ids}" if re.match(r"^[\d;]+$", part) else part for part in to.split("/")])
+
+
+_STACK_EXCHANGE_KEY = "DMercir86DS8ZhXwHZ)vxg(("
+"""
+Key for StackExchange API, see: https://api.stackexchange.com/docs/authentication
+"""
+
+_sites = dict()
+_sites_lock = threading.Lock()
+
+
+def get_site(site_name=str):
+    """
+    Returns the StackExchange site with the given name. The site (and its connections) is shared by all
+    searches in the process, and is created the first time it is used (or when the module is imported,
+    if it is listed in ```stackexchange_parameters['preload_sites']``` in the config file).
+
+    Arguments:
+        site_name (str): Name of the site, e.g. "StackOverflow". Please note that this is case-sensitive.
+
+    Returns:
+        RateLimitedSite: The StackExchange site
+
+    Raises:
+        AttributeError: Error if site name is not found
+
+    """
+    site = _sites.get(site_name)
+    if site is None:
+        with _sites_lock:
+            site = _sites.get(site_name)
+            if site is None:
+                domain = getattr(stackexchange.sites, site_name)
+                site_parameters = getattr(config, 'stackexchange_parameters', dict())
+                site = RateLimitedSite(domain, _STACK_EXCHANGE_KEY,
+                                       site_parameters.get('api_root', RateLimitedSite.DEFAULT_API_ROOT),
+                                       site_parameters.get('timeout', RateLimitedSite.DEFAULT_TIMEOUT),
+                                       site_parameters.get('pool_size', RateLimitedSite.DEFAULT_POOL_SIZE))
+                _sites[site_name] = site
+    return site
+
+
+for _site_name in getattr(config, 'stackexchange_parameters', dict()).get('preload_sites', ["StackOverflow"]):
+    get_site(_site_name)
@@ -0,0 +1,458 @@
+import calendar
+import datetime
+import math
+import sqlite3
+import sys
+import threading
+from collections import Counter
+from xml.etree import cElementTree
+
+from searchstackexchange import StackExchangeAnswer, StackExchangeQuestions
+from textprocessing import tokenize
+
+"""
+This file contains an offline alternative to searching StackExchange through the API.
+
+The StackExchange data dumps (https://archive.org/details/stackexchange) contain all posts of a
+site in the file 'Posts.xml'. ```StackOverflowIndexBuilder``` streams this file into a local
+SQLite database with an inverted index of the (tokenized) titles and bodies of the questions,
+together with the scores and the accepted answers. ```LocalSearchStackExchange``` answers
+searches from this index, and can be used in place of ```SearchStackExchange``` (same functions),
+which means that the Chat Agent can be used without network access and without API throttling.
+
+The index is built by running this file:
+    python stackoverflowindex.py <path to Posts.xml> <path to index file>
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+
+class StackOverflowIndexBuilder(object):
+    """
+    Class for building the local search index from the 'Posts.xml' file in a StackExchange data dump.
+    The file is streamed (not loaded into memory), so that the index can be built from the full StackOverflow dump.
+    """
+
+    __QUESTION_POST_TYPE = "1"
+    __ANSWER_POST_TYPE = "2"
+    # the timestamp format used in the data dump, e.g. '2008-07-31T21:42:52.667' (milliseconds are ignored)
+    __DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+    __BATCH_SIZE = 5000
+    """
+    The number of posts that are inserted into the index in each transaction
+    """
+
+    def __init__(self, index_path=str):
+        """
+        Constructor for the index builder
+
+        Arguments:
+            index_path (str): Path to the SQLite file the index is written to. Any existing index is replaced.
+
+        """
+        self.__index_path = index_path
+
+    def build(self, posts_path=str):
+        """
+        Builds the index from the given 'Posts.xml' file.
+
+        Arguments:
+            posts_path (str): Path to the 'Posts.xml' file from the data dump
+
+        Returns:
+            tuple: (number of indexed questions, number of indexed answers)
+
+        """
+        connection = sqlite3.connect(self.__index_path)
+        try:
+            self.__create_tables(connection)
+            question_count, answer_count = self.__insert_posts(connection, posts_path)
+            self.__create_indexes(connection)
+        finally:
+            connection.close()
+        return question_count, answer_count
+
+    @staticmethod
+    def __create_tables(connection):
+        """
+        (Re-)creates the tables of the index. The indexes are created after the posts are inserted,
+        since inserting into indexed tables is a lot slower.
+        """
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        for table_name in ("questions", "answers", "postings", "terms", "metadata"):
+            connection.execute("DROP TABLE IF EXISTS " + table_name)
+        connection.execute("CREATE TABLE questions ("
+                           "question_id INTEGER PRIMARY KEY, "
+                           "title TEXT NOT NULL, "
+                           "body TEXT, "
+                           "score INTEGER NOT NULL, "
+                           "accepted_answer_id INTEGER, "
+                           "answer_count INTEGER NOT NULL, "
+                           "view_count INTEGER NOT NULL, "
+                           "creation_date INTEGER)")
+        connection.execute("CREATE TABLE answers ("
+                           "answer_id INTEGER PRIMARY KEY, "
+                           "question_id INTEGER NOT NULL, "
+                           "body TEXT, "
+                           "score INTEGER NOT NULL, "
+                           "creation_date INTEGER)")
+        # one row per term and question, for the title and the body respectively
+        connection.execute("CREATE TABLE postings ("
+                           "term TEXT NOT NULL, "
+                           "question_id INTEGER NOT NULL, "
+                           "in_title INTEGER NOT NULL, "
+                           "frequency INTEGER NOT NULL)")
+        connection.execute("CREATE TABLE terms ("
+                           "term TEXT PRIMARY KEY, "
+                           "document_frequency INTEGER NOT NULL)")
+        # statistics of the whole index (e.g. the number of questions), counted once when the index is built
+        connection.execute("CREATE TABLE metadata ("
+                           "name TEXT PRIMARY KEY, "
+                           "value REAL NOT NULL)")
+        connection.commit()
+
+    def __insert_posts(self, connection, posts_path):
+        """
+        Streams the posts from the XML file, and inserts them into the index in batches.
+
+        Returns:
+            tuple: (number of indexed questions, number of indexed answers)
+
+        """
+        question_count = 0
+        answer_count = 0
+        question_rows = list()
+        answer_rows = list()
+        posting_rows = list()
+        context = cElementTree.iterparse(posts_path, events=("start", "end"))
+        event, root = next(context)
+        for event, element in context:
+            if event != "end" or element.tag != "row":
+                continue
+            post_type = element.get("PostTypeId")
+            if post_type == self.__QUESTION_POST_TYPE:
+                question_id = int(element.get("Id"))
+                title = element.get("Title", u"")
+                body = element.get("Body", u"")
+                question_rows.append((question_id, title, body, int(element.get("Score", 0)),
+                                      self.__to_int(element.get("AcceptedAnswerId")),
+                                      int(element.get("AnswerCount", 0)), int(element.get("ViewCount", 0)),
+                                      self.__to_timestamp(element.get("CreationDate"))))
+                for term, frequency in Counter(tokenize(title)).iteritems():
+                    posting_rows.append((term, question_id, 1, frequency))
+                for term, frequency in Counter(tokenize(body, True)).iteritems():
+                    posting_rows.append((term, question_id, 0, frequency))
+                question_count += 1
+            elif post_type == self.__ANSWER_POST_TYPE:
+                answer_rows.append((int(element.get("Id")), int(element.get("ParentId")), element.get("Body", u""),
+                                    int(element.get("Score", 0)), self.__to_timestamp(element.get("CreationDate"))))
+                answer_count += 1
+            # free the memory used by the parsed elements
+            element.clear()
+            root.clear()
+            if len(question_rows) + len(answer_rows) >= self.__BATCH_SIZE:
+                self.__insert_batch(connection, question_rows, answer_rows, posting_rows)
+        self.__insert_batch(connection, question_rows, answer_rows, posting_rows)
+        return question_count, answer_count
+
+    @staticmethod
+    def __insert_batch(connection, question_rows, answer_rows, posting_rows):
+        """
+        Inserts the collected rows, and empties the lists
+        """
+        connection.executemany("INSERT INTO questions VALUES (?, ?, ?, ?, ?, ?, ?, ?)", question_rows)
+        connection.executemany("INSERT INTO answers VALUES (?, ?, ?, ?, ?)", answer_rows)
+        connection.executemany("INSERT INTO postings VALUES (?, ?, ?, ?)", posting_rows)
+        connection.commit()
+        del question_rows[:]
+        del answer_rows[:]
+        del posting_rows[:]
+
+    @staticmethod
+    def __create_indexes(connection):
+        """
+        Creates the indexes used for searching, and counts the document frequency of each term
+        and the statistics of the index (the number of questions, and the average title and body length)
+        """
+        connection.execute("CREATE INDEX postings_term_idx ON postings (term, in_title, question_id, frequency)")
+        connection.execute("CREATE INDEX answers_question_idx ON answers (question_id)")
+        connection.execute("INSERT INTO terms "
+                           "SELECT term, COUNT(DISTINCT question_id) FROM postings GROUP BY term")
+        number_of_questions = connection.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+        title_length, body_length = connection.execute("SELECT "
+                                                       "COALESCE(SUM(CASE in_title WHEN 1 THEN frequency END), 0), "
+                                                       "COALESCE(SUM(CASE in_title WHEN 0 THEN frequency END), 0) "
+                                                       "FROM postings").fetchone()
+        connection.executemany("INSERT INTO metadata VALUES (?, ?)",
+                               [("number_of_questions", number_of_questions),
+                                ("average_title_length", float(title_length) / max(number_of_questions, 1)),
+                                ("average_body_length", float(body_length) / max(number_of_questions, 1))])
+        connection.execute("ANALYZE")
+        connection.commit()
+
+    @staticmethod
+    def __to_int(value):
+        """
+        Converts the attribute value to int, or None if the attribute is not set
+        """
+        if value is None:
+            return None
+        return int(value)
+
+    def __to_timestamp(self, value):
+        """
+        Converts the date in the data dump to unix epoch time (UTC)
+        """
+        if value is None:
+            return None
+        date = datetime.datetime.strptime(value.split(".")[0], self.__DATE_FORMAT)
+        return calendar.timegm(date.timetuple())
+
+
+class LocalSearchStackExchange:
+    """
+    Class for searching the local index built by ```StackOverflowIndexBuilder```.
+    This class has the same functions as ```SearchStackExchange```, and can be used in its place.
+    """
+
+    __PAGE_SIZE = 100
+    """
+    The maximum number of questions returned by a search (the index is local, so all are returned at once)
+    """
+
+    __QUESTION_LINK = "http://stackoverflow.com/questions/%d"
+    """
+    The link to a question on StackOverflow (only the StackOverflow data dump is supported)
+    """
+
+    __UNKNOWN_REPUTATION = -1
+    """
+    The reputation of the users is not in the index (it is in 'Users.xml' in the data dump)
+    """
+
+    __local_connections = threading.local()
+    """
+    SQLite connections cannot be shared between threads, so each thread has its own connection(s)
+    """
+
+    __index_metadata = dict()
+    """
+    The statistics of each index (see ```StackOverflowIndexBuilder```), read once per process
+    """
+
+    __index_metadata_lock = threading.Lock()
+
+    def __init__(self, site_name=str, index_path=str):
+        """
+        Constructor for the class searching the local index
+
+        Arguments:
+            site_name (str): Name of the StackExchange community site (kept for compatibility with
+                ```SearchStackExchange```, the index contains the site it was built from)
+            index_path (str): Path to the SQLite file built by ```StackOverflowIndexBuilder```
+
+        """
+        self.__result_list = list()
+        self.__site_name = site_name
+        self.__index_path = index_path
+
+    def process_search_results_for_question(self, question=str, use_adv_search=bool):
+        """
+        Searches the local index for questions that matches the content of ```question```.
+        The default search only returns questions where all the words in ```question```
+        are in the title (same as ```intitle``` in the API), whereas the advanced search
+        returns the questions that have one or more of the words in either the title or the
+        body, ranked by TF-IDF (only questions with answers are returned).
+
+        Arguments:
+            question (str): The question to search for
+            use_adv_search (bool): Should the advanced search be used?
+
+        Returns:
+            bool: ```False```: search had no results (or failed).
+            ```True```: search was successful.
+
+        """
+        terms = sorted(set(tokenize(question)))
+        if len(terms) == 0:
+            return False
+        connection = self.__get_connection()
+        if use_adv_search:
+            rows = self.__search_title_and_body(connection, terms)
+        else:
+            rows = self.__search_title(connection, terms)
+        if len(rows) == 0:
+            return False
+        for row in rows:
+            question_id, title, score, accepted_answer_id, answer_count, view_count, creation_date, body = row
+            if accepted_answer_id is None:
+                accepted_answer_id = -1
+            question_obj = StackExchangeQuestions(accepted_answer_id, answer_count, self.__to_datetime(creation_date),
+                                                  answer_count > 0, self.__QUESTION_LINK % question_id, question_id,
+                                                  score, title, view_count, None, body)
+            self.__result_list.append(question_obj)
+        return True
+
+    def get_list_of_results(self):
+        """
+        Returns a list containing the data from the search
+
+        Returns:
+             list: List with search result data (```StackExchangeQuestions```)
+        """
+        return self.__result_list
+
+    def rank_results(self, question_ranker=object, question=str):
+        """
+        Re-orders the search results by their relevance to the question.
+
+        Arguments:
+            question_ranker (QuestionRanker): The ranker scoring the results against the question
+            question (str): The question that was asked
+
+        """
+        self.__result_list[:] = question_ranker.rank(self.__result_list, question)
+
+    def get_question_data(self, index=int):
+        """
+        Retrieves the answers to the question at the given index in the result list
+
+        Arguments:
+            index: Index of question object to retrieve
+
+        Returns:
+            list: List of ```StackExchangeAnswer```
+
+        """
+        question_obj = self.__result_list[index]
+        if question_obj.get_answers() is None:
+            self.__fetch_answers([question_obj])
+        return question_obj.get_answers()
+
+    def prefetch_answers(self, number_of_questions=int):
+        """
+        Retrieves the answers for the first ```number_of_questions``` questions in the result list,
+        and stores them on the Question objects (same as ```SearchStackExchange.prefetch_answers```)
+
+        Arguments:
+            number_of_questions (int): The number of questions to retrieve answers for
+
+        """
+        question_list = [question_obj for question_obj in self.__result_list[:number_of_questions]
+                         if question_obj.get_answers() is None]
+        if len(question_list) > 0:
+            self.__fetch_answers(question_list)
+
+    def __fetch_answers(self, question_list=list):
+        """
+        Retrieves the answers for the given questions from the index (ordered by score),
+        and stores them on the Question objects
+        """
+        question_dict = dict((question_obj.get_question_id(), question_obj) for question_obj in question_list)
+        answer_dict = dict((question_id, list()) for question_id in question_dict)
+        placeholders = ", ".join("?" * len(question_dict))
+        rows = self.__get_connection().execute("SELECT answer_id, question_id, body, score, creation_date "
+                                               "FROM answers WHERE question_id IN (" + placeholders + ") "
+                                               "ORDER BY score DESC", question_dict.keys())
+        for answer_id, question_id, body, score, creation_date in rows:
+            is_accepted = question_dict[question_id].get_accepted_answer_id() == answer_id
+            answer_dict[question_id].append(StackExchangeAnswer(answer_id, question_id, body, score, is_accepted,
+                                                                self.__to_datetime(creation_date),
+                                                                self.__UNKNOWN_REPUTATION))
+        for question_id, question_obj in question_dict.items():
+            question_obj.set_answers(answer_dict[question_id])
+
+    def __search_title(self, connection, terms):
+        """
+        Returns the questions that have all the terms in the title, ordered by score
+        """
+        placeholders = ", ".join("?" * len(terms))
+        query = "SELECT q.question_id, q.title, q.score, q.accepted_answer_id, q.answer_count, " \
+                "q.view_count, q.creation_date, q.body " \
+                "FROM questions q JOIN (" \
+                "SELECT question_id FROM postings " \
+                "WHERE in_title = 1 AND term IN (" + placeholders + ") " \
+                "GROUP BY question_id HAVING COUNT(*) = ?" \
+                ") matches ON matches.question_id = q.question_id " \
+                "ORDER BY q.score DESC LIMIT ?"
+        return connection.execute(query, terms + [len(terms), self.__PAGE_SIZE]).fetchall()
+
+    def __search_title_and_body(self, connection, terms):
+        """
+        Returns the answered questions that have one or more of the terms in the title or body, ranked by TF-IDF.
+        Terms in the title count twice as much as terms in the body.
+        """
+        placeholders = ", ".join("?" * len(terms))
+        number_of_questions = self.__get_metadata(connection)['number_of_questions']
+        term_weights = dict()
+        for term, document_frequency in connection.execute("SELECT term, document_frequency FROM terms "
+                                                           "WHERE term IN (" + placeholders + ")", terms):
+            term_weights[term] = math.log(float(number_of_questions) / document_frequency)
+        if len(term_weights) == 0:
+            return list()
+        weight_case = "CASE term " + " ".join(["WHEN ? THEN ?"] * len(term_weights)) + " END"
+        weight_args = [value for item in term_weights.items() for value in item]
+        query = "SELECT q.question_id, q.title, q.score, q.accepted_answer_id, q.answer_count, " \
+                "q.view_count, q.creation_date, q.body " \
+                "FROM questions q JOIN (" \
+                "SELECT question_id, SUM(frequency * (1 + in_title) * " + weight_case + ") AS relevance " \
+                "FROM postings WHERE term IN (" + placeholders + ") GROUP BY question_id" \
+                ") matches ON matches.question_id = q.question_id " \
+                "WHERE q.answer_count > 0 " \
+                "ORDER BY matches.relevance DESC LIMIT ?"
+        return connection.execute(query, weight_args + terms + [self.__PAGE_SIZE]).fetchall()
+
+    def __get_metadata(self, connection):
+        """
+        Returns the statistics of the index (read from the 'metadata' table the first time).
+        Indexes built before the table was added are counted instead.
+        """
+        metadata = self.__index_metadata.get(self.__index_path)
+        if metadata is not None:
+            return metadata
+        with self.__index_metadata_lock:
+            metadata = self.__index_metadata.get(self.__index_path)
+            if metadata is None:
+                try:
+                    metadata = dict(connection.execute("SELECT name, value FROM metadata").fetchall())
+                except sqlite3.OperationalError:
+                    metadata = dict()
+                if 'number_of_questions' not in metadata:
+                    metadata['number_of_questions'] = connection.execute("SELECT COUNT(*) "
+                                                                         "FROM questions").fetchone()[0]
+                metadata['number_of_questions'] = int(metadata['number_of_questions'])
+                self.__index_metadata[self.__index_path] = metadata
+        return metadata
+
+    def __get_connection(self):
+        """
+        Returns the connection to the index for the current thread (opened on first use)
+        """
+        connections = getattr(self.__local_connections, 'connections', None)
+        if connections is None:
+            connections = dict()
+            self.__local_connections.connections = connections
+        connection = connections.get(self.__index_path)
+        if connection is None:
+            connection = sqlite3.connect(self.__index_path)
+            connections[self.__index_path] = connection
+        return connection
+
+    @staticmethod
+    def __to_datetime(timestamp):
+        """
+        Converts the unix epoch time to datetime (same as the dates returned from the API)
+        """
+        if timestamp is None:
+            return None
+        return datetime.datetime.utcfromtimestamp(timestamp)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python stackoverflowindex.py <path to Posts.xml> <path to index file>")
+        sys.exit(1)
+    no_of_questions, no_of_answers = StackOverflowIndexBuilder(sys.argv[2]).build(sys.argv[1])
+    print("Indexed %d questions and %d answers" % (no_of_questions, no_of_answers))
@@ -41,6 +41,30 @@ function ChatAgentXBlock(runtime, element) {
      * @const
      */
     var HIDE_ANSWER = "Hide answer?";
+    /**
+     * Status returned while the answer to a question is being retrieved
+     * @type {string}
+     * @const
+     */
+    var JOB_PENDING = "pending";
+    /**
+     * Milliseconds before the first poll for the answer
+     * @type {number}
+     * @const
+     */
+    var POLL_INTERVAL = 250;
+    /**
+     * The maximum number of milliseconds between each poll for the answer
+     * @type {number}
+     * @const
+     */
+    var MAX_POLL_INTERVAL = 2000;
+    /**
+     * Milliseconds to wait for the answer before giving up
+     * @type {number}
+     * @const
+     */
+    var MAX_POLL_TIME = 60000;
     /**
      * The name of the currently active user of this application.
      * The value of USER_NAME is set in the function `getAndSetUsername`.
@@ -142,35 +166,61 @@ function ChatAgentXBlock(runtime, element) {
     /**
      * Processes the users input as a question,
      * and uses it to retrieve an answer from
-     * the given StackExchange site
+     * the given StackExchange site. The answer is retrieved
+     * in the background, so the returned job id is used
+     * to poll for the answer.
      * @param input {string} User input
      */
     function processUsersQuestion(input) {
-        var title = "";
-        var chatLog = "";
-        var response = "";
-        var readMore = "";
-        var containsHTML = false;
         //create JSON format for input
         var json_input = {'user_input': input};
         invoke('handle_user_input', json_input, function (data) {
-            title = data['title'];
-            response = data['response'];
-            readMore = data['read_more'];
-            containsHTML = data['contains_html'];
-            chatLog = CHAT_AGENT_NAME + title;
-            //does the response contain html? if so, convert to html
-            if (containsHTML) {
-                chatLog += $(response).html();
-            } else {
-                chatLog += response;
-            } //if
-            //using <br /> for extra space between question/answer
-            chatLog += readMore + "<br />";
-            $(CHATBOX_ID).append(chatLog);
+            pollForAnswer(data['job_id'], POLL_INTERVAL, 0);
         }); //invoke
     } //processUsersQuestion
 
+    /**
+     * Polls for the answer to the question with the given job id. The interval
+     * between each poll is doubled (up to MAX_POLL_INTERVAL) while the answer is pending.
+     * @param jobId {string} The id of the job retrieving the answer
+     * @param interval {number} Milliseconds to wait before polling
+     * @param elapsed {number} Milliseconds spent polling so far
+     */
+    function pollForAnswer(jobId, interval, elapsed) {
+        setTimeout(function () {
+            invoke('get_answer_result', {'job_id': jobId}, function (data) {
+                if (data['status'] != JOB_PENDING) {
+                    displayAnswer(data);
+                } else if (elapsed + interval >= MAX_POLL_TIME) {
+                    $(CHATBOX_ID).append(CHAT_AGENT_NAME + "Sorry, I could not find an answer in time." + HTML_NEWLINE);
+                } else {
+                    pollForAnswer(jobId, Math.min(interval * 2, MAX_POLL_INTERVAL), elapsed + interval);
+                } //if
+            }); //invoke
+        }, interval); //setTimeout
+    } //pollForAnswer
+
+    /**
+     * Displays the retrieved answer in the chatbox
+     * @param data {object} The result from `get_answer_result`
+     */
+    function displayAnswer(data) {
+        var title = data['title'];
+        var response = data['response'];
+        var readMore = data['read_more'];
+        var containsHTML = data['contains_html'];
+        var chatLog = CHAT_AGENT_NAME + title;
+        //does the response contain html? if so, convert to html
+        if (containsHTML) {
+            chatLog += $(response).html();
+        } else {
+            chatLog += response;
+        } //if
+        //using <br /> for extra space between question/answer
+        chatLog += readMore + "<br />";
+        $(CHATBOX_ID).append(chatLog);
+    } //displayAnswer
+
     /**
      * Invoke function for retrieving data from the Edx XBlock.
      * @param method {string} Name of function to call from XBlocks
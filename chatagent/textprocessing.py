@@ -0,0 +1,95 @@
+import cgi
+import re
+from HTMLParser import HTMLParser
+
+"""
+This file contains helper functions for processing text, such as removing HTML and splitting
+text (questions, titles and answers) into tokens for indexing and comparison.
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+_HTML_TAG_PATTERN = re.compile(r"<[^>]*>")
+"""
+Pattern matching HTML tags
+"""
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9_#+]+(?:[.\-][a-z0-9_#+]+)*")
+"""
+Pattern matching a single token. Tokens can contain '#' and '+' (e.g. 'c#' and 'c++'),
+and can be joined by '.' or '-' (e.g. 'node.js' and 'py-stackexchange')
+"""
+
+STOP_WORDS = frozenset([
+    'a', 'about', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'can', 'do', 'does', 'for', 'from',
+    'get', 'how', 'i', 'if', 'in', 'into', 'is', 'it', 'its', 'me', 'my', 'not', 'of', 'on', 'or', 'so',
+    'that', 'the', 'their', 'then', 'there', 'these', 'this', 'to', 'use', 'using', 'was', 'what', 'when',
+    'where', 'which', 'while', 'who', 'why', 'will', 'with', 'you', 'your'
+])
+"""
+Common words that are ignored when the text is tokenized
+"""
+
+NEGATION_WORDS = frozenset(['no', 'nor', 'not', 'never', 'without'])
+"""
+Words that reverse the meaning of a question (e.g. 'how to not sort a list'). They are ignored as stop words
+when searching, but must be kept when deciding if two questions are the same (see duplicatequestions.py)
+"""
+
+_html_parser = HTMLParser()
+
+
+def remove_html(text=str):
+    """
+    Removes the HTML tags from the text, and converts HTML entities (e.g. '&lt;') to characters
+
+    Arguments:
+        text (str): The text (e.g. the body of an answer)
+
+    Returns:
+        str: The text without HTML
+
+    """
+    if not text:
+        return u""
+    return _html_parser.unescape(_HTML_TAG_PATTERN.sub(u" ", text))
+
+
+def escape_html(text=str):
+    """
+    Escapes the text, so that it is shown as text in HTML (e.g. the question asked by a user).
+    HTML entities in the text (e.g. in the titles from StackExchange) are converted first, so they
+    are not escaped twice.
+
+    Arguments:
+        text (str): The text (UTF-8 if not unicode)
+
+    Returns:
+        unicode: The escaped text
+
+    """
+    if not text:
+        return u""
+    if isinstance(text, str):
+        text = text.decode("utf8", "replace")
+    return cgi.escape(_html_parser.unescape(text), True)
+
+
+def tokenize(text=str, contains_html=False, stop_words=STOP_WORDS):
+    """
+    Splits the text into a list of lower case tokens, where stop words are removed.
+
+    Arguments:
+        text (str): The text to tokenize
+        contains_html (bool): Should HTML be removed before the text is tokenized?
+        stop_words (frozenset): The words to remove (default: ```STOP_WORDS```)
+
+    Returns:
+        list: List of tokens (str), in the order they appear in the text
+
+    """
+    if not text:
+        return list()
+    if contains_html:
+        text = remove_html(text)
+    return [token for token in _TOKEN_PATTERN.findall(text.lower()) if token not in stop_words]
@@ -42,8 +42,11 @@ CREATE TABLE IF NOT EXISTS `s130533`.`tblChatQuestions` (
   `question_text` VARCHAR(250) NOT NULL,
   `asked_by_user` TINYINT(1) NULL,
   `fk_tblChatUsers` INT NOT NULL,
+  `question_hash` CHAR(40) NOT NULL COMMENT 'SHA1 of the lower case question_text',
   PRIMARY KEY (`chatQuestionID`),
   INDEX `fk_tblChatQuestions_tblChatUsers1_idx` (`fk_tblChatUsers` ASC),
+  UNIQUE INDEX `question_hash_UNIQUE` (`question_hash` ASC),
+  INDEX `user_asked_by_user_idx` (`fk_tblChatUsers` ASC, `asked_by_user` ASC, `edx_questionID` ASC),
   CONSTRAINT `fk_tblChatQuestions_tblChatUsers1`
     FOREIGN KEY (`fk_tblChatUsers`)
     REFERENCES `s130533`.`tblChatUsers` (`chatUserID`)
@@ -62,7 +65,10 @@ CREATE TABLE IF NOT EXISTS `s130533`.`tblStackExchange` (
   `stackexchangeID` INT NULL AUTO_INCREMENT,
   `stackexchange_link` LONGTEXT NOT NULL,
   `lookup_date` DATETIME NOT NULL,
-  PRIMARY KEY (`stackexchangeID`))
+  `stackexchange_link_hash` CHAR(40) NOT NULL COMMENT 'SHA1 of the stackexchange_link',
+  PRIMARY KEY (`stackexchangeID`),
+  UNIQUE INDEX `stackexchange_link_hash_UNIQUE` (`stackexchange_link_hash` ASC),
+  INDEX `lookup_date_idx` (`lookup_date` ASC))
 ENGINE = InnoDB
 COMMENT = 'StackExchange related information\n';
 
@@ -75,6 +81,7 @@ DROP TABLE IF EXISTS `s130533`.`tblChatAnswers` ;
 CREATE TABLE IF NOT EXISTS `s130533`.`tblChatAnswers` (
   `chatAnswersID` INT NULL AUTO_INCREMENT,
   `answer_text` LONGTEXT NOT NULL,
+  `answer_preview` TEXT NULL,
   `is_answer_read` TINYINT(1) NOT NULL,
   `correct_answer` TINYINT(1) NOT NULL,
   `fk_tblStackExchange` INT NOT NULL,
@@ -82,6 +89,8 @@ CREATE TABLE IF NOT EXISTS `s130533`.`tblChatAnswers` (
   PRIMARY KEY (`chatAnswersID`),
   INDEX `fk_tblChatAnswers_tblStackOverflow1_idx` (`fk_tblStackExchange` ASC),
   INDEX `fk_tblChatAnswers_tblChatQuestions1_idx` (`fk_tblChatQuestions` ASC),
+  INDEX `correct_answer_idx` (`correct_answer` ASC, `is_answer_read` ASC, `fk_tblChatQuestions` ASC, `fk_tblStackExchange` ASC),
+  INDEX `is_answer_read_idx` (`is_answer_read` ASC, `fk_tblChatQuestions` ASC, `fk_tblStackExchange` ASC),
   CONSTRAINT `fk_tblStackOverflow`
     FOREIGN KEY (`fk_tblStackExchange`)
     REFERENCES `s130533`.`tblStackExchange` (`stackexchangeID`)
@@ -143,11 +152,62 @@ DROP TABLE IF EXISTS `s130533`.`tblEdxQuestions` ;
 
 CREATE TABLE IF NOT EXISTS `s130533`.`tblEdxQuestions` (
   `edx_questionID` INT NOT NULL,
+  `course_id` VARCHAR(250) NULL,
   `question_text` LONGTEXT NOT NULL,
   `question_link` LONGTEXT NOT NULL,
-  PRIMARY KEY (`edx_questionID`))
+  PRIMARY KEY (`edx_questionID`),
+  INDEX `course_id_idx` (`course_id` ASC))
 ENGINE = InnoDB
-COMMENT = 'dummy table, not in use';
+COMMENT = 'questions of the edX courses';
+
+
+-- -----------------------------------------------------
+-- Table `s130533`.`tblEdxAnswers`
+-- -----------------------------------------------------
+DROP TABLE IF EXISTS `s130533`.`tblEdxAnswers` ;
+
+CREATE TABLE IF NOT EXISTS `s130533`.`tblEdxAnswers` (
+  `edx_questionID` INT NOT NULL,
+  `title` LONGTEXT NOT NULL,
+  `answer_text` LONGTEXT NOT NULL,
+  `answer_preview` TEXT NULL,
+  `fk_tblStackExchange` INT NOT NULL,
+  `computed_date` DATETIME NOT NULL,
+  PRIMARY KEY (`edx_questionID`),
+  INDEX `fk_tblEdxAnswers_tblStackExchange1_idx` (`fk_tblStackExchange` ASC),
+  CONSTRAINT `fk_tblEdxAnswers_tblEdxQuestions1`
+    FOREIGN KEY (`edx_questionID`)
+    REFERENCES `s130533`.`tblEdxQuestions` (`edx_questionID`)
+    ON DELETE CASCADE
+    ON UPDATE NO ACTION,
+  CONSTRAINT `fk_tblEdxAnswers_tblStackExchange1`
+    FOREIGN KEY (`fk_tblStackExchange`)
+    REFERENCES `s130533`.`tblStackExchange` (`stackexchangeID`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION)
+ENGINE = InnoDB
+COMMENT = 'answers to the edX questions, found in advance (see edxquestions.py)';
+
+
+-- -----------------------------------------------------
+-- Table `s130533`.`tblSchemaVersion`
+-- -----------------------------------------------------
+DROP TABLE IF EXISTS `s130533`.`tblSchemaVersion` ;
+
+CREATE TABLE IF NOT EXISTS `s130533`.`tblSchemaVersion` (
+  `version` INT NOT NULL,
+  `description` VARCHAR(250) NOT NULL,
+  `applied_date` DATETIME NOT NULL,
+  PRIMARY KEY (`version`))
+ENGINE = InnoDB
+COMMENT = 'applied schema migrations';
+
+-- this script creates the latest version, so all migrations (see chatagent/schemamigration.py) are marked as applied
+INSERT INTO `s130533`.`tblSchemaVersion` (`version`, `description`, `applied_date`) VALUES
+  (1, 'Hashed, unique lookup columns for question_text and stackexchange_link', NOW()),
+  (2, 'Covering indexes for filtering on user, date, correct_answer and is_answer_read', NOW()),
+  (3, 'Preview of the answer shown before \'read more\'', NOW()),
+  (4, 'Course of the edX questions, and their precomputed answers', NOW());
 
 
 SET SQL_MODE=@OLD_SQL_MODE;
@@ -37,7 +37,9 @@ setup(
     ],
     install_requires=[
         'XBlock',
-        'Py-StackExchange'
+        'Py-StackExchange',
+        'requests',
+        'numpy'
     ],
     entry_points={
         'xblock.v1': [
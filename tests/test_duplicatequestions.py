@@ -0,0 +1,57 @@
+import imp
+import os
+import sys
+import unittest
+
+"""
+This file contains the regression tests of the near-duplicate detection (see duplicatequestions.py):
+questions where the order of the words or a negation changes the meaning must not be answered as duplicates.
+
+The tests use the settings in dbconfig.py.example if the chat agent has no config file:
+    python -m unittest discover tests
+"""
+
+_author_ = "Knut Lucas Andersen"
+
+_PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, _PACKAGE_ROOT)
+if not os.path.exists(os.path.join(_PACKAGE_ROOT, "chatagent", "dbconfig.py")) \
+        and "chatagent.dbconfig" not in sys.modules:
+    _config = imp.new_module("chatagent.dbconfig")
+    execfile(os.path.join(_PACKAGE_ROOT, "chatagent", "dbconfig.py.example"), _config.__dict__)
+    sys.modules["chatagent.dbconfig"] = _config
+
+from chatagent.duplicatequestions import DuplicateQuestionIndex
+
+
+class DuplicateQuestionIndexTest(unittest.TestCase):
+    """
+    Tests of ```DuplicateQuestionIndex``` with the default threshold
+    """
+
+    def setUp(self):
+        self.index = DuplicateQuestionIndex()
+
+    def assert_not_duplicate(self, answered_question=str, question=str):
+        self.index.add(answered_question, {'title': answered_question})
+        self.assertIsNone(self.index.find(question))
+
+    def test_same_question_is_duplicate(self):
+        self.index.add("How do I sort a list in Python?", {'title': "sort"})
+        similarity, answer_dict = self.index.find("how to sort a list in python")
+        self.assertEqual(1.0, similarity)
+        self.assertEqual("sort", answer_dict['title'])
+
+    def test_word_order_is_not_duplicate(self):
+        self.assert_not_duplicate("convert string to int in java", "convert int to string in java")
+
+    def test_negation_is_not_duplicate(self):
+        self.assert_not_duplicate("how do I sort a list in python", "how do I not sort a list in python")
+
+    def test_added_word_is_not_duplicate(self):
+        self.assert_not_duplicate("how do I sort a list in python", "how to sort a list in python descending")
+
+
+if __name__ == "__main__":
+    unittest.main()